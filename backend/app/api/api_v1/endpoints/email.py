@@ -1,52 +1,21 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
-import redis
 import logging
 
 from app.core.database import get_db
 from app.core.deps import get_current_active_user
-from app.core.config import settings
 from app.services.email_service import EmailService
 from app.schemas.email_config import (
     EmailConfig, EmailConfigCreate, EmailConfigUpdate, 
     EmailConnectionTest, EmailScanResult, ManualScanRequest
 )
 from app.schemas.user import User
-from app.workers.email_tasks import manual_email_scan_task
+from app.workers.email_tasks import is_email_scan_running, manual_email_scan_task
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def get_email_scan_lock_key(user_id: int, config_id: int = None) -> str:
-    """生成邮箱扫描锁的Redis key"""
-    if config_id:
-        return f"email_scan_lock:user:{user_id}:config:{config_id}"
-    else:
-        return f"email_scan_lock:user:{user_id}:all"
-
-def is_email_scan_running(user_id: int, config_id: int = None) -> bool:
-    """检查是否有正在运行的邮箱扫描任务"""
-    try:
-        redis_client = redis.from_url(settings.REDIS_URL)
-        
-        # 检查指定配置的锁
-        if config_id:
-            specific_lock = get_email_scan_lock_key(user_id, config_id)
-            if redis_client.exists(specific_lock):
-                return True
-        
-        # 检查用户全局扫描锁
-        global_lock = get_email_scan_lock_key(user_id, None)
-        if redis_client.exists(global_lock):
-            return True
-            
-        return False
-        
-    except Exception as e:
-        logger.warning(f"检查邮箱扫描锁失败: {e}")
-        return False
-
 
 @router.post("", response_model=EmailConfig)
 def create_email_config(
@@ -65,7 +34,8 @@ def create_email_config(
             imap_port=config_data.imap_port,
             username=config_data.username,
             password=config_data.password,
-            scan_days=config_data.scan_days
+            scan_days=config_data.scan_days,
+            scan_folders=config_data.scan_folders
         )
         
         return config
@@ -13,12 +13,13 @@ from app.core.database import get_db
 from app.core.deps import get_current_active_user
 from app.core.config import settings, get_absolute_file_path, get_relative_file_path
 from app.services.invoice_service import InvoiceService
+from app.services.invoice_facet_service import InvoiceFacetService
 from app.schemas.invoice import (
     Invoice, InvoiceCreate, InvoiceUpdate, InvoiceFilter, 
-    PaginationParams, InvoiceListResponse, InvoiceUploadResponse, OCRRetryRequest
+    PaginationParams, InvoiceListResponse, InvoiceUploadResponse, OCRRetryRequest, InvoiceOCRResult
 )
 from app.schemas.user import User
-from app.workers.ocr_tasks import process_invoice_ocr
+from app.workers.ocr_tasks import enqueue_invoice_ocr
 from app.core.metrics import EMAIL_DUPLICATES
 from hashlib import md5, sha256
 from pydantic import BaseModel
@@ -131,7 +132,7 @@ async def upload_invoice(
         raise
     
     # 异步处理OCR（传递相对路径，让OCR任务根据运行环境转换）
-    process_invoice_ocr.delay(invoice.id, relative_file_path, current_user.id)
+    enqueue_invoice_ocr(invoice.id, relative_file_path, current_user.id)
     
     return InvoiceUploadResponse(
         id=invoice.id,
@@ -149,6 +150,8 @@ def get_invoices(
     include_duplicates: bool = Query(False, description="是否包含重复样本"),
     page: int = Query(1, ge=1, description="页码"),
     size: int = Query(20, ge=1, le=100, description="每页数量"),
+    cursor: Optional[str] = Query(None, description="分页游标（上一页的 next_cursor），提供时忽略页码"),
+    with_total: bool = Query(True, description="是否返回总数"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
@@ -162,18 +165,24 @@ def get_invoices(
         service_type=service_type
     )
     
-    pagination = PaginationParams(page=page, size=size)
+    pagination = PaginationParams(page=page, size=size, cursor=cursor, with_total=with_total)
     
-    invoices, total = invoice_service.get_invoices(current_user.id, filters, pagination, include_duplicates=include_duplicates)
+    try:
+        invoices, total, next_cursor = invoice_service.get_invoices(
+            current_user.id, filters, pagination, include_duplicates=include_duplicates
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     
-    pages = (total + size - 1) // size
+    pages = (total + size - 1) // size if total is not None else None
     
     return InvoiceListResponse(
         items=invoices,
         total=total,
         page=page,
         size=size,
-        pages=pages
+        pages=pages,
+        next_cursor=next_cursor
     )
 
 
@@ -190,6 +199,9 @@ class InvoiceSearchRequest(BaseModel):
     include_duplicates: bool = False
     page: int = 1
     size: int = 20
+    # 键集分页：上一页的 next_cursor，提供时忽略 page
+    cursor: Optional[str] = None
+    with_total: bool = True
 
 
 @router.post("/search", response_model=InvoiceListResponse)
@@ -212,16 +224,19 @@ def search_invoices(
         service_types=body.service_types,
     )
 
-    pagination = PaginationParams(page=body.page, size=body.size)
+    pagination = PaginationParams(page=body.page, size=body.size, cursor=body.cursor, with_total=body.with_total)
 
-    invoices, total = invoice_service.get_invoices(
-        current_user.id,
-        filters,
-        pagination,
-        include_duplicates=body.include_duplicates,
-    )
+    try:
+        invoices, total, next_cursor = invoice_service.get_invoices(
+            current_user.id,
+            filters,
+            pagination,
+            include_duplicates=body.include_duplicates,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    pages = (total + body.size - 1) // body.size
+    pages = (total + body.size - 1) // body.size if total is not None else None
 
     return InvoiceListResponse(
         items=invoices,
@@ -229,6 +244,7 @@ def search_invoices(
         page=body.page,
         size=body.size,
         pages=pages,
+        next_cursor=next_cursor,
     )
 
 
@@ -240,39 +256,32 @@ SERVICE_TYPE_OPTIONS = [
 
 @router.get("/filters/options")
 def get_invoice_filter_options(
+    rebuild: bool = Query(False, description="按发票重新聚合筛选项"),
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    """获取发票筛选器可选项（Excel 风格）"""
-    # 去重查询购方/销售方
-    from app.models.invoice import Invoice as InvoiceModel
-    seller_rows = (
-        db.query(InvoiceModel.seller_name)
-        .filter(InvoiceModel.user_id == current_user.id)
-        .filter(InvoiceModel.seller_name.isnot(None))
-        .distinct()
-        .order_by(InvoiceModel.seller_name.asc())
-        .all()
-    )
-    purchaser_rows = (
-        db.query(InvoiceModel.purchaser_name)
-        .filter(InvoiceModel.user_id == current_user.id)
-        .filter(InvoiceModel.purchaser_name.isnot(None))
-        .distinct()
-        .order_by(InvoiceModel.purchaser_name.asc())
-        .all()
-    )
-
-    sellers = [row[0] for row in seller_rows if row[0]]
-    purchasers = [row[0] for row in purchaser_rows if row[0]]
+    """获取发票筛选器可选项（Excel 风格），附各取值的发票数"""
+    options = InvoiceFacetService(db).get_options(current_user.id, rebuild=rebuild)
 
     return {
-        "sellers": sellers,
-        "purchasers": purchasers,
+        "sellers": list(options["seller"]),
+        "purchasers": list(options["purchaser"]),
         "service_types": SERVICE_TYPE_OPTIONS,
+        "counts": {
+            "sellers": options["seller"],
+            "purchasers": options["purchaser"],
+            "service_types": options["service_type"],
+        },
     }
 
 
+def _with_ocr_payload(schema, invoice, invoice_service: InvoiceService):
+    """成功的OCR结果存于 ocr_payloads，响应时按文件 sha256 补回 ocr_raw_data"""
+    result = schema.model_validate(invoice)
+    result.ocr_raw_data = invoice_service.get_ocr_payload(invoice)
+    return result
+
+
 @router.get("/{invoice_id}", response_model=Invoice)
 def get_invoice(
     invoice_id: str,
@@ -289,7 +298,26 @@ def get_invoice(
             detail="发票不存在"
         )
     
-    return invoice
+    return _with_ocr_payload(Invoice, invoice, invoice_service)
+
+
+@router.get("/{invoice_id}/ocr", response_model=InvoiceOCRResult)
+def get_invoice_ocr(
+    invoice_id: str,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """获取发票完整 OCR 识别数据（原始返回与商品明细，列表接口不再返回）"""
+    invoice_service = InvoiceService(db)
+    invoice = invoice_service.get_invoice(invoice_id, current_user.id)
+    
+    if not invoice:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="发票不存在"
+        )
+    
+    return _with_ocr_payload(InvoiceOCRResult, invoice, invoice_service)
 
 
 @router.put("/{invoice_id}", response_model=Invoice)
@@ -309,7 +337,7 @@ def update_invoice(
             detail="发票不存在"
         )
     
-    return invoice
+    return _with_ocr_payload(Invoice, invoice, invoice_service)
 
 
 @router.post("/{invoice_id}/retry-ocr")
@@ -342,7 +370,7 @@ def retry_ocr(
     db.commit()
     
     # 异步处理OCR（传递存储在数据库中的相对路径）
-    process_invoice_ocr.delay(invoice.id, invoice.file_path, current_user.id)
+    enqueue_invoice_ocr(invoice.id, invoice.file_path, current_user.id)
     
     return {"message": "OCR重试已启动"}
 
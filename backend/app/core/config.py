@@ -43,6 +43,11 @@ class Settings(BaseSettings):
     
     # Redis配置
     REDIS_URL: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    # 进程级共享连接池：连接上限、连接池耗尽时等待空闲连接的秒数、套接字超时、空闲连接健康检查间隔（秒）
+    REDIS_MAX_CONNECTIONS: int = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+    REDIS_POOL_TIMEOUT: float = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+    REDIS_SOCKET_TIMEOUT: float = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+    REDIS_HEALTH_CHECK_INTERVAL: int = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
     
     # CORS配置
     ALLOWED_HOSTS: List[str] = ["*"]  # 生产环境应该限制具体域名
@@ -52,21 +57,92 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = os.getenv("UPLOAD_DIR", os.path.abspath(os.path.join(os.getcwd(), "storage")))
     MAX_FILE_SIZE: int = int(os.getenv("MAX_FILE_SIZE", "10485760"))  # 10MB
     ALLOWED_FILE_TYPES: List[str] = ["pdf"]
+    # 发票列表游标翻页时复用的总数缓存有效期（秒），0 为每次精确计数
+    INVOICE_COUNT_CACHE_TTL: int = int(os.getenv("INVOICE_COUNT_CACHE_TTL", "60"))
+    INVOICE_FACET_CACHE_TTL: int = int(os.getenv("INVOICE_FACET_CACHE_TTL", "600"))  # 筛选项缓存有效期(秒)，写入后提交即失效，0 为不缓存
     
     # 百度OCR配置
     BAIDU_OCR_API_KEY: Optional[str] = os.getenv("BAIDU_OCR_API_KEY")
     BAIDU_OCR_SECRET_KEY: Optional[str] = os.getenv("BAIDU_OCR_SECRET_KEY")
+    # 可指向本地桩服务（测试/压测用），默认官方地址
+    BAIDU_OCR_BASE_URL: str = os.getenv("BAIDU_OCR_BASE_URL", "https://aip.baidubce.com")
     
     # OCR配置
     OCR_RETRY_TIMES: int = int(os.getenv("OCR_RETRY_TIMES", "3"))
     OCR_TIMEOUT: int = int(os.getenv("OCR_TIMEOUT", "30"))
     OCR_AMOUNT_IN_CENTS: bool = os.getenv("OCR_AMOUNT_IN_CENTS", "false").lower() == "true"
     OCR_QPS_LIMIT: int = int(os.getenv("OCR_QPS_LIMIT", "2"))
+    # 令牌桶限流：突发容量、活跃用户判定窗口(秒)、最长排队等待(秒)、用户权重("user_id:weight,...")
+    OCR_RATE_BURST: int = int(os.getenv("OCR_RATE_BURST", "1"))
+    OCR_RATE_ACTIVE_WINDOW: float = float(os.getenv("OCR_RATE_ACTIVE_WINDOW", "10"))
+    OCR_RATE_MAX_WAIT: float = float(os.getenv("OCR_RATE_MAX_WAIT", "30"))
+    OCR_USER_WEIGHTS: str = os.getenv("OCR_USER_WEIGHTS", "")
+    OCR_HTTP_POOL_SIZE: int = int(os.getenv("OCR_HTTP_POOL_SIZE", "10"))  # keep-alive 连接池大小
+    OCR_TOKEN_REFRESH_MARGIN: int = int(os.getenv("OCR_TOKEN_REFRESH_MARGIN", "86400"))  # 令牌提前刷新秒数
+    OCR_BODY_SPOOL_MAX_SIZE: int = int(os.getenv("OCR_BODY_SPOOL_MAX_SIZE", str(4 * 1024 * 1024)))  # 请求体超过该字节数落盘
+    # 识别引擎：baidu（仅远程，默认）、auto（先解析PDF文本层，缺必需字段再调用百度）、local（仅本地）
+    # 本地结果不含服务类型与商品金额，且不写入共享结果缓存
+    OCR_ENGINE: str = os.getenv("OCR_ENGINE", "baidu").lower()
+    OCR_LOCAL_MAX_PAGES: int = int(os.getenv("OCR_LOCAL_MAX_PAGES", "2"))  # 本地解析读取的最大页数
+    # 本地解析进程池：进程数（默认 1，即在当前进程内解析）、单文档超时(秒)、子进程处理多少份文档后回收
+    # 进程池面向单进程的批量识别 worker（-P solo / -P threads）；API 多 worker 部署下每个进程各建一池，保持默认
+    OCR_LOCAL_WORKERS: int = int(os.getenv("OCR_LOCAL_WORKERS", "1"))
+    OCR_LOCAL_TIMEOUT: float = float(os.getenv("OCR_LOCAL_TIMEOUT", "20"))
+    OCR_LOCAL_MAX_TASKS_PER_CHILD: int = int(os.getenv("OCR_LOCAL_MAX_TASKS_PER_CHILD", "200"))
+    # OCR结果分层缓存：进程内 LRU 条目数、Redis 缓存有效期(秒)，置 0 关闭对应层
+    OCR_CACHE_LRU_SIZE: int = int(os.getenv("OCR_CACHE_LRU_SIZE", "256"))
+    OCR_CACHE_REDIS_TTL: int = int(os.getenv("OCR_CACHE_REDIS_TTL", str(7 * 24 * 3600)))
+    # 批量OCR模式：由调度任务按批领取 pending 发票，替代每张发票一个任务
+    OCR_BATCH_MODE: bool = os.getenv("OCR_BATCH_MODE", "false").lower() == "true"
+    OCR_BATCH_SIZE: int = int(os.getenv("OCR_BATCH_SIZE", "20"))  # 每次领取的发票数
+    OCR_BATCH_CONCURRENCY: int = int(os.getenv("OCR_BATCH_CONCURRENCY", "4"))  # 批内并发线程数（总速率仍受令牌桶约束）
+    OCR_BATCH_INTERVAL: float = float(os.getenv("OCR_BATCH_INTERVAL", "10"))  # 调度周期(秒)
+    OCR_BATCH_STALE_SECONDS: int = int(os.getenv("OCR_BATCH_STALE_SECONDS", "600"))  # processing 超时后重新领取
+    # OCR结果迁入 ocr_payloads 的后台任务：每批行数、单个时间片秒数（到期后续投递）
+    OCR_PAYLOAD_MIGRATION_BATCH: int = int(os.getenv("OCR_PAYLOAD_MIGRATION_BATCH", "500"))
+    OCR_PAYLOAD_MIGRATION_SLICE_SECONDS: float = float(os.getenv("OCR_PAYLOAD_MIGRATION_SLICE_SECONDS", "60"))
+    # 名称/主题/日志检索使用 FULLTEXT(ngram) 索引（非 MySQL 为进程内倒排索引），false 时全部使用 LIKE
+    FULLTEXT_SEARCH_ENABLED: bool = os.getenv("FULLTEXT_SEARCH_ENABLED", "true").lower() == "true"
     
     # 邮箱配置
     DEFAULT_EMAIL_SERVER: str = os.getenv("DEFAULT_EMAIL_SERVER", "imap.gmail.com")
     DEFAULT_EMAIL_PORT: int = int(os.getenv("DEFAULT_EMAIL_PORT", "993"))
     EMAIL_ENCRYPTION_KEY: Optional[str] = os.getenv("EMAIL_ENCRYPTION_KEY")
+    # 邮箱扫描：每次 UID FETCH 的邮件数、预取块数（有界队列）、并发扫描的邮箱配置数
+    EMAIL_FETCH_CHUNK_SIZE: int = int(os.getenv("EMAIL_FETCH_CHUNK_SIZE", "50"))
+    EMAIL_FETCH_PREFETCH_CHUNKS: int = int(os.getenv("EMAIL_FETCH_PREFETCH_CHUNKS", "2"))
+    EMAIL_SCAN_CONCURRENCY: int = int(os.getenv("EMAIL_SCAN_CONCURRENCY", "4"))
+    # 扇出模式：每个邮箱配置一个 Celery 子任务（配置级锁），chord 回调汇总统计；扫描总耗时随 worker 数扩展
+    EMAIL_SCAN_FANOUT: bool = os.getenv("EMAIL_SCAN_FANOUT", "false").lower() == "true"
+    # 扫描的文件夹（逗号分隔，"*" 为按 LIST 与 special-use 标志自动发现），邮箱配置的 scan_folders 优先；
+    # 多个文件夹时每个配置并发使用的 IMAP 连接数
+    EMAIL_SCAN_FOLDERS: str = os.getenv("EMAIL_SCAN_FOLDERS", "INBOX")
+    EMAIL_FOLDER_CONCURRENCY: int = int(os.getenv("EMAIL_FOLDER_CONCURRENCY", "2"))
+    # 先抓取头部与 BODYSTRUCTURE，仅下载候选邮件的正文与 PDF 部件；关闭则整封抓取 RFC822
+    EMAIL_SCAN_HEADERS_FIRST: bool = os.getenv("EMAIL_SCAN_HEADERS_FIRST", "true").lower() == "true"
+    # 扫描时间片：单次任务最多扫描的秒数，到期在块边界停止并投递续扫（检查点每 EMAIL_FETCH_CHUNK_SIZE 封提交一次）；
+    # 任务软超时须大于时间片，硬超时为软超时 + 60 秒
+    EMAIL_SCAN_SLICE_SECONDS: float = float(os.getenv("EMAIL_SCAN_SLICE_SECONDS", "600"))
+    EMAIL_SCAN_SOFT_TIME_LIMIT: int = int(os.getenv("EMAIL_SCAN_SOFT_TIME_LIMIT", "900"))
+    # 服务端检索过滤：仅检索主题含发票关键词或带附件（multipart/mixed）的邮件，服务器不支持时自动回退
+    EMAIL_SEARCH_FILTER: bool = os.getenv("EMAIL_SEARCH_FILTER", "true").lower() == "true"
+    # PDF 附件按 BODY.PEEK[n]<offset.length> 分段抓取的字节数（解码后直接写入存储）
+    EMAIL_ATTACHMENT_FETCH_SIZE: int = int(os.getenv("EMAIL_ATTACHMENT_FETCH_SIZE", str(1024 * 1024)))
+    # 正文 PDF 链接异步下载：单主机并发、连接池上限、单次读写超时与单个链接总超时（秒）
+    EMAIL_LINK_PER_HOST_CONCURRENCY: int = int(os.getenv("EMAIL_LINK_PER_HOST_CONCURRENCY", "2"))
+    EMAIL_LINK_MAX_CONNECTIONS: int = int(os.getenv("EMAIL_LINK_MAX_CONNECTIONS", "16"))
+    EMAIL_LINK_TIMEOUT: float = float(os.getenv("EMAIL_LINK_TIMEOUT", "30"))
+    EMAIL_LINK_TOTAL_TIMEOUT: float = float(os.getenv("EMAIL_LINK_TOTAL_TIMEOUT", "120"))
+    # 下载链接指纹（规范化 URL -> sha256、ETag/Last-Modified）在 Redis 中的保留时间（秒），0 为仅用数据库
+    EMAIL_LINK_CACHE_TTL: int = int(os.getenv("EMAIL_LINK_CACHE_TTL", str(30 * 24 * 3600)))
+    # 定时扫描周期（秒）；启用 IMAP IDLE 监听（python -m app.workers.email_idle）后可调大作为兜底
+    EMAIL_SCAN_INTERVAL: float = float(os.getenv("EMAIL_SCAN_INTERVAL", str(30 * 60)))
+    # IDLE 监听：重新发起 IDLE 的周期、新邮件通知防抖、重连退避上限、配置刷新周期与套接字超时（秒）
+    EMAIL_IDLE_RENEW: float = float(os.getenv("EMAIL_IDLE_RENEW", str(25 * 60)))
+    EMAIL_IDLE_DEBOUNCE: float = float(os.getenv("EMAIL_IDLE_DEBOUNCE", "5"))
+    EMAIL_IDLE_RECONNECT_MAX: float = float(os.getenv("EMAIL_IDLE_RECONNECT_MAX", "300"))
+    EMAIL_IDLE_REFRESH_INTERVAL: float = float(os.getenv("EMAIL_IDLE_REFRESH_INTERVAL", "60"))
+    EMAIL_IDLE_SOCKET_TIMEOUT: float = float(os.getenv("EMAIL_IDLE_SOCKET_TIMEOUT", "60"))
     
     # 管理员配置
     ADMIN_USERNAME: str = os.getenv("ADMIN_USERNAME", "admin")
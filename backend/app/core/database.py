@@ -30,11 +30,15 @@ def get_db():
 def init_db():
     """初始化数据库表"""
     # 导入所有模型以确保它们被注册到Base.metadata
-    from app.models import user, invoice, attachment, email_config, system_log
+    from app.models import user, invoice, attachment, email_config, system_log, email, ocr_cache, link_cache, email_scan_cursor, ocr_payload, invoice_facet
     
     # 创建所有表
     Base.metadata.create_all(bind=engine)
     
+    # 为已有部署补齐新增的列与索引
+    from app.db.schema_upgrades import run_schema_upgrades
+    run_schema_upgrades(engine)
+    
     # 创建默认管理员用户
     from app.db.init_db import init_db as create_default_user
     create_default_user()
\ No newline at end of file
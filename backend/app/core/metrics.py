@@ -5,7 +5,7 @@ Prometheus metrics helpers with safe fallbacks when prometheus_client is unavail
 from typing import Any
 
 try:
-    from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+    from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
     PROMETHEUS_AVAILABLE = True
 except Exception:  # pragma: no cover - optional dependency
     PROMETHEUS_AVAILABLE = False
@@ -20,9 +20,18 @@ except Exception:  # pragma: no cover - optional dependency
         def observe(self, amount: float) -> None:
             return None
 
+        def set(self, value: float) -> None:
+            return None
+
+        def set_function(self, f: Any) -> None:
+            return None
+
     def Counter(name: str, documentation: str, labelnames: list[str] | None = None):  # type: ignore
         return _NoopMetric()
 
+    def Gauge(name: str, documentation: str, labelnames: list[str] | None = None):  # type: ignore
+        return _NoopMetric()
+
     def Histogram(name: str, documentation: str, buckets: tuple[float, ...] | None = None, labelnames: list[str] | None = None):  # type: ignore
         return _NoopMetric()
 
@@ -46,14 +55,26 @@ EMAILS_INVOICES_FOUND = Counter(
 EMAIL_DUPLICATES = Counter(
     "email_duplicates_total",
     "Total number of duplicates encountered during email pipeline",
-    ["type"],  # attachment, create_invoice, file_store_skip
+    ["type"],  # attachment, create_invoice, file_store_skip, link_cache
+)
+
+EMAIL_LINK_FETCHES = Counter(
+    "email_link_fetches_total",
+    "Email body PDF link fetches, labeled by outcome",
+    ["result"],  # duplicate_skipped, not_modified, downloaded, rejected
 )
 
 # OCR metrics
 OCR_REQUESTS_TOTAL = Counter(
     "ocr_requests_total",
     "Total number of OCR requests, labeled by result",
-    ["result"],  # reused_invoice, cache_hit, success, failed, error
+    ["result"],  # reused_invoice, cache_hit, local, success, failed, error
+)
+
+OCR_CACHE_LOOKUPS = Counter(
+    "ocr_cache_lookups_total",
+    "OCR result cache lookups by tier and outcome",
+    ["tier", "result"],  # tier: memory, redis, db; result: hit, miss
 )
 
 OCR_DURATION_SECONDS = Histogram(
@@ -63,3 +84,16 @@ OCR_DURATION_SECONDS = Histogram(
 )
 
 
+
+OCR_INVOICES_PROCESSED = Counter(
+    "ocr_invoices_processed_total",
+    "Total number of invoices finished by OCR workers, labeled by dispatch mode and result",
+    ["mode", "result"],  # mode: task, batch; result: success, failed, throttled, error
+)
+
+# Redis metrics
+REDIS_POOL_CONNECTIONS = Gauge(
+    "redis_pool_connections",
+    "Connections in the shared Redis pool of this process, labeled by state",
+    ["state"],  # created, in_use, idle, max
+)
@@ -0,0 +1,106 @@
+"""
+进程级共享 Redis 客户端
+所有服务通过同一个有界连接池访问 Redis：连接复用、空闲连接健康检查，fork 后（Celery prefork）在子进程内重建；
+连接池使用情况导出为 redis_pool_connections 指标，用于调整 REDIS_MAX_CONNECTIONS。
+"""
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+import redis
+
+from app.core.config import settings
+from app.core.metrics import REDIS_POOL_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[redis.Redis] = None
+_client_pid: Optional[int] = None
+_lock = threading.Lock()
+
+
+class CountingBlockingConnectionPool(redis.BlockingConnectionPool):
+    """自行统计已创建与借出连接的阻塞连接池，连接数指标不依赖 redis-py 的私有属性"""
+
+    def reset(self):
+        # 构造与 fork 后重建时都会调用，计数随连接列表一起清零
+        self._stats_lock = threading.Lock()
+        self._created = 0
+        self._in_use = set()
+        super().reset()
+
+    def make_connection(self):
+        connection = super().make_connection()
+        with self._stats_lock:
+            self._created += 1
+        return connection
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super().get_connection(command_name, *keys, **options)
+        with self._stats_lock:
+            self._in_use.add(id(connection))
+        return connection
+
+    def release(self, connection):
+        # 连接建立失败时父类 get_connection 也会调用 release，按连接标识去重，不会多减
+        with self._stats_lock:
+            self._in_use.discard(id(connection))
+        super().release(connection)
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            created, in_use = self._created, len(self._in_use)
+        return {"created": created, "in_use": in_use, "idle": max(0, created - in_use), "max": self.max_connections}
+
+
+def _build_pool() -> redis.BlockingConnectionPool:
+    # 连接数达到上限时等待空闲连接（最长 REDIS_POOL_TIMEOUT 秒），而不是立即报错
+    return CountingBlockingConnectionPool.from_url(
+        settings.REDIS_URL,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+        retry_on_timeout=True,
+    )
+
+
+def get_redis() -> redis.Redis:
+    """获取进程级共享 Redis 客户端"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _lock:
+            if _client is None or _client_pid != pid:
+                _client = redis.Redis(connection_pool=_build_pool())
+                _client_pid = pid
+    return _client
+
+
+def get_redis_pipeline(transaction: bool = False):
+    """共享连接池上的 pipeline：多条命令一次往返（默认不包 MULTI/EXEC）"""
+    return get_redis().pipeline(transaction=transaction)
+
+
+def redis_pool_stats() -> Dict[str, int]:
+    """当前进程连接池的连接数：已创建、使用中、空闲与上限"""
+    client = _client
+    if client is None or _client_pid != os.getpid():
+        return {"created": 0, "in_use": 0, "idle": 0, "max": settings.REDIS_MAX_CONNECTIONS}
+    return client.connection_pool.stats()
+
+
+def ping_redis() -> bool:
+    try:
+        return bool(get_redis().ping())
+    except Exception as e:
+        logger.warning(f"Redis 健康检查失败: {e}")
+        return False
+
+
+# 抓取指标时读取当前连接池状态
+for _state in ("created", "in_use", "idle", "max"):
+    REDIS_POOL_CONNECTIONS.labels(state=_state).set_function(lambda state=_state: redis_pool_stats()[state])
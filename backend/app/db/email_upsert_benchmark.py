@@ -0,0 +1,173 @@
+"""
+邮件记录写入基准：逐条写入（create_or_update_email，每封一次查询 + 一次提交）与
+按块批量 upsert（bulk_upsert_emails，每块一条 INSERT ... ON DUPLICATE KEY UPDATE + 一次提交）对比
+在 emails 表中以临时用户生成指定封数的扫描记录，分别测量首次写入与重复扫描（更新已有记录）两种情形的
+总耗时、每秒写入封数与执行的 SQL 语句数；结束后删除临时用户及其邮件记录（--keep 保留）。
+非 MySQL 数据库的批量写入回退为逐条写入，结果不代表生产性能（输出中 bulk_statement 为 per_row_fallback），
+对比数据须在 MySQL 上测得。
+
+运行：python -m app.db.email_upsert_benchmark --rows 5000
+（compose 部署：docker compose exec backend python -m app.db.email_upsert_benchmark --rows 5000）
+"""
+import argparse
+import json
+import logging
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import engine
+from app.models.email import Email
+from app.models.user import User
+from app.services.email_list_service import EMAIL_FAILURE_COLUMNS, EMAIL_ROW_DEFAULTS, EmailListService
+
+logger = logging.getLogger(__name__)
+
+BENCH_USER_PREFIX = "__email_upsert_bench_"
+
+_SENDERS = ["发票通知 <invoice@nuonuo.com>", "noreply@fapiao.jd.com", "财务部 <finance@example.com>",
+            "携程旅行 <service@ctrip.com>", "滴滴出行 <invoice@didiglobal.com>"]
+_SUBJECTS = ["您收到一张电子发票", "【电子发票】订单发票已开具", "差旅报销单据", "本月对账单", "会议通知"]
+
+
+def _email_rows(prefix: str, rows: int, seed: int, rescan: bool) -> List[Dict[str, Any]]:
+    """生成与扫描流程一致的邮件记录行；rescan 为 True 时模拟重复扫描后的扫描结果"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    result = []
+    for i in range(rows):
+        attachments = [
+            {"filename": f"发票_{i}_{n}.pdf", "content_type": "application/pdf",
+             "size": rng.randint(40000, 400000), "is_pdf": True}
+            for n in range(rng.randint(0, 2))
+        ]
+        result.append({
+            "message_id": f"<{prefix}-{i}@bench.local>",
+            "subject": rng.choice(_SUBJECTS),
+            "sender": rng.choice(_SENDERS),
+            "recipient": "user@example.com",
+            "date_sent": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+            "date_received": now,
+            "body_text": "您好，附件为本次消费的电子发票，请查收。" * rng.randint(5, 40),
+            "body_html": None,
+            "has_attachments": bool(attachments),
+            "attachment_count": len(attachments),
+            "attachment_info": attachments or None,
+            "invoice_scan_status": ("has_invoice" if attachments else "no_invoice") if rescan else "pending",
+            "invoice_count": len(attachments) if rescan else 0,
+            "processing_status": "completed" if rescan else "processing",
+            "scanned_at": now if rescan else None,
+        })
+    return result
+
+
+def _per_row(service: EmailListService, user_id: int, rows: List[Dict[str, Any]]) -> None:
+    """原写入方式：每封邮件查询一次并单独提交"""
+    for row in rows:
+        columns = EMAIL_FAILURE_COLUMNS if row.get("processing_status") == "failed" else EMAIL_ROW_DEFAULTS
+        fields = {k: v for k, v in row.items() if k in columns}
+        service.create_or_update_email(user_id, row["message_id"], fields)
+
+
+def _bulk(service: EmailListService, user_id: int, rows: List[Dict[str, Any]], chunk: int) -> None:
+    """扫描流程的写入方式：每个抓取块一次 upsert 并提交"""
+    for offset in range(0, len(rows), chunk):
+        service.bulk_upsert_emails(user_id, rows[offset:offset + chunk])
+        service.db.commit()
+
+
+def _measure(db: Session, rows: int, fn: Callable[[], None]) -> Dict[str, Any]:
+    statements = 0
+
+    def _count(*_args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    return {
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 1) if elapsed > 0 else None,
+        "statements": statements,
+    }
+
+
+def _create_user(db: Session) -> int:
+    user = User(username=f"{BENCH_USER_PREFIX}{uuid.uuid4().hex[:8]}", hashed_password="!", is_active=False)
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+def _cleanup(db: Session, user_id: int) -> None:
+    db.rollback()
+    db.query(Email).filter(Email.user_id == user_id).delete(synchronize_session=False)
+    db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+    db.commit()
+
+
+def run_benchmark(rows: int, chunk: int, seed: int, keep: bool) -> Dict[str, Any]:
+    mysql = engine.dialect.name == "mysql"
+    if not mysql:
+        logger.warning(f"当前数据库为 {engine.dialect.name}，批量 upsert 回退为逐条写入，两种方式的对比没有参考意义")
+    db = Session(bind=engine)
+    user_id = _create_user(db)
+    service = EmailListService(db)
+    try:
+        result: Dict[str, Any] = {
+            "dialect": engine.dialect.name,
+            "bulk_statement": "insert_on_duplicate_key_update" if mysql else "per_row_fallback",
+            "rows": rows,
+            "chunk": chunk,
+            "user_id": user_id,
+        }
+        writers = {
+            "per_row": lambda batch: _per_row(service, user_id, batch),
+            "bulk": lambda batch: _bulk(service, user_id, batch, chunk),
+        }
+        for name, write in writers.items():
+            # 两种方式使用不同的 message_id，互不影响；update 为同一批邮件的重复扫描
+            first = _email_rows(name, rows, seed, rescan=False)
+            rescan = _email_rows(name, rows, seed, rescan=True)
+            result[name] = {
+                "insert": _measure(db, rows, lambda: write(first)),
+                "update": _measure(db, rows, lambda: write(rescan)),
+            }
+
+        for phase in ("insert", "update"):
+            per_row, bulk = result["per_row"][phase]["seconds"], result["bulk"][phase]["seconds"]
+            result[f"{phase}_speedup"] = round(per_row / bulk, 2) if bulk > 0 else None
+        return result
+    finally:
+        if not keep:
+            _cleanup(db, user_id)
+        db.close()
+
+
+def main() -> None:
+    from app.core.logging_config import configure_logging
+    configure_logging(settings.LOG_LEVEL)
+    parser = argparse.ArgumentParser(description="邮件记录写入基准：逐条写入与批量 upsert 对比")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--chunk", type=int, default=settings.EMAIL_FETCH_CHUNK_SIZE, help="每次 upsert 的封数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="保留临时用户及其邮件记录")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.rows, max(1, args.chunk), args.seed, args.keep)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
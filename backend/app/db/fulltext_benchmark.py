@@ -0,0 +1,166 @@
+"""
+名称模糊检索基准：LIKE '%词%' 与全文检索（MySQL ngram FULLTEXT / 其他数据库的进程内倒排索引）对比
+在独立的临时表中生成指定行数的中文公司名（默认 100 万行、10 个用户），分别测量
+分页（LIMIT 20）与计数两类查询的中位耗时，以及建立索引耗时；结束后删除临时表（--keep 保留）。
+
+运行：python -m app.db.fulltext_benchmark --rows 1000000
+"""
+import argparse
+import json
+import logging
+import random
+import statistics
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import Column, DateTime, Integer, String, func, insert, text
+from sqlalchemy.orm import Session, declarative_base
+
+from app.core.config import settings
+from app.core.database import engine
+from app.services import fulltext_search
+from app.services.fulltext_search import text_match
+
+logger = logging.getLogger(__name__)
+
+BENCH_TABLE = "fulltext_bench_invoices"
+BENCH_INDEX = "ft_bench_seller_name"
+INSERT_BATCH = 10000
+
+_REGIONS = ["北京", "上海", "广州", "深圳", "杭州", "南京", "成都", "武汉", "西安", "苏州",
+            "天津", "重庆", "长沙", "郑州", "青岛", "厦门", "宁波", "合肥", "济南", "昆明"]
+_CHARS = "华创科信达源恒通瑞丰盛鑫宏远泰和安博智联云峰汇金星海德隆中天新广嘉诚启明"
+_INDUSTRIES = ["科技", "信息技术", "贸易", "餐饮管理", "物流", "建筑工程", "电子商务", "咨询服务",
+               "文化传媒", "医药", "网络科技", "酒店管理", "能源", "汽车服务", "教育科技"]
+_SUFFIXES = ["有限公司", "股份有限公司", "有限责任公司", "分公司"]
+
+BenchBase = declarative_base()
+
+
+class BenchInvoice(BenchBase):
+    """基准测试临时表（只含检索相关列）"""
+    __tablename__ = BENCH_TABLE
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    seller_name = Column(String(200))
+    updated_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"},
+    )
+
+
+# 让检索服务识别临时表，走与业务表相同的代码路径
+fulltext_search.FULLTEXT_INDEXES[(BENCH_TABLE, ("seller_name",))] = BENCH_INDEX
+fulltext_search._FALLBACK_TIMESTAMPS[BENCH_TABLE] = "updated_at"
+
+
+def _company_name(rng: random.Random) -> str:
+    core = "".join(rng.sample(_CHARS, 2))
+    return f"{rng.choice(_REGIONS)}{core}{rng.choice(_INDUSTRIES)}{rng.choice(_SUFFIXES)}"
+
+
+def _load_rows(db: Session, rows: int, users: int, seed: int) -> float:
+    rng = random.Random(seed)
+    now = datetime.now()
+    started = time.perf_counter()
+    for offset in range(0, rows, INSERT_BATCH):
+        batch = [
+            {"user_id": rng.randint(1, users), "seller_name": _company_name(rng), "updated_at": now}
+            for _ in range(min(INSERT_BATCH, rows - offset))
+        ]
+        db.execute(insert(BenchInvoice), batch)
+        db.commit()
+    return time.perf_counter() - started
+
+
+def _build_index(db: Session) -> float:
+    started = time.perf_counter()
+    if db.get_bind().dialect.name == "mysql":
+        db.execute(text("SET SESSION innodb_ft_enable_stopword = OFF"))
+        db.execute(text(
+            f"CREATE FULLTEXT INDEX `{BENCH_INDEX}` ON `{BENCH_TABLE}` (`seller_name`) WITH PARSER ngram"
+        ))
+        db.commit()
+    else:
+        fulltext_search._fallback_index(BenchInvoice, ("seller_name",)).refresh(db)
+    return time.perf_counter() - started
+
+
+def _median_ms(fn: Callable[[], Any], runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 3)
+
+
+def _measure(db: Session, condition_for: Callable[[str], Any], user_id: int, term: str, runs: int) -> Dict[str, Any]:
+    def page():
+        return (
+            db.query(BenchInvoice.id, BenchInvoice.seller_name)
+            .filter(BenchInvoice.user_id == user_id, condition_for(term))
+            .order_by(BenchInvoice.id.desc())
+            .limit(20)
+            .all()
+        )
+
+    def count():
+        return (
+            db.query(func.count(BenchInvoice.id))
+            .filter(BenchInvoice.user_id == user_id, condition_for(term))
+            .scalar()
+        )
+
+    return {"page_ms": _median_ms(page, runs), "count_ms": _median_ms(count, runs), "matches": count()}
+
+
+def run_benchmark(rows: int, users: int, terms: List[str], runs: int, seed: int, keep: bool) -> Dict[str, Any]:
+    BenchBase.metadata.drop_all(bind=engine)
+    BenchBase.metadata.create_all(bind=engine)
+    db = Session(bind=engine)
+    try:
+        result: Dict[str, Any] = {
+            "dialect": engine.dialect.name,
+            "rows": rows,
+            "users": users,
+            "load_seconds": round(_load_rows(db, rows, users, seed), 3),
+        }
+        result["index_build_seconds"] = round(_build_index(db), 3)
+
+        result["terms"] = []
+        for term in terms:
+            like = _measure(db, lambda t: BenchInvoice.seller_name.ilike(f"%{t}%"), 1, term, runs)
+            fulltext = _measure(db, lambda t: text_match(db, BenchInvoice.seller_name, t), 1, term, runs)
+            if like["matches"] != fulltext["matches"]:
+                logger.warning(f"检索结果不一致: {term} LIKE={like['matches']} 全文={fulltext['matches']}")
+            result["terms"].append({"term": term, "like": like, "fulltext": fulltext})
+        return result
+    finally:
+        db.close()
+        if not keep:
+            BenchBase.metadata.drop_all(bind=engine)
+
+
+def main() -> None:
+    from app.core.logging_config import configure_logging
+    configure_logging(settings.LOG_LEVEL)
+    parser = argparse.ArgumentParser(description="名称模糊检索基准：LIKE 与全文检索对比")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--terms", default="科技,深圳华创,物流有限,股份有限公司")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="保留临时表")
+    args = parser.parse_args()
+
+    terms = [term.strip() for term in args.terms.split(",") if term.strip()]
+    result = run_benchmark(args.rows, args.users, terms, args.runs, args.seed, args.keep)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
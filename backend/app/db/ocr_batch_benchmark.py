@@ -0,0 +1,271 @@
+"""
+OCR 吞吐基准：逐张任务（process_invoice_ocr）与批量调度（process_pending_ocr_batch）对比
+在进程内启动百度 OCR 桩服务（app.devtools.ocr_stub，固定 QPS 上限与接口延迟），以临时用户生成指定张数、
+内容互不相同的 PDF 发票，分别以两种方式完成识别与写回，报告每秒完成的发票数、最终 OCR 状态分布与桩服务请求计数。
+逐张任务模式以 --task-workers 个 fork 子进程模拟 prefork worker，每个子进程逐张执行任务体（不经过 Celery 的 rate_limit）；
+批量模式在当前进程内同步执行（task_always_eager），积压时的续跑同样在进程内完成。
+两种模式的令牌桶速率都与桩服务 QPS 一致（Redis 可用时为全局桶，请勿指向生产 Redis）。
+批量模式会领取库中所有待识别发票，存在其他待识别发票时拒绝运行；结束后删除临时用户、发票、日志与 OCR 数据（--keep 保留）。
+
+运行：python -m app.db.ocr_batch_benchmark --invoices 200 --qps 10 --latency-ms 200
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import engine
+from app.core.redis_client import get_redis
+from app.devtools.ocr_stub import StubState, create_app
+from app.models import email  # noqa: F401  User.emails 关系需要注册邮件模型
+from app.models.invoice import Invoice
+from app.models.invoice_facet import InvoiceFacet
+from app.models.ocr_cache import OCRCache
+from app.models.ocr_payload import OCRPayload
+from app.models.system_log import SystemLog
+from app.models.user import User
+from app.services import ocr_client, ocr_rate_limiter
+from app.services.ocr_cache_service import OCRResultCache
+from app.services.ocr_client import BaiduOCRClient
+from app.services.ocr_rate_limiter import OCRRateLimiter
+from app.workers import ocr_tasks
+from app.workers.celery_app import celery_app
+
+logger = logging.getLogger(__name__)
+
+BENCH_USER_PREFIX = "__ocr_batch_bench_"
+STUB_API_KEY = "ocr-batch-bench"
+DELETE_BATCH = 500
+
+InvoiceItem = Tuple[str, str]  # (发票ID, 文件路径)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_stub(qps: float, latency_ms: int):
+    """后台线程运行桩服务，返回 (地址, 状态, uvicorn.Server)"""
+    import uvicorn
+    state = StubState(latency_ms=latency_ms, qps=qps)
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(state), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="ocr-stub", daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("OCR 桩服务启动超时")
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}", state, server
+
+
+def _use_stub(base_url: str, qps: float) -> None:
+    """让当前进程的共享 OCR 客户端与限流器指向桩服务（只走远程识别，不启用本地解析）"""
+    settings.OCR_ENGINE = "baidu"
+    ocr_client._client = BaiduOCRClient(base_url=base_url, api_key=STUB_API_KEY, secret_key=STUB_API_KEY)
+    ocr_rate_limiter._limiter = OCRRateLimiter(rate=qps)
+
+
+def _redis_available() -> bool:
+    try:
+        return bool(get_redis().ping())
+    except Exception:
+        return False
+
+
+def _create_user(db: Session) -> int:
+    user = User(username=f"{BENCH_USER_PREFIX}{uuid.uuid4().hex[:8]}", hashed_password="!", is_active=False)
+    db.add(user)
+    db.commit()
+    return user.id
+
+
+def _create_invoices(db: Session, user_id: int, storage_dir: str, prefix: str, count: int,
+                     hashes: List[str]) -> List[InvoiceItem]:
+    """生成内容互不相同的 PDF 文件与待识别发票（不命中任何结果缓存）"""
+    run = uuid.uuid4().hex
+    invoices = []
+    for i in range(count):
+        content = f"%PDF-1.4\n% {prefix} {run} {i}\n%%EOF\n".encode()
+        path = os.path.join(storage_dir, f"{prefix}-{i}.pdf")
+        with open(path, "wb") as f:
+            f.write(content)
+        sha256 = hashlib.sha256(content).hexdigest()
+        hashes.append(sha256)
+        invoices.append(Invoice(
+            user_id=user_id,
+            original_filename=f"{prefix}-{i}.pdf",
+            file_path=path,
+            file_size=len(content),
+            file_md5_hash=hashlib.md5(content).hexdigest(),
+            file_sha256_hash=sha256,
+            status="processing",
+            ocr_status="pending",
+        ))
+    db.add_all(invoices)
+    db.commit()
+    return [(invoice.id, invoice.file_path) for invoice in invoices]
+
+
+def _run_tasks(job: Tuple[str, float, int, List[InvoiceItem]]) -> None:
+    """fork 子进程：逐张执行 process_invoice_ocr（与 prefork worker 子进程相同，各自持有连接与客户端）"""
+    base_url, qps, user_id, items = job
+    engine.dispose(close=False)
+    _use_stub(base_url, qps)
+    for invoice_id, file_path in items:
+        ocr_tasks.process_invoice_ocr.apply(args=(invoice_id, file_path, user_id))
+
+
+def _per_task(base_url: str, qps: float, user_id: int, items: List[InvoiceItem], workers: int) -> None:
+    if workers <= 1:
+        _run_tasks((base_url, qps, user_id, items))
+        return
+    jobs = [(base_url, qps, user_id, items[i::workers]) for i in range(workers)]
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        pool.map(_run_tasks, jobs)
+
+
+def _batch(batch_size: int, timeout: float) -> None:
+    """同步执行批量调度直至没有待识别发票；限流放回的发票由下一轮领取"""
+    previous = celery_app.conf.task_always_eager
+    celery_app.conf.task_always_eager = True
+    deadline = time.monotonic() + timeout
+    try:
+        while time.monotonic() < deadline:
+            summary = ocr_tasks.process_pending_ocr_batch.apply(args=(batch_size,)).get()
+            if summary.get("status") == "idle":
+                return
+        logger.warning("批量模式超时，仍有未完成的发票")
+    finally:
+        celery_app.conf.task_always_eager = previous
+
+
+def _status_counts(db: Session, user_id: int, prefix: str) -> Dict[str, int]:
+    db.expire_all()
+    rows = (
+        db.query(Invoice.ocr_status, func.count(Invoice.id))
+        .filter(Invoice.user_id == user_id, Invoice.original_filename.like(f"{prefix}-%"))
+        .group_by(Invoice.ocr_status)
+        .all()
+    )
+    return {status: count for status, count in rows}
+
+
+def _measure(db: Session, state: StubState, user_id: int, prefix: str, run: Any) -> Dict[str, Any]:
+    before = dict(state.counters)
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    statuses = _status_counts(db, user_id, prefix)
+    return {
+        "seconds": round(elapsed, 3),
+        "invoices_per_second": round(statuses.get("success", 0) / elapsed, 3) if elapsed > 0 else None,
+        "ocr_status": statuses,
+        "stub": {name: value - before.get(name, 0) for name, value in state.counters.items()},
+    }
+
+
+def _cleanup(db: Session, user_id: int, hashes: List[str]) -> None:
+    db.rollback()
+    db.query(SystemLog).filter(SystemLog.user_id == user_id).delete(synchronize_session=False)
+    db.query(InvoiceFacet).filter(InvoiceFacet.user_id == user_id).delete(synchronize_session=False)
+    db.query(Invoice).filter(Invoice.user_id == user_id).delete(synchronize_session=False)
+    for offset in range(0, len(hashes), DELETE_BATCH):
+        chunk = hashes[offset:offset + DELETE_BATCH]
+        db.query(OCRPayload).filter(OCRPayload.sha256.in_(chunk)).delete(synchronize_session=False)
+        db.query(OCRCache).filter(OCRCache.sha256.in_(chunk)).delete(synchronize_session=False)
+    db.query(User).filter(User.id == user_id).delete(synchronize_session=False)
+    db.commit()
+    try:
+        redis = get_redis()
+        for offset in range(0, len(hashes), DELETE_BATCH):
+            redis.delete(*(OCRResultCache.REDIS_KEY_PREFIX + sha256 for sha256 in hashes[offset:offset + DELETE_BATCH]))
+    except Exception as e:
+        logger.debug(f"清理OCR结果Redis缓存失败: {e}")
+
+
+def run_benchmark(invoices: int, qps: float, latency_ms: int, task_workers: int, batch_size: int,
+                  batch_concurrency: int, timeout: float, keep: bool) -> Dict[str, Any]:
+    db = Session(bind=engine)
+    pending = db.query(func.count(Invoice.id)).filter(Invoice.ocr_status.in_(("pending", "processing"))).scalar()
+    if pending:
+        db.close()
+        raise SystemExit(f"库中有 {pending} 张待识别/识别中的发票，批量模式会领取它们，请在空库上运行")
+
+    settings.OCR_BATCH_CONCURRENCY = batch_concurrency
+    base_url, state, server = _start_stub(qps, latency_ms)
+    _use_stub(base_url, qps)
+    storage_dir = tempfile.mkdtemp(prefix="ocr-batch-bench-")
+    user_id = _create_user(db)
+    hashes: List[str] = []
+    try:
+        result: Dict[str, Any] = {
+            "dialect": engine.dialect.name,
+            "invoices": invoices,
+            "qps": qps,
+            "latency_ms": latency_ms,
+            "task_workers": task_workers,
+            "batch_size": batch_size,
+            "batch_concurrency": batch_concurrency,
+            # Redis 不可用时各进程的令牌桶各自计数，逐张任务模式的总速率会超出 QPS（桩服务返回 18）
+            "shared_rate_limiter": _redis_available(),
+        }
+        # 逐张任务先跑完，避免其发票被批量模式领取
+        items = _create_invoices(db, user_id, storage_dir, "task", invoices, hashes)
+        result["per_task"] = _measure(
+            db, state, user_id, "task",
+            lambda: _per_task(base_url, qps, user_id, items, task_workers),
+        )
+        _create_invoices(db, user_id, storage_dir, "batch", invoices, hashes)
+        result["batch"] = _measure(db, state, user_id, "batch", lambda: _batch(batch_size, timeout))
+
+        per_task, batch = result["per_task"]["invoices_per_second"], result["batch"]["invoices_per_second"]
+        result["speedup"] = round(batch / per_task, 2) if per_task and batch else None
+        return result
+    finally:
+        server.should_exit = True
+        if not keep:
+            _cleanup(db, user_id, hashes)
+            shutil.rmtree(storage_dir, ignore_errors=True)
+        db.close()
+
+
+def main() -> None:
+    from app.core.logging_config import configure_logging
+    configure_logging(settings.LOG_LEVEL)
+    parser = argparse.ArgumentParser(description="OCR 吞吐基准：逐张任务与批量调度对比（桩服务）")
+    parser.add_argument("--invoices", type=int, default=200)
+    parser.add_argument("--qps", type=float, default=10, help="桩服务与令牌桶的 QPS 上限")
+    parser.add_argument("--latency-ms", type=int, default=200, help="桩服务识别接口延迟（毫秒）")
+    parser.add_argument("--task-workers", type=int, default=settings.OCR_BATCH_CONCURRENCY,
+                        help="逐张任务模式的 worker 子进程数")
+    parser.add_argument("--batch-size", type=int, default=settings.OCR_BATCH_SIZE)
+    parser.add_argument("--batch-concurrency", type=int, default=settings.OCR_BATCH_CONCURRENCY)
+    parser.add_argument("--timeout", type=float, default=600, help="批量模式最长运行时间（秒）")
+    parser.add_argument("--keep", action="store_true", help="保留临时用户、发票与文件")
+    args = parser.parse_args()
+
+    result = run_benchmark(
+        args.invoices, args.qps, args.latency_ms, max(1, args.task_workers), max(1, args.batch_size),
+        max(1, args.batch_concurrency), args.timeout, args.keep,
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+数据库结构增量升级
+init.sql 仅在首次部署时执行，create_all 也不会修改已存在的表；
+这里以幂等方式为已有部署补齐后续新增的列与索引。
+FULLTEXT 索引会重建整张表，不在启动时创建，需单独执行：python -m app.db.schema_upgrades --fulltext
+（未建索引时检索自动回退为 LIKE）。
+"""
+import argparse
+import logging
+import time
+from typing import List, Tuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# (表名, 列名, DDL)
+COLUMN_UPGRADES: List[Tuple[str, str, str]] = [
+    (
+        "email_configs",
+        "scan_folders",
+        "ALTER TABLE `email_configs` ADD COLUMN `scan_folders` JSON DEFAULT NULL",
+    ),
+    (
+        "email_scan_cursors",
+        "last_seen_uid",
+        "ALTER TABLE `email_scan_cursors` ADD COLUMN `last_seen_uid` BIGINT DEFAULT NULL AFTER `uid_validity`",
+    ),
+    (
+        "email_scan_cursors",
+        "last_scan_time",
+        "ALTER TABLE `email_scan_cursors` ADD COLUMN `last_scan_time` DATETIME DEFAULT NULL AFTER `last_committed_uid`",
+    ),
+]
+
+# (表名, 索引名, DDL)
+INDEX_UPGRADES: List[Tuple[str, str, str]] = [
+    (
+        "invoices",
+        "idx_invoices_ocr_status_created",
+        "CREATE INDEX `idx_invoices_ocr_status_created` ON `invoices` (`ocr_status`, `created_at`)",
+    ),
+    (
+        "invoices",
+        "idx_invoices_user_status_created_id",
+        "CREATE INDEX `idx_invoices_user_status_created_id` ON `invoices` (`user_id`, `status`, `created_at`, `id`)",
+    ),
+    (
+        "invoices",
+        "idx_invoices_user_created_id",
+        "CREATE INDEX `idx_invoices_user_created_id` ON `invoices` (`user_id`, `created_at`, `id`)",
+    ),
+]
+
+# 名称/主题/日志模糊检索；表上首个 FULLTEXT 索引会重建表（添加 FTS_DOC_ID），大表升级需预留时间，故不在启动时执行
+FULLTEXT_INDEX_UPGRADES: List[Tuple[str, str, str]] = [
+    (
+        "invoices",
+        "ft_invoices_seller_name",
+        "CREATE FULLTEXT INDEX `ft_invoices_seller_name` ON `invoices` (`seller_name`) WITH PARSER ngram",
+    ),
+    (
+        "invoices",
+        "ft_invoices_purchaser_name",
+        "CREATE FULLTEXT INDEX `ft_invoices_purchaser_name` ON `invoices` (`purchaser_name`) WITH PARSER ngram",
+    ),
+    (
+        "emails",
+        "ft_emails_sender",
+        "CREATE FULLTEXT INDEX `ft_emails_sender` ON `emails` (`sender`) WITH PARSER ngram",
+    ),
+    (
+        "emails",
+        "ft_emails_subject",
+        "CREATE FULLTEXT INDEX `ft_emails_subject` ON `emails` (`subject`) WITH PARSER ngram",
+    ),
+    (
+        "system_logs",
+        "ft_system_logs_search",
+        "CREATE FULLTEXT INDEX `ft_system_logs_search` ON `system_logs` (`message`, `resource_id`) WITH PARSER ngram",
+    ),
+]
+
+
+def _missing_indexes(bind: Engine, upgrades: List[Tuple[str, str, str]]) -> List[Tuple[str, str, str]]:
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table, index_name, ddl in upgrades:
+        if table in tables and index_name not in {i["name"] for i in inspector.get_indexes(table)}:
+            missing.append((table, index_name, ddl))
+    return missing
+
+
+def run_schema_upgrades(bind: Engine) -> None:
+    """补齐缺失的列与索引（仅 MySQL；其他方言由 create_all 按模型建表）；FULLTEXT 索引只提示，不创建"""
+    if bind.dialect.name != "mysql":
+        return
+
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+
+    with bind.begin() as conn:
+        for table, column, ddl in COLUMN_UPGRADES:
+            if table not in tables:
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing:
+                logger.info(f"结构升级：为 {table} 添加列 {column}")
+                conn.execute(text(ddl))
+
+        for table, index_name, ddl in _missing_indexes(bind, INDEX_UPGRADES):
+            logger.info(f"结构升级：为 {table} 创建索引 {index_name}")
+            conn.execute(text(ddl))
+
+    missing = [index_name for _, index_name, _ in _missing_indexes(bind, FULLTEXT_INDEX_UPGRADES)]
+    if missing:
+        logger.warning(
+            f"缺少 FULLTEXT 索引 {missing}，名称检索回退为 LIKE；"
+            f"请在低峰期执行 python -m app.db.schema_upgrades --fulltext（会重建相关表）"
+        )
+
+
+def run_fulltext_upgrades(bind: Engine) -> None:
+    """创建缺失的 FULLTEXT(ngram) 索引（一次性手动执行；每个索引单独执行，已建的不受后续失败影响）"""
+    if bind.dialect.name != "mysql":
+        logger.info("非 MySQL 数据库不使用 FULLTEXT 索引，跳过")
+        return
+
+    for table, index_name, ddl in _missing_indexes(bind, FULLTEXT_INDEX_UPGRADES):
+        logger.info(f"结构升级：为 {table} 创建 FULLTEXT 索引 {index_name}")
+        started = time.monotonic()
+        with bind.begin() as conn:
+            # ngram 词元不使用停用词表，否则含停用词字母的词元不会入索引
+            conn.execute(text("SET SESSION innodb_ft_enable_stopword = OFF"))
+            conn.execute(text(ddl))
+        logger.info(f"FULLTEXT 索引 {index_name} 创建完成，耗时 {time.monotonic() - started:.1f} 秒")
+
+
+def main() -> None:
+    from app.core.config import settings
+    from app.core.database import engine
+    from app.core.logging_config import configure_logging
+    configure_logging(settings.LOG_LEVEL)
+    parser = argparse.ArgumentParser(description="数据库结构增量升级")
+    parser.add_argument("--fulltext", action="store_true", help="同时创建缺失的 FULLTEXT 索引（会重建相关表）")
+    args = parser.parse_args()
+
+    run_schema_upgrades(engine)
+    if args.fulltext:
+        run_fulltext_upgrades(engine)
+
+
+if __name__ == "__main__":
+    main()
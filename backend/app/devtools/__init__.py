@@ -0,0 +1 @@
+# 开发与测试工具模块初始化文件
\ No newline at end of file
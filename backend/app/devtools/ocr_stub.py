@@ -0,0 +1,175 @@
+"""
+百度 OCR 本地桩服务（测试/压测用）
+提供 OAuth 令牌接口与增值税发票识别接口，返回结构与百度一致的伪造结果；
+同一文件（按请求体中文件内容的 sha256）总是得到相同的发票号码，不同文件不会被判为重复。
+支持模拟令牌过期（error_code 110）、QPS 超限（error_code 18）与接口延迟，并通过 /_stub/stats
+暴露令牌与识别请求计数，用于确认令牌缓存与连接复用是否生效。
+
+运行：python -m app.devtools.ocr_stub --port 8090
+然后设置 BAIDU_OCR_BASE_URL=http://127.0.0.1:8090
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import date, timedelta
+from typing import Any, Deque, Dict, Optional, Set
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+
+TOKEN_PATH = "/oauth/2.0/token"
+VAT_INVOICE_PATH = "/rest/2.0/ocr/v1/vat_invoice"
+
+_SELLERS = ["北京华创科技有限公司", "上海瑞丰物流有限公司", "深圳恒通电子商务有限公司", "杭州博智信息技术有限公司"]
+_PURCHASERS = ["广州嘉诚贸易有限公司", "成都启明咨询服务有限公司", "南京宏远建筑工程有限公司"]
+_SERVICE_TYPES = ["餐饮", "交通", "住宿", "办公用品", "其他"]
+
+
+class StubState:
+    """桩服务状态：已签发令牌、请求计数与 QPS 窗口"""
+
+    def __init__(self, expires_in: int = 2592000, latency_ms: int = 0, qps: float = 0):
+        self.expires_in = expires_in
+        self.latency_ms = latency_ms
+        self.qps = qps
+        self.tokens: Dict[str, float] = {}
+        self.revoked: Set[str] = set()
+        self.counters = {"token_requests": 0, "ocr_requests": 0, "invalid_token": 0, "rate_limited": 0}
+        self._recent: Deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def issue_token(self) -> str:
+        token = f"stub.{uuid.uuid4().hex}"
+        with self._lock:
+            self.counters["token_requests"] += 1
+            self.tokens[token] = time.time() + self.expires_in
+        return token
+
+    def token_valid(self, token: Optional[str]) -> bool:
+        with self._lock:
+            expires_at = self.tokens.get(token or "")
+            return expires_at is not None and token not in self.revoked and expires_at > time.time()
+
+    def revoke_all(self) -> None:
+        with self._lock:
+            self.revoked.update(self.tokens)
+
+    def admit(self) -> bool:
+        """按滑动一秒窗口判断是否超过 QPS 限制"""
+        with self._lock:
+            self.counters["ocr_requests"] += 1
+            if self.qps <= 0:
+                return True
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] >= 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.qps:
+                self.counters["rate_limited"] += 1
+                return False
+            self._recent.append(now)
+            return True
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+
+def fake_words_result(digest: str) -> Dict[str, Any]:
+    """按文件摘要生成确定的发票字段（格式与百度增值税发票识别一致）"""
+    seed = int(digest[:12], 16)
+    amount = round(50 + seed % 500000 / 100, 2)
+    tax = round(amount * 0.06, 2)
+    invoice_date = date(2024, 1, 1) + timedelta(days=seed % 365)
+    return {
+        "InvoiceType": "电子发票(普通发票)",
+        "InvoiceCode": "",
+        "InvoiceNum": str(seed % 10 ** 20).zfill(20),
+        "InvoiceDate": invoice_date.strftime("%Y年%m月%d日"),
+        "PurchaserName": _PURCHASERS[seed % len(_PURCHASERS)],
+        "PurchaserRegisterNum": f"91440101{digest[:10].upper()}",
+        "PurchaserAddress": "",
+        "PurchaserBank": "",
+        "SellerName": _SELLERS[seed % len(_SELLERS)],
+        "SellerRegisterNum": f"91110108{digest[10:20].upper()}",
+        "SellerAddress": "",
+        "SellerBank": "",
+        "TotalAmount": f"{amount:.2f}",
+        "TotalTax": f"{tax:.2f}",
+        "AmountInFiguers": f"{amount + tax:.2f}",
+        "AmountInWords": "",
+        "ServiceType": _SERVICE_TYPES[seed % len(_SERVICE_TYPES)],
+        "CommodityName": [{"row": "1", "word": "*信息技术服务*技术服务费"}],
+        "CommodityAmount": [{"row": "1", "word": f"{amount:.2f}"}],
+        "CommodityTaxRate": [{"row": "1", "word": "6%"}],
+        "CommodityTax": [{"row": "1", "word": f"{tax:.2f}"}],
+    }
+
+
+def create_app(state: Optional[StubState] = None) -> FastAPI:
+    state = state or StubState()
+    app = FastAPI(title="Baidu OCR stub")
+    app.state.stub = state
+
+    @app.api_route(TOKEN_PATH, methods=["GET", "POST"])
+    async def token(request: Request):
+        params = request.query_params
+        if params.get("grant_type") != "client_credentials" or not params.get("client_id"):
+            return {"error": "invalid_client", "error_description": "unknown client id"}
+        return {"access_token": state.issue_token(), "expires_in": state.expires_in, "scope": "vis-ocr_vat_invoice"}
+
+    @app.post(VAT_INVOICE_PATH)
+    async def vat_invoice(request: Request):
+        if not state.token_valid(request.query_params.get("access_token")):
+            state.count("invalid_token")
+            return {"error_code": 110, "error_msg": "Access token invalid or no longer valid"}
+        if not state.admit():
+            return {"error_code": 18, "error_msg": "Open api qps request limit reached"}
+        if state.latency_ms > 0:
+            await asyncio.sleep(state.latency_ms / 1000)
+
+        form = parse_qs((await request.body()).decode("ascii", errors="ignore"))
+        encoded = (form.get("pdf_file") or form.get("image") or [""])[0]
+        if not encoded:
+            return {"error_code": 216100, "error_msg": "invalid param"}
+        try:
+            content = base64.b64decode(encoded)
+        except Exception:
+            return {"error_code": 216201, "error_msg": "image format error"}
+        words_result = fake_words_result(hashlib.sha256(content).hexdigest())
+        return {"log_id": uuid.uuid4().int >> 72, "words_result_num": len(words_result), "words_result": words_result}
+
+    @app.get("/_stub/stats")
+    async def stats():
+        return dict(state.counters)
+
+    @app.post("/_stub/revoke")
+    async def revoke():
+        """让已签发的令牌全部失效，用于验证 110 后的令牌刷新与重试"""
+        state.revoke_all()
+        return {"revoked": len(state.tokens)}
+
+    return app
+
+
+app = create_app()
+
+
+def main() -> None:
+    import uvicorn
+    parser = argparse.ArgumentParser(description="百度 OCR 本地桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--expires-in", type=int, default=2592000, help="令牌有效期（秒）")
+    parser.add_argument("--latency-ms", type=int, default=0, help="识别接口模拟延迟（毫秒）")
+    parser.add_argument("--qps", type=float, default=0, help="识别接口 QPS 上限，超出返回 error_code 18；0 为不限")
+    args = parser.parse_args()
+    uvicorn.run(create_app(StubState(args.expires_in, args.latency_ms, args.qps)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
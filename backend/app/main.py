@@ -15,6 +15,7 @@ from app.api.api_v1.api import api_router
 from app.services.logging_service import logging_service
 from fastapi import Response
 from app.core.metrics import CONTENT_TYPE_LATEST, generate_latest
+from app.core.redis_client import ping_redis, redis_pool_stats
 from app.core.deps import get_current_user
 
 # Configure logging with UTF-8 support
@@ -174,6 +175,13 @@ async def detailed_health_check(current_user=Depends(get_current_user) if settin
             }
             health_info["status"] = "degraded"
         
+        # 检查 Redis 连接（共享连接池）
+        if ping_redis():
+            health_info["services"]["redis"] = {"status": "healthy", "pool": redis_pool_stats()}
+        else:
+            health_info["services"]["redis"] = {"status": "unhealthy"}
+            health_info["status"] = "degraded"
+        
         # 检查系统资源
         try:
             health_info["system"] = {
@@ -4,7 +4,7 @@ from sqlalchemy.dialects.mysql import CHAR
 from datetime import datetime
 import uuid
 from app.core.database import Base
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index
 
 
 class Email(Base):
@@ -51,5 +51,8 @@ class Email(Base):
     # 添加唯一约束/索引：同一用户下的邮件message_id唯一
     __table_args__ = (
         UniqueConstraint('user_id', 'message_id', name='uq_email_user_message'),
+        # 发件人/主题模糊检索走 ngram 全文索引，仅 MySQL 创建
+        Index('ft_emails_sender', 'sender', mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
+        Index('ft_emails_subject', 'subject', mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
         {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
     )
\ No newline at end of file
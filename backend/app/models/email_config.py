@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, BigInteger, JSON
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -25,6 +25,8 @@ class EmailConfig(Base):
     # 增量扫描：记录最后处理的IMAP UID 与 UIDVALIDITY
     last_seen_uid = Column(BigInteger)  # None 表示首次全量或按日期扫描
     uid_validity = Column(BigInteger)  # 服务器UIDVALIDITY，变化时需重置last_seen_uid
+    # 扫描的文件夹列表，["*"] 为自动发现；None 使用 EMAIL_SCAN_FOLDERS（各文件夹的 UID 状态见 email_scan_cursors）
+    scan_folders = Column(JSON)
 
     # 时间戳
     created_at = Column(DateTime, default=datetime.now)
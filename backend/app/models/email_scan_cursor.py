@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, DateTime, BigInteger, ForeignKey, UniqueConstraint
+from datetime import datetime
+from app.core.database import Base
+
+
+class EmailScanCursor(Base):
+    """邮箱文件夹扫描状态：每个邮箱配置与文件夹的已完成扫描位置，以及扫描中断后继续的检查点"""
+    __tablename__ = "email_scan_cursors"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    config_id = Column(Integer, ForeignKey("email_configs.id", ondelete="CASCADE"), nullable=False)
+    folder = Column(String(255), nullable=False, default="INBOX")
+    uid_validity = Column(BigInteger)  # 该文件夹的 UIDVALIDITY，变化时 UID 状态作废
+    last_seen_uid = Column(BigInteger)  # 已完成扫描的最大 UID，None 表示按日期首次扫描
+    last_committed_uid = Column(BigInteger)  # 该 UID 及之前的邮件记录已提交
+    last_scan_time = Column(DateTime)  # 该文件夹最后一次扫描完成时间
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('config_id', 'folder', name='uq_email_scan_cursor_config_folder'),
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    )
@@ -1,10 +1,10 @@
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, ForeignKey, JSON, Numeric
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.dialects.mysql import CHAR
 from datetime import datetime
 import uuid
 from app.core.database import Base
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, Index
 
 
 class Invoice(Base):
@@ -50,8 +50,10 @@ class Invoice(Base):
 
     # 其他信息
     service_type = Column(String(50), index=True)  # 消费类型，用于分类打印
-    commodity_details = Column(JSON)  # 商品明细，JSON格式存储
-    ocr_raw_data = Column(JSON)  # OCR原始返回数据
+    # 大字段延迟加载（同组一次取回）：列表查询不读取，访问时才加载
+    commodity_details = deferred(Column(JSON), group="ocr_payload")  # 商品明细，JSON格式存储
+    # OCR原始返回数据：成功结果按 file_sha256_hash 存于 ocr_payloads（压缩），此列仅保留失败信息与未迁移的旧数据
+    ocr_raw_data = deferred(Column(JSON(none_as_null=True)), group="ocr_payload")
 
     # 状态管理
     status = Column(String(20), default="processing", index=True)  # pending, processing, completed, failed, archived, duplicate
@@ -72,6 +74,14 @@ class Invoice(Base):
         UniqueConstraint('user_id', 'file_md5_hash', 'file_size', name='uq_invoice_user_filehash_size'),
         UniqueConstraint('user_id', 'file_sha256_hash', name='uq_invoice_user_sha256'),
         UniqueConstraint('user_id', 'invoice_num', name='uq_invoice_user_invoicenum'),
+        # 批量OCR调度按 ocr_status 拉取待处理发票
+        Index('idx_invoices_ocr_status_created', 'ocr_status', 'created_at'),
+        # 列表键集分页：按状态筛选 / 不按状态筛选时均可沿索引顺序读取 (created_at, id)
+        Index('idx_invoices_user_status_created_id', 'user_id', 'status', 'created_at', 'id'),
+        Index('idx_invoices_user_created_id', 'user_id', 'created_at', 'id'),
+        # 名称模糊检索走 ngram 全文索引（见 services/fulltext_search.py），仅 MySQL 创建
+        Index('ft_invoices_seller_name', 'seller_name', mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
+        Index('ft_invoices_purchaser_name', 'purchaser_name', mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
         {
             "mysql_charset": "utf8mb4",
             "mysql_collate": "utf8mb4_unicode_ci"
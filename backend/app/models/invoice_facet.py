@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from datetime import datetime
+from app.core.database import Base
+
+
+class InvoiceFacet(Base):
+    """发票筛选项字典：每个用户的销售方/购买方/服务类型取值及对应发票数，随发票写入增量维护"""
+    __tablename__ = "invoice_facets"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    facet = Column(String(20), nullable=False)  # seller, purchaser, service_type；_built 为已构建标记
+    value = Column(String(200), nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('user_id', 'facet', 'value', name='uq_invoice_facets_user_facet_value'),
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    )
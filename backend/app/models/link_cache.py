@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, UniqueConstraint
+from datetime import datetime
+from app.core.database import Base
+
+
+class LinkCache(Base):
+    """邮件正文下载链接指纹：规范化 URL -> 内容 sha256 与 HTTP 校验器"""
+    __tablename__ = "link_cache"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    url_hash = Column(String(64), nullable=False)  # 规范化 URL 的 sha256
+    url = Column(Text, nullable=False)
+    sha256 = Column(String(64), nullable=False, index=True)
+    file_md5_hash = Column(String(32))
+    file_size = Column(Integer)
+    stored_path = Column(String(500))  # 最近一次落盘的相对路径，条件请求 304 时复用
+    filename = Column(String(255))
+    etag = Column(String(255))
+    last_modified = Column(String(64))
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        UniqueConstraint('url_hash', name='uq_link_cache_url_hash'),
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
+    )
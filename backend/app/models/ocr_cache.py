@@ -9,7 +9,7 @@ class OCRCache(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     sha256 = Column(String(64), nullable=False, index=True)
     status = Column(String(20), default="success")  # success, failed
-    ocr_json = Column(JSON)
+    ocr_json = Column(JSON(none_as_null=True))  # 旧数据；新结果按 sha256 存于 ocr_payloads
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary
+from sqlalchemy.dialects.mysql import MEDIUMBLOB
+from datetime import datetime
+from app.core.database import Base
+
+
+class OCRPayload(Base):
+    """OCR 原始返回数据：按文件 sha256 内容寻址，压缩后的 JSON（invoices、ocr_cache、OCR 日志只引用 sha256）"""
+    __tablename__ = "ocr_payloads"
+
+    sha256 = Column(String(64), primary_key=True)
+    codec = Column(String(10), nullable=False)  # zstd, gzip
+    payload = Column(LargeBinary().with_variant(MEDIUMBLOB(), "mysql"), nullable=False)
+    raw_size = Column(Integer)  # 压缩前 JSON 字节数
+    stored_size = Column(Integer)  # 压缩后字节数
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    __table_args__ = (
+        {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"},
+    )
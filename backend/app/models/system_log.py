@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.core.database import Base
@@ -27,4 +27,9 @@ class SystemLog(Base):
     created_at = Column(DateTime, default=datetime.now, index=True)
 
     # 外键关系
-    user = relationship("User", back_populates="system_logs")
\ No newline at end of file
+    user = relationship("User", back_populates="system_logs")
+
+    __table_args__ = (
+        # 日志关键词检索走 ngram 全文索引，仅 MySQL 创建
+        Index('ft_system_logs_search', 'message', 'resource_id', mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
+    )
\ No newline at end of file
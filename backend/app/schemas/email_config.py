@@ -10,6 +10,7 @@ class EmailConfigBase(BaseModel):
     imap_port: int = 993
     username: str
     scan_days: int = 7
+    scan_folders: Optional[List[str]] = None  # 扫描的文件夹，["*"] 为自动发现，为空时使用系统默认
 
 
 # 创建邮箱配置请求模式
@@ -25,6 +26,7 @@ class EmailConfigUpdate(BaseModel):
     username: Optional[str] = None
     password: Optional[str] = None
     scan_days: Optional[int] = None
+    scan_folders: Optional[List[str]] = None
     is_active: Optional[bool] = None
 
 
@@ -65,6 +65,47 @@ class Invoice(InvoiceBase):
         from_attributes = True
 
 
+# 发票列表项：仅列表展示所需字段，不含 OCR 原始数据、商品明细与地址/银行等长文本
+class InvoiceListItem(BaseModel):
+    id: str
+    user_id: int
+    original_filename: str
+    file_size: Optional[int] = None
+    source: Optional[str] = None
+    invoice_code: Optional[str] = None
+    invoice_num: Optional[str] = None
+    invoice_date: Optional[datetime] = None
+    invoice_type: Optional[str] = None
+    purchaser_name: Optional[str] = None
+    seller_name: Optional[str] = None
+    total_amount: Optional[Decimal] = None
+    total_tax: Optional[Decimal] = None
+    amount_in_figures: Optional[Decimal] = None
+    service_type: Optional[str] = None
+    status: str
+    ocr_status: str
+    ocr_error_message: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+    processed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+# 发票 OCR 结果（完整识别数据单独获取）
+class InvoiceOCRResult(BaseModel):
+    id: str
+    ocr_status: str
+    ocr_error_message: Optional[str] = None
+    ocr_raw_data: Optional[Dict[str, Any]] = None
+    commodity_details: Optional[List[Dict[str, Any]]] = None
+    processed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 # 发票列表查询参数
 class InvoiceFilter(BaseModel):
     status: Optional[str] = None
@@ -86,15 +127,20 @@ class InvoiceFilter(BaseModel):
 class PaginationParams(BaseModel):
     page: int = Field(1, ge=1)
     size: int = Field(20, ge=1, le=100)
+    # 键集分页游标（上一页响应的 next_cursor），提供时忽略 page
+    cursor: Optional[str] = None
+    # 是否返回总数；游标翻页时总数来自短期缓存
+    with_total: bool = True
 
 
 # 发票列表响应
 class InvoiceListResponse(BaseModel):
-    items: List[Invoice]
-    total: int
+    items: List[InvoiceListItem]
+    total: Optional[int] = None
     page: int
     size: int
-    pages: int
+    pages: Optional[int] = None
+    next_cursor: Optional[str] = None
 
 
 # 发票上传响应
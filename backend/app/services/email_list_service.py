@@ -5,16 +5,42 @@
 
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, desc, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from typing import List, Optional, Tuple, Dict, Any
 from datetime import datetime, timedelta
 import logging
+import uuid
 
 from app.models.email import Email
 from app.models.invoice import Invoice
 from app.services.logging_service import logging_service
+from app.services.fulltext_search import text_match
 
 logger = logging.getLogger(__name__)
 
+# 批量写入的邮件列及默认值（多行 INSERT 要求每行列一致）
+EMAIL_ROW_DEFAULTS: Dict[str, Any] = {
+    'subject': None,
+    'sender': None,
+    'recipient': None,
+    'date_sent': None,
+    'date_received': None,
+    'body_text': None,
+    'body_html': None,
+    'has_attachments': False,
+    'attachment_count': 0,
+    'attachment_info': None,
+    'invoice_scan_status': 'pending',
+    'invoice_count': 0,
+    'scan_result': None,
+    'processing_status': 'unprocessed',
+    'error_message': None,
+    'scanned_at': None,
+}
+
+# 处理失败的行只更新这些列，保留已有的正文与扫描结果
+EMAIL_FAILURE_COLUMNS = ('subject', 'sender', 'processing_status', 'error_message')
+
 
 class EmailListService:
     """邮件列表服务类"""
@@ -72,6 +98,60 @@ class EmailListService:
             logger.error(f"创建/更新邮件记录失败: {str(e)}")
             raise
     
+    def get_scanned_message_ids(self, user_id: int, message_ids: List[str]) -> set:
+        """返回已完成发票扫描的 message_id 集合（一次 IN 查询）"""
+        if not message_ids:
+            return set()
+        rows = self.db.query(Email.message_id).filter(
+            Email.user_id == user_id,
+            Email.message_id.in_(list(set(message_ids))),
+            Email.invoice_scan_status.in_(('has_invoice', 'no_invoice')),
+            Email.scanned_at.isnot(None),
+        ).all()
+        return {row.message_id for row in rows}
+    
+    def bulk_upsert_emails(self, user_id: int, rows: List[Dict[str, Any]]) -> None:
+        """批量写入邮件记录：MySQL 下一条 INSERT ... ON DUPLICATE KEY UPDATE（uq_email_user_message），
+        其他数据库逐条 create_or_update_email。rows 含 message_id 与邮件字段，调用方负责提交。
+        """
+        if not rows:
+            return
+        now = datetime.now()
+        # 同一批内同一 message_id 以最后一行为准
+        latest: Dict[str, Dict[str, Any]] = {}
+        for row in rows:
+            latest[row['message_id']] = row
+        values = [
+            {
+                **EMAIL_ROW_DEFAULTS,
+                **{k: v for k, v in row.items() if k in EMAIL_ROW_DEFAULTS},
+                'id': str(uuid.uuid4()),
+                'user_id': user_id,
+                'message_id': message_id,
+                'created_at': now,
+                'updated_at': now,
+            }
+            for message_id, row in latest.items()
+        ]
+
+        if self.db.get_bind().dialect.name != 'mysql':
+            for value in values:
+                columns = EMAIL_FAILURE_COLUMNS if value['processing_status'] == 'failed' else EMAIL_ROW_DEFAULTS
+                fields = {k: v for k, v in value.items() if k in columns}
+                self.create_or_update_email(user_id, value['message_id'], fields)
+            return
+
+        table = Email.__table__
+        stmt = mysql_insert(table).values(values)
+        failed = stmt.inserted.processing_status == 'failed'
+        updates = {
+            column: stmt.inserted[column] if column in EMAIL_FAILURE_COLUMNS
+            else func.if_(failed, table.c[column], stmt.inserted[column])
+            for column in EMAIL_ROW_DEFAULTS
+        }
+        updates['updated_at'] = stmt.inserted.updated_at
+        self.db.execute(stmt.on_duplicate_key_update(**updates))
+    
     def get_emails(
         self, 
         user_id: int, 
@@ -95,11 +175,11 @@ class EmailListService:
                 
                 # 发送者筛选
                 if filters.get('sender'):
-                    query = query.filter(Email.sender.ilike(f"%{filters['sender']}%"))
+                    query = query.filter(text_match(self.db, Email.sender, filters['sender']))
                 
                 # 主题筛选
                 if filters.get('subject'):
-                    query = query.filter(Email.subject.ilike(f"%{filters['subject']}%"))
+                    query = query.filter(text_match(self.db, Email.subject, filters['subject']))
                 
                 # 是否有附件筛选
                 if filters.get('has_attachments') is not None:
@@ -1,36 +1,258 @@
 import imaplib
 import email
 import re
-import requests
 from email.header import decode_header
-from typing import List, Dict, Optional, Tuple
+from email.utils import decode_rfc2231
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from datetime import datetime, timedelta
-from urllib.parse import urlparse
+from urllib.parse import unquote, urlparse
 import base64
 import os
-import tempfile
+import quopri
+import queue
+import threading
+import time
 import logging
 import traceback
 
+from imapclient import imap_utf7
+from imapclient.response_parser import parse_fetch_response
+
 from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.metrics import EMAIL_DUPLICATES, EMAIL_LINK_FETCHES
 from app.models.email_config import EmailConfig
-from app.models.invoice import Invoice
+from app.models.email_scan_cursor import EmailScanCursor
 from app.services.invoice_service import InvoiceService
 from app.services.email_list_service import EmailListService
 from app.services.logging_service import logging_service
+from app.services.link_cache_service import get_link_fingerprint_cache
+from app.services.pdf_link_fetcher import get_pdf_link_fetcher
+from app.services.pdf_storage import SPOOL_CHUNK_SIZE, discard_stored_files, store_pdf_stream
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
 
 logger = logging.getLogger(__name__)
 
+_FETCH_UID_RE = re.compile(rb'UID\s+(\d+)')
+
+
+def _parse_fetch_literals(data) -> List[Tuple[str, bytes]]:
+    """解析 imaplib UID FETCH 响应，返回 [(uid, 字面量内容)]
+    兼容 UID 出现在字面量之前（b'1 (UID 10 RFC822 {n}'）或之后（b' UID 10)'）的服务器。
+    """
+    items = []
+    pending = None
+    for entry in data or []:
+        if isinstance(entry, tuple) and len(entry) >= 2:
+            m = _FETCH_UID_RE.search(entry[0])
+            if m:
+                items.append((m.group(1).decode(), entry[1]))
+                pending = None
+            else:
+                pending = entry[1]
+        elif isinstance(entry, (bytes, bytearray)) and pending is not None:
+            m = _FETCH_UID_RE.search(entry)
+            if m:
+                items.append((m.group(1).decode(), pending))
+            pending = None
+    return items
+
+
+# 主题发票关键词（客户端判定与服务端 SUBJECT 检索共用）
+INVOICE_SUBJECT_KEYWORDS = [
+    '发票', '票据', 'invoice', '开票', '电子发票',
+    '增值税发票', '专用发票', '普通发票', '税务'
+]
+
+# IMAP SEARCH 日期使用固定的英文月份缩写（与 locale 无关）
+_IMAP_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _imap_date(value: datetime) -> str:
+    return f"{value.day}-{_IMAP_MONTHS[value.month - 1]}-{value.year}"
+
+
+def _search_keywords() -> List[str]:
+    """服务端 SUBJECT 为子串匹配：去掉包含其他关键词的冗余项（如“电子发票”已被“发票”覆盖）"""
+    keywords = [k.lower() for k in INVOICE_SUBJECT_KEYWORDS]
+    return [k for k in dict.fromkeys(keywords) if not any(o != k and o in k for o in keywords)]
+
+
+# LIST 响应：(flags) "delimiter" name
+_LIST_RE = re.compile(rb'\((?P<flags>[^)]*)\)\s+(?P<delim>"(?:[^"\\]|\\.)*"|NIL)\s+(?P<name>.+?)\s*$')
+# 自动发现时跳过的文件夹：不可选择、不存在，以及 special-use（RFC 6154）中不会收到发票的文件夹
+_SKIP_FOLDER_FLAGS = {
+    b'\\noselect', b'\\nonexistent', b'\\junk', b'\\trash', b'\\sent', b'\\drafts', b'\\all', b'\\flagged',
+}
+# 不支持 special-use 的服务器按常见名称跳过
+_SKIP_FOLDER_NAMES = {
+    'sent', 'sent items', 'sent messages', 'trash', 'deleted', 'deleted items', 'deleted messages',
+    'junk', 'junk e-mail', 'spam', 'drafts', 'outbox',
+    '已发送', '已删除', '垃圾邮件', '草稿箱', '草稿', '病毒文件夹', '广告邮件',
+}
+
+
+def _imap_unquote(value: bytes) -> bytes:
+    if len(value) >= 2 and value[:1] == b'"' and value[-1:] == b'"':
+        return re.sub(rb'\\(.)', rb'\1', value[1:-1])
+    return value
+
+
+def _imap_mailbox(folder: str) -> str:
+    """文件夹名编码为 modified UTF-7 并加引号，作为 SELECT/STATUS 参数"""
+    encoded = imap_utf7.encode(folder).decode('ascii')
+    return '"' + encoded.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+# 第一阶段抓取项：仅头部字段与 MIME 结构，不下载正文
+HEADER_FETCH_ITEMS = '(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS (SUBJECT FROM TO DATE MESSAGE-ID)])'
+
+
+def _to_str(value) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='ignore')
+    return value or ''
+
+
+def _structure_params(raw) -> Dict[str, str]:
+    """BODYSTRUCTURE 参数列表 (k1 v1 k2 v2 ...) 转为小写键字典"""
+    if not isinstance(raw, (list, tuple)):
+        return {}
+    return {_to_str(k).lower(): _to_str(v) for k, v in zip(raw[::2], raw[1::2])}
+
+
+def _structure_filename(params: Dict[str, str]) -> Optional[str]:
+    """解析 filename/name 参数，兼容 RFC 2231（filename*、filename*0* 分段）"""
+    for key in ('filename', 'name'):
+        if params.get(key):
+            return params[key]
+        segments = sorted(
+            (k for k in params if k.startswith(f'{key}*')),
+            key=lambda k: int(re.sub(r'\D', '', k) or 0),
+        )
+        if segments:
+            encoded = any(k.endswith('*') for k in segments)
+            raw = ''.join(params[k] for k in segments)
+            if encoded:
+                charset, _, value = decode_rfc2231(raw)
+                if charset is None:
+                    return unquote(value)
+                try:
+                    return unquote(value, encoding=charset, errors='replace')
+                except LookupError:
+                    return unquote(value)
+            return raw
+    return None
+
+
+def _walk_bodystructure(structure, prefix: str = '') -> List[Dict[str, Any]]:
+    """展开 BODYSTRUCTURE 为叶子部件列表（含 IMAP 部件编号、类型、编码、大小、处置方式、文件名）"""
+    if structure is None:
+        return []
+    if getattr(structure, 'is_multipart', False):
+        parts = []
+        for index, sub in enumerate(structure[0], 1):
+            parts.extend(_walk_bodystructure(sub, f'{prefix}.{index}' if prefix else str(index)))
+        return parts
+
+    main_type = _to_str(structure[0]).lower()
+    sub_type = _to_str(structure[1]).lower()
+    params = _structure_params(structure[2])
+    encoding = _to_str(structure[5]).lower() if len(structure) > 5 else ''
+    size = structure[6] if len(structure) > 6 and isinstance(structure[6], int) else 0
+
+    # 扩展字段位置：text 多一个行数，message/rfc822 多信封、内部结构与行数
+    ext = 7 + (1 if main_type == 'text' else 0) + (3 if (main_type, sub_type) == ('message', 'rfc822') else 0)
+    disposition, disposition_params = None, {}
+    if len(structure) > ext + 1 and isinstance(structure[ext + 1], (list, tuple)) and structure[ext + 1]:
+        disposition = _to_str(structure[ext + 1][0]).lower()
+        if len(structure[ext + 1]) > 1:
+            disposition_params = _structure_params(structure[ext + 1][1])
+
+    return [{
+        'part': prefix or '1',
+        'content_type': f'{main_type}/{sub_type}',
+        'charset': params.get('charset'),
+        'encoding': encoding,
+        'size': size,
+        'disposition': disposition,
+        'filename': _structure_filename(disposition_params) or _structure_filename(params),
+    }]
+
+
+def _decode_part(payload: bytes, encoding: str) -> bytes:
+    """按 Content-Transfer-Encoding 解码 BODY[n] 内容"""
+    if not payload:
+        return b''
+    if encoding == 'base64':
+        return base64.b64decode(payload)
+    if encoding == 'quoted-printable':
+        return quopri.decodestring(payload)
+    return bytes(payload)
+
+
+def _decoded_size(size: int, encoding: str) -> int:
+    """由传输编码后的大小估算解码后的大小（base64 约 3/4）"""
+    return size * 3 // 4 if encoding == 'base64' else size
+
+
+def _fetch_value(fetched: Dict[bytes, Any], prefix: bytes):
+    for key, value in fetched.items():
+        if isinstance(key, bytes) and key.upper().startswith(prefix):
+            return value
+    return None
+
+
+
+_BASE64_WHITESPACE = b' \t\r\n'
+
+
+def _iter_str_slices(payload, size: int = SPOOL_CHUNK_SIZE):
+    """按块切分 MIME 部件的原始（未解码）载荷"""
+    for start in range(0, len(payload or ''), size):
+        chunk = payload[start:start + size]
+        yield chunk.encode('ascii', errors='ignore') if isinstance(chunk, str) else chunk
+
+
+def _iter_decoded(chunks, encoding: str):
+    """按 Content-Transfer-Encoding 增量解码：base64 每次只解码 4 字节对齐的部分，余下留到下一块"""
+    if encoding == 'base64':
+        pending = b''
+        for chunk in chunks:
+            data = pending + bytes(chunk).translate(None, _BASE64_WHITESPACE)
+            cut = len(data) - len(data) % 4
+            pending = data[cut:]
+            if cut:
+                yield base64.b64decode(data[:cut])
+        if pending.rstrip(b'='):
+            yield base64.b64decode(pending + b'=' * (-len(pending) % 4))
+    elif encoding == 'quoted-printable':
+        # quoted-printable 的软换行可能跨块，整体解码（PDF 附件极少使用此编码）
+        yield quopri.decodestring(b''.join(bytes(c) for c in chunks))
+    else:
+        for chunk in chunks:
+            yield bytes(chunk)
+
+
+
 
 class EmailService:
     """邮箱服务类"""
     
+    # 正文链接下载未完成的邮件积压上限，超过后等待下载完成再继续处理
+    MAX_PENDING_LINK_EMAILS = 100
+    
     def __init__(self, db: Session):
         self.db = db
         self.invoice_service = InvoiceService(db)
         self.email_list_service = EmailListService(db)
+        self.link_cache = get_link_fingerprint_cache()
+        # 正文链接仍在下载中的邮件，下载完成后再更新扫描状态
+        self._pending_link_emails: List[Dict[str, Any]] = []
+        # 已算好扫描状态、等待按块批量写入的邮件记录
+        self._pending_email_rows: List[Dict[str, Any]] = []
+        # 本次扫描中已通过重复预判的文件 sha256
+        self._scan_seen_sha256: set = set()
         
     def encrypt_password(self, password: str) -> str:
         """加密密码（改进：若提供密钥则使用AES-GCM，否则回退Base64）"""
@@ -82,7 +304,8 @@ class EmailService:
         imap_port: int,
         username: str, 
         password: str,
-        scan_days: int = 7
+        scan_days: int = 7,
+        scan_folders: Optional[List[str]] = None
     ) -> EmailConfig:
         """创建邮箱配置"""
         encrypted_password = self.encrypt_password(password)
@@ -100,6 +323,7 @@ class EmailService:
             existing_config.username = username
             existing_config.password_encrypted = encrypted_password
             existing_config.scan_days = scan_days
+            existing_config.scan_folders = scan_folders
             existing_config.is_active = True
             self.db.commit()
             return existing_config
@@ -113,6 +337,7 @@ class EmailService:
                 username=username,
                 password_encrypted=encrypted_password,
                 scan_days=scan_days,
+                scan_folders=scan_folders,
                 is_active=True
             )
             self.db.add(config)
@@ -148,13 +373,20 @@ class EmailService:
             logger.error(f"邮箱连接测试失败: {str(e)}")
             return False
     
-    def scan_emails(self, config: EmailConfig, days: int = 7, with_stats: bool = False) -> List[Dict]:
-        """扫描邮箱中的发票"""
+    def scan_emails(self, config: EmailConfig, days: int = 7, with_stats: bool = False,
+                    deadline: Optional[float] = None) -> List[Dict]:
+        """扫描邮箱中的发票。
+        按 scan_folders（未配置时为 EMAIL_SCAN_FOLDERS）扫描一个或多个文件夹，每个文件夹在 email_scan_cursors
+        中独立维护 UID 状态；多个文件夹时由少量已登录连接并发扫描（EMAIL_FOLDER_CONCURRENCY）。
+        每处理一块邮件就提交一次检查点，中断后下次从检查点继续；
+        deadline 为 time.monotonic() 截止时间，到期后在块边界停止，统计中 incomplete=True，由调用方续扫。
+        """
         scan_start_time = datetime.now()
         total_emails = 0
         processed_emails = 0
         found_invoices = 0
         errors = []
+        stopped = False
         
         try:
             # 记录扫描开始
@@ -172,127 +404,52 @@ class EmailService:
             
             password = self.decrypt_password(config.password_encrypted)
             results = []
+            self._scan_seen_sha256 = set()
             
-            # 连接IMAP服务器
-            mail = imaplib.IMAP4_SSL(config.imap_server, config.imap_port)
-            login_time = datetime.now()
-            mail.login(config.username, password)
-            status_select, _ = mail.select('inbox')
-            # 读取 UIDVALIDITY
-            current_uid_validity = None
+            # 连接IMAP服务器，确定要扫描的文件夹
+            mail = self._imap_connect(config, password)
             try:
-                mailbox_status, mailbox_info = mail.status('inbox', '(UIDVALIDITY)')
-                if mailbox_status == 'OK' and mailbox_info and mailbox_info[0]:
-                    import re as _re
-                    m = _re.search(rb'UIDVALIDITY\s+(\d+)', mailbox_info[0])
-                    if m:
-                        current_uid_validity = int(m.group(1))
+                folders = self._resolve_scan_folders(mail, config)
             except Exception:
-                current_uid_validity = None
+                self._imap_logout(mail)
+                raise
             
             # 降噪：登录成功不再单条记录，仅计入完成统计
             
-            # 始终使用基于 UID 的扫描（首次全量 ALL，之后增量 from last_seen_uid+1）
-            email_ids = []
-            try:
-                # 若 UIDVALIDITY 改变，重置 last_seen_uid 并更新 uid_validity
-                if current_uid_validity and getattr(config, 'uid_validity', None) and config.uid_validity != current_uid_validity:
-                    config.last_seen_uid = None
-                if current_uid_validity and getattr(config, 'uid_validity', None) != current_uid_validity:
-                    config.uid_validity = current_uid_validity
-
-                if getattr(config, 'last_seen_uid', None):
-                    # 增量扫描：抓取 last_seen_uid 之后的所有 UID
-                    status, messages = mail.uid('search', None, f'(UID {config.last_seen_uid + 1}:*)')
-                else:
-                    # 首次全量：ALL（可能很大）
-                    status, messages = mail.uid('search', None, 'ALL')
-
-                if status == 'OK' and messages and messages[0]:
-                    email_ids = messages[0].split()
-                
-                if email_ids:
-                    total_emails = len(email_ids)
-            except Exception as e:
-                errors.append(f"UID 搜索失败: {str(e)}")
-            
-            # 降噪：中间态信息不再单条记录，仅计入完成统计
-            
-            if email_ids:
-                # 仅使用 UID FETCH 抓取
-                use_uid = True
-
-                max_uid_seen = config.last_seen_uid or 0
-                batch_size = 50
-                ids_to_process = email_ids  # 按需求收集所有邮件，不再限制 200 封
-                for idx, eid in enumerate(ids_to_process):
-                    try:
-                        # UID FETCH 并校验结果结构
-                        status, msg_data = mail.uid('fetch', eid, '(RFC822)')
-
-                        valid = False
-                        email_body = None
-                        if status == 'OK' and msg_data and isinstance(msg_data, (list, tuple)) and len(msg_data) > 0:
-                            first = msg_data[0]
-                            if isinstance(first, (list, tuple)) and len(first) > 1 and isinstance(first[1], (bytes, bytearray)):
-                                email_body = first[1]
-                                valid = True
-
-                        if not valid:
-                            eid_str = eid.decode() if isinstance(eid, (bytes, bytearray)) else str(eid)
-                            error_msg = f"处理邮件失败 [UID: {eid_str}]: 无法获取RFC822正文（uid fetch）"
-                            logger.error(error_msg)
-                            errors.append(error_msg)
-                            continue
-
-                        email_message = email.message_from_bytes(email_body)
-
-                        # 处理邮件
-                        eid_str = eid.decode() if isinstance(eid, (bytes, bytearray)) else str(eid)
-                        result = self._process_email(
-                            config.user_id,
-                            email_message,
-                            eid_str,
-                            uid_validity=current_uid_validity
-                        )
-                        processed_emails += 1
-
-                        # 更新最大 UID
-                        try:
-                            uid_int = int(eid)
-                            if uid_int > max_uid_seen:
-                                max_uid_seen = uid_int
-                        except Exception:
-                            pass
-
-                        if result:
-                            results.extend(result)
-                            found_invoices += len(result)
-                                
-                    except Exception as e:
-                        eid_str = eid.decode() if isinstance(eid, (bytes, bytearray)) else str(eid)
-                        error_msg = f"处理邮件失败 [ID: {eid_str}]: {str(e)}"
-                        logger.error(error_msg)
-                        errors.append(error_msg)
-                        continue
-                    
-                    # 分批提交，降低单次事务压力
-                    if (idx + 1) % batch_size == 0:
-                        try:
-                            self.db.commit()
-                        except Exception:
-                            self.db.rollback()
+            workers = max(1, min(settings.EMAIL_FOLDER_CONCURRENCY, len(folders)))
+            if workers == 1:
+                outcomes = []
+                try:
+                    for folder in folders:
+                        if outcomes and deadline is not None and time.monotonic() >= deadline:
+                            stopped = True
+                            break
+                        outcomes.append(self._scan_folder(mail, config, folder, days, deadline))
+                finally:
+                    self._imap_logout(mail)
+            else:
+                outcomes, deadline_hit = self._scan_folders_concurrently(
+                    mail, config, password, folders, days, deadline, workers
+                )
+                stopped = stopped or deadline_hit
             
-            mail.close()
-            mail.logout()
+            inbox_state = None
+            for outcome in outcomes:
+                results.extend(outcome['results'])
+                total_emails += outcome['total']
+                processed_emails += outcome['processed']
+                errors.extend(outcome['errors'])
+                stopped = stopped or outcome['stopped']
+                if outcome['folder'] == 'INBOX' and outcome['last_seen_uid']:
+                    inbox_state = outcome
+            found_invoices = len(results)
             
-            # 更新最后扫描时间与last_seen_uid（若有）
-            config.last_scan_time = datetime.now()
-            try:
-                if 'max_uid_seen' in locals() and max_uid_seen and (not getattr(config, 'last_seen_uid', None) or max_uid_seen > config.last_seen_uid):
-                    config.last_seen_uid = max_uid_seen
-            except Exception:
-                pass
+            # 收件箱状态同步回配置（兼容仍读取 last_seen_uid/uid_validity 的代码）；未扫完时不更新扫描时间
+            if inbox_state is not None:
+                config.uid_validity = inbox_state['uid_validity']
+                config.last_seen_uid = inbox_state['last_seen_uid']
+            if not stopped:
+                config.last_scan_time = datetime.now()
             self.db.commit()
             
             # 记录扫描完成
@@ -304,12 +461,14 @@ class EmailService:
                 user_id=config.user_id,
                 details={
                     "email_address": config.email_address,
+                    "folders": [outcome['folder'] for outcome in outcomes],
                     "total_emails": total_emails,
                     "processed_emails": processed_emails,
                     "found_invoices": found_invoices,
                     "scan_duration": scan_duration,
                     "success_rate": round(processed_emails / total_emails * 100, 2) if total_emails > 0 else 100,
-                    "errors_count": len(errors)
+                    "errors_count": len(errors),
+                    "incomplete": stopped
                 }
             )
             
@@ -322,6 +481,7 @@ class EmailService:
                     "processed_emails": processed_emails,
                     "found_invoices": found_invoices,
                     "errors_count": len(errors),
+                    "incomplete": stopped,
                 }
             return results
             
@@ -351,10 +511,656 @@ class EmailService:
             except Exception as commit_error:
                 logger.error(f"提交错误日志失败: {str(commit_error)}")
             
+            if with_stats:
+                return [], {
+                    "total_emails": total_emails,
+                    "processed_emails": processed_emails,
+                    "found_invoices": 0,
+                    "errors_count": len(errors) + 1,
+                    "incomplete": False,
+                }
             return []
     
-    def _process_email(self, user_id: int, email_message, email_id: str = None, uid_validity: int = None) -> List[Dict]:
-        """处理单封邮件"""
+    def _imap_connect(self, config: EmailConfig, password: str):
+        mail = imaplib.IMAP4_SSL(config.imap_server, config.imap_port)
+        mail.login(config.username, password)
+        return mail
+    
+    @staticmethod
+    def _imap_logout(mail) -> None:
+        try:
+            mail.close()
+        except Exception:
+            pass
+        try:
+            mail.logout()
+        except Exception:
+            pass
+    
+    def _resolve_scan_folders(self, mail, config: EmailConfig) -> List[str]:
+        """要扫描的文件夹：配置的 scan_folders，未配置时为 EMAIL_SCAN_FOLDERS；"*" 表示通过 LIST 自动发现"""
+        folders = config.scan_folders or [f.strip() for f in settings.EMAIL_SCAN_FOLDERS.split(',') if f.strip()]
+        if '*' in folders:
+            folders = self._discover_folders(mail) + [f for f in folders if f != '*']
+        resolved = []
+        for folder in folders:
+            folder = 'INBOX' if folder.upper() == 'INBOX' else folder
+            if folder not in resolved:
+                resolved.append(folder)
+        return resolved or ['INBOX']
+    
+    def _discover_folders(self, mail) -> List[str]:
+        """LIST 自动发现可能存放发票的文件夹：收件箱与其他可选择的文件夹，
+        按 special-use 标志（RFC 6154）及常见名称排除已发送、草稿、垃圾、已删除与“所有邮件”等
+        """
+        status, data = mail.list()
+        if status != 'OK':
+            return ['INBOX']
+        folders = ['INBOX']
+        for line in data or []:
+            # 以 literal 返回的名称（少见）跳过
+            if not isinstance(line, (bytes, bytearray)):
+                continue
+            match = _LIST_RE.match(bytes(line))
+            if not match:
+                continue
+            flags = {flag.lower() for flag in match.group('flags').split()}
+            if flags & _SKIP_FOLDER_FLAGS:
+                continue
+            name = _imap_unquote(match.group('name'))
+            try:
+                folder = imap_utf7.decode(name)
+            except Exception:
+                folder = name.decode('utf-8', errors='replace')
+            delimiter = _imap_unquote(match.group('delim')).decode('ascii', errors='ignore')
+            leaf = folder.rsplit(delimiter, 1)[-1] if delimiter and delimiter != 'NIL' else folder
+            if folder.upper() == 'INBOX' or leaf.strip().lower() in _SKIP_FOLDER_NAMES:
+                continue
+            folders.append(folder)
+        return folders
+    
+    def _scan_folders_concurrently(self, mail, config: EmailConfig, password: str, folders: List[str],
+                                   days: int, deadline: Optional[float], workers: int):
+        """多个已登录连接并发扫描文件夹：每个工作线程使用独立的 IMAP 连接与数据库会话，依次领取文件夹。
+        返回 (各文件夹结果, 是否因时间片用完而留有未扫描的文件夹)
+        """
+        pending = queue.Queue()
+        for folder in folders:
+            pending.put(folder)
+        outcomes: List[Dict[str, Any]] = []
+        outcomes_lock = threading.Lock()
+        deadline_hit = threading.Event()
+        
+        def _worker(conn):
+            db = SessionLocal()
+            # 本次扫描内的重复预判跨文件夹共享
+            service = EmailService(db)
+            service._scan_seen_sha256 = self._scan_seen_sha256
+            try:
+                worker_config = db.query(EmailConfig).filter(EmailConfig.id == config.id).first()
+                if conn is None:
+                    conn = service._imap_connect(worker_config, password)
+                while True:
+                    if deadline is not None and time.monotonic() >= deadline and not pending.empty():
+                        deadline_hit.set()
+                        return
+                    try:
+                        folder = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    outcome = service._scan_folder(conn, worker_config, folder, days, deadline)
+                    with outcomes_lock:
+                        outcomes.append(outcome)
+            except Exception as e:
+                # 该连接不可用时，剩余文件夹由其他连接继续领取
+                logger.error(f"文件夹扫描连接失败: {config.email_address}, 错误: {str(e)}")
+                with outcomes_lock:
+                    outcomes.append(self._folder_outcome(None, errors=[f"文件夹扫描连接失败: {str(e)}"]))
+            finally:
+                if conn is not None:
+                    self._imap_logout(conn)
+                db.close()
+        
+        # 第一个工作线程复用已登录的连接
+        threads = [
+            threading.Thread(target=_worker, args=(mail if index == 0 else None,),
+                             name=f"email-folder-{index}", daemon=True)
+            for index in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        unscanned = []
+        while not pending.empty():
+            unscanned.append(pending.get_nowait())
+        if unscanned and not deadline_hit.is_set():
+            outcomes.append(self._folder_outcome(None, errors=[f"文件夹未扫描（连接失败）: {', '.join(unscanned)}"]))
+        return outcomes, deadline_hit.is_set()
+    
+    @staticmethod
+    def _folder_outcome(folder: Optional[str], errors: List[str] = None) -> Dict[str, Any]:
+        return {
+            'folder': folder,
+            'results': [],
+            'total': 0,
+            'processed': 0,
+            'errors': errors or [],
+            'stopped': False,
+            'uid_validity': None,
+            'last_seen_uid': None,
+        }
+    
+    def _scan_folder(self, mail, config: EmailConfig, folder: str, days: int,
+                     deadline: Optional[float] = None) -> Dict[str, Any]:
+        """扫描单个文件夹：按该文件夹的 UID 状态检索候选邮件并分块处理，返回结果与统计"""
+        outcome = self._folder_outcome(folder)
+        results = outcome['results']
+        errors = outcome['errors']
+        self._pending_link_emails = []
+        self._pending_email_rows = []
+        mailbox = _imap_mailbox(folder)
+        
+        try:
+            status_select, _ = mail.select(mailbox)
+            if status_select != 'OK':
+                errors.append(f"无法打开文件夹: {folder}")
+                return outcome
+            # 读取 UIDVALIDITY 与 UIDNEXT（检索前读取，扫描完成后以 UIDNEXT-1 推进 last_seen_uid）
+            current_uid_validity = None
+            uid_next = None
+            try:
+                mailbox_status, mailbox_info = mail.status(mailbox, '(UIDVALIDITY UIDNEXT)')
+                if mailbox_status == 'OK' and mailbox_info and mailbox_info[0]:
+                    m = re.search(rb'UIDVALIDITY\s+(\d+)', mailbox_info[0])
+                    if m:
+                        current_uid_validity = int(m.group(1))
+                    m = re.search(rb'UIDNEXT\s+(\d+)', mailbox_info[0])
+                    if m:
+                        uid_next = int(m.group(1))
+            except Exception:
+                current_uid_validity = None
+            
+            # 该文件夹的 UID 状态；UIDVALIDITY 改变时作废
+            cursor = self._get_scan_cursor(config, folder)
+            if current_uid_validity and cursor.uid_validity and cursor.uid_validity != current_uid_validity:
+                cursor.last_seen_uid = None
+                cursor.last_committed_uid = None
+            if current_uid_validity:
+                cursor.uid_validity = current_uid_validity
+            last_seen_uid = cursor.last_seen_uid or 0
+            
+            # 始终使用基于 UID 的扫描（首次按 SINCE 日期，之后增量 from last_seen_uid+1），服务端按发票特征过滤
+            email_ids = []
+            search_complete = False
+            try:
+                # 上次扫描中断时的检查点
+                start_uid = max(last_seen_uid, cursor.last_committed_uid or 0)
+                if last_seen_uid:
+                    # 增量扫描：抓取 last_seen_uid（或检查点）之后的所有 UID
+                    base_criteria = [f'UID {start_uid + 1}:*']
+                else:
+                    # 首次扫描：按 days 限定日期；UIDVALIDITY 重置后从上次扫描时间附近开始
+                    since = datetime.now() - timedelta(days=max(1, days or 1))
+                    if cursor.last_scan_time:
+                        since = max(since, cursor.last_scan_time - timedelta(days=1))
+                    base_criteria = [f'SINCE {_imap_date(since)}']
+                    if start_uid:
+                        base_criteria.append(f'UID {start_uid + 1}:*')
+                
+                email_ids = self._search_candidate_uids(mail, base_criteria)
+                if start_uid:
+                    # “n:*” 在没有更大 UID 时仍会返回最后一封邮件
+                    email_ids = [uid for uid in email_ids if int(uid) > start_uid]
+                search_complete = True
+                outcome['total'] = len(email_ids)
+            except imaplib.IMAP4.abort:
+                raise
+            except Exception as e:
+                errors.append(f"UID 搜索失败 [{folder}]: {str(e)}")
+            
+            # 降噪：中间态信息不再单条记录，仅计入完成统计
+            
+            max_uid_seen = last_seen_uid
+            checkpoint_uid = 0
+            if email_ids:
+                # 与抓取块对齐：每块一次已扫描查询、一次批量重复预判、一条邮件记录 upsert 并提交
+                batch_size = max(1, settings.EMAIL_FETCH_CHUNK_SIZE)
+                dedup_from = 0
+                # 分块 UID FETCH 由后台线程预取，解析与入库在当前线程进行，两者重叠执行；
+                # 默认先取头部与 BODYSTRUCTURE，仅下载候选邮件的正文与 PDF 部件
+                if settings.EMAIL_SCAN_HEADERS_FIRST:
+                    def fetch_chunk(conn, chunk):
+                        return self._fetch_headers_first_chunk(
+                            conn, chunk, config.user_id, current_uid_validity, folder
+                        )
+                else:
+                    fetch_chunk = self._fetch_rfc822_chunk
+                
+                def _scan_batch(batch):
+                    nonlocal max_uid_seen, dedup_from, checkpoint_uid
+                    processed = self._scan_email_batch(
+                        config.user_id, batch, current_uid_validity, results, errors, folder
+                    )
+                    outcome['processed'] += len(processed)
+                    for uid in processed:
+                        try:
+                            max_uid_seen = max(max_uid_seen, int(uid))
+                        except Exception:
+                            pass
+                    self._mark_duplicates(config.user_id, results[dedup_from:])
+                    dedup_from = len(results)
+                    # 检查点与本块邮件记录在同一事务中提交；正文链接仍在下载的邮件之前不推进
+                    checkpoint_uid = max(checkpoint_uid, self._pending_link_floor(max_uid_seen))
+                    self._set_scan_cursor(cursor, checkpoint_uid)
+                    self._flush_email_rows(config.user_id)
+                
+                batch = []
+                pipeline = self._fetch_messages_pipelined(mail, email_ids, fetch_chunk)
+                try:
+                    for eid_str, fetched, fetch_error in pipeline:
+                        if fetch_error:
+                            logger.error(fetch_error)
+                            errors.append(fetch_error)
+                            continue
+                        batch.append((eid_str, fetched))
+                        fetched = None
+                        if len(batch) >= batch_size:
+                            _scan_batch(batch)
+                            batch = []
+                            if deadline is not None and time.monotonic() >= deadline:
+                                # 时间片用完：在块边界停止，剩余邮件由续扫任务从检查点继续
+                                outcome['stopped'] = True
+                                break
+                    if batch:
+                        _scan_batch(batch)
+                        batch = []
+                finally:
+                    # 提前结束时停止预取线程，归还 IMAP 连接
+                    pipeline.close()
+            
+            # 等待剩余的正文链接下载完成，对尚未判定的结果做最后一次批量重复预判并写入邮件记录
+            results.extend(self._collect_link_downloads(wait=True))
+            self._mark_duplicates(config.user_id, results)
+            self._flush_email_rows(config.user_id)
+            if outcome['stopped']:
+                # 未扫完：只保留检查点，last_seen_uid 待续扫完成后更新
+                self._set_scan_cursor(cursor, max_uid_seen)
+            elif search_complete:
+                if not errors and uid_next:
+                    # 检索与处理均无错误时，被服务端过滤掉的邮件也视为已扫描，下次不再重复检索
+                    max_uid_seen = max(max_uid_seen, uid_next - 1)
+                if max_uid_seen:
+                    cursor.last_seen_uid = max_uid_seen
+                    cursor.last_committed_uid = max_uid_seen
+                cursor.last_scan_time = datetime.now()
+            self.db.commit()
+            outcome['uid_validity'] = cursor.uid_validity
+            outcome['last_seen_uid'] = cursor.last_seen_uid
+        except Exception as e:
+            # 保留已提交部分的结果，其余由下次扫描从检查点继续
+            self.db.rollback()
+            logger.error(f"扫描文件夹失败: {config.email_address} [{folder}], 错误: {str(e)}")
+            errors.append(f"扫描文件夹失败 [{folder}]: {str(e)}")
+        return outcome
+    
+    def _get_scan_cursor(self, config: EmailConfig, folder: str) -> EmailScanCursor:
+        """获取（不存在则新建，随下一次提交写入）邮箱配置在某文件夹的 UID 状态；
+        收件箱首次建立时沿用配置上原有的 last_seen_uid/uid_validity/last_scan_time
+        """
+        cursor = self.db.query(EmailScanCursor).filter(
+            EmailScanCursor.config_id == config.id,
+            EmailScanCursor.folder == folder
+        ).first()
+        if cursor is None:
+            cursor = EmailScanCursor(config_id=config.id, folder=folder)
+            if folder == 'INBOX':
+                cursor.uid_validity = config.uid_validity
+                cursor.last_seen_uid = config.last_seen_uid
+                cursor.last_scan_time = config.last_scan_time
+            self.db.add(cursor)
+        elif folder == 'INBOX' and cursor.last_seen_uid is None and config.last_seen_uid \
+                and cursor.uid_validity in (None, config.uid_validity):
+            # 早期版本只记录了中断检查点，已完成的扫描状态仍在配置上
+            cursor.uid_validity = config.uid_validity
+            cursor.last_seen_uid = config.last_seen_uid
+            cursor.last_scan_time = cursor.last_scan_time or config.last_scan_time
+        return cursor
+    
+    def _set_scan_cursor(self, cursor: EmailScanCursor, uid: Optional[int]) -> None:
+        """推进检查点（随邮件记录一同提交）"""
+        if uid and uid > (cursor.last_committed_uid or 0):
+            cursor.last_committed_uid = uid
+    
+    def _pending_link_floor(self, uid: int) -> int:
+        """正文链接仍在下载的邮件尚未写入记录：检查点不能越过其中最小的 UID"""
+        pending = [int(entry['uid']) for entry in self._pending_link_emails if str(entry.get('uid', '')).isdigit()]
+        if not pending:
+            return uid
+        return min(uid, min(pending) - 1)
+    
+    def _uid_search(self, mail, *criteria, charset: str = None) -> List[bytes]:
+        status, data = mail.uid('search', charset, *criteria)
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"SEARCH 返回 {status}: {data}")
+        return data[0].split() if data and data[0] else []
+
+    def _search_candidate_uids(self, mail, base_criteria: List[str]) -> List[bytes]:
+        """服务端检索候选邮件 UID：base_criteria 之内，主题命中发票关键词或带附件（multipart/mixed）。
+        英文关键词与附件条件合并为一条 OR 检索；中文关键词以 CHARSET UTF-8 + literal 逐个检索后合并。
+        服务器不支持（BADCHARSET、HEADER 检索等）时回退为仅按 base_criteria 检索，由客户端判定候选。
+        """
+        if not settings.EMAIL_SEARCH_FILTER:
+            return self._uid_search(mail, *base_criteria)
+        try:
+            keywords = _search_keywords()
+            ascii_terms = [f'SUBJECT "{k}"' for k in keywords if k.isascii()]
+            ascii_terms.append('HEADER Content-Type "multipart/mixed"')
+            expression = ascii_terms[-1]
+            for term in reversed(ascii_terms[:-1]):
+                expression = f'OR {term} {expression}'
+            uids = set(self._uid_search(mail, *base_criteria, expression))
+            for keyword in keywords:
+                if keyword.isascii():
+                    continue
+                # imaplib 仅支持一个 literal，且附加在命令末尾
+                mail.literal = keyword.encode('utf-8')
+                try:
+                    uids.update(self._uid_search(mail, *base_criteria, 'SUBJECT', charset='CHARSET UTF-8'))
+                finally:
+                    mail.literal = None
+            return sorted(uids, key=int)
+        except imaplib.IMAP4.abort:
+            raise
+        except Exception as e:
+            logger.info(f"服务端条件检索不可用，回退为仅按日期/UID检索: {e}")
+            return self._uid_search(mail, *base_criteria)
+
+    def _fetch_messages_pipelined(self, mail, uids, fetch_chunk: Callable = None,
+                                  chunk_size: int = None, prefetch_chunks: int = None):
+        """流水线抓取邮件：生产者线程按块调用 fetch_chunk(mail, uids)（如 1000,1001,...,1049），
+        通过有界队列交给调用方逐封处理；队列上限控制同时驻留内存的块数。
+        逐个产出 (uid, 抓取结果 | None, 错误信息 | None)，抓取结果为原始邮件字节或两阶段抓取的字典。
+        生产者独占 IMAP 连接直至结束，调用方在迭代完成前不得使用该连接。
+        """
+        fetch_chunk = fetch_chunk or self._fetch_rfc822_chunk
+        chunk_size = max(1, chunk_size or settings.EMAIL_FETCH_CHUNK_SIZE)
+        prefetch_chunks = max(1, prefetch_chunks or settings.EMAIL_FETCH_PREFETCH_CHUNKS)
+        uids = [u.decode() if isinstance(u, (bytes, bytearray)) else str(u) for u in uids]
+        chunks = [uids[i:i + chunk_size] for i in range(0, len(uids), chunk_size)]
+        fetched = queue.Queue(maxsize=prefetch_chunks)
+        stop = threading.Event()
+
+        def _put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    fetched.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def _produce():
+            try:
+                for position, chunk in enumerate(chunks):
+                    if stop.is_set():
+                        return
+                    try:
+                        item = (chunk, fetch_chunk(mail, chunk), None)
+                    except Exception as e:
+                        item = (chunk, None, e)
+                    if not _put(item):
+                        return
+                    if isinstance(item[2], imaplib.IMAP4.abort):
+                        # 连接已不可用，后续块无法继续抓取
+                        for rest in chunks[position + 1:]:
+                            if not _put((rest, None, item[2])):
+                                return
+                        return
+            finally:
+                _put(None)
+
+        producer = threading.Thread(target=_produce, name="imap-fetch", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = fetched.get()
+                if item is None:
+                    break
+                chunk, messages, error = item
+                if error is not None:
+                    for uid in chunk:
+                        yield uid, None, f"处理邮件失败 [UID: {uid}]: 批量抓取失败（uid fetch）: {error}"
+                    continue
+                for uid in chunk:
+                    message = messages.pop(uid, None)
+                    if isinstance(message, (bytes, bytearray, dict)):
+                        yield uid, message, None
+                    else:
+                        yield uid, None, f"处理邮件失败 [UID: {uid}]: 无法获取邮件内容（uid fetch）"
+        finally:
+            stop.set()
+            producer.join()
+
+    def _fetch_rfc822_chunk(self, mail, uids: List[str]) -> Dict[str, bytes]:
+        """整封抓取一块邮件，返回 {uid: 原始邮件字节}"""
+        status, data = mail.uid('fetch', ','.join(uids), '(UID RFC822)')
+        if status != 'OK':
+            return {}
+        return dict(_parse_fetch_literals(data))
+
+    def _fetch_headers_first_chunk(self, mail, uids: List[str], user_id: int,
+                                   uid_validity: Optional[int] = None, folder: str = 'INBOX') -> Dict[str, Any]:
+        """两阶段抓取一块邮件：先取头部字段与 BODYSTRUCTURE，仅对候选邮件按部件下载正文与 PDF 附件。
+        头部取回后即按邮件唯一键查询已扫描的邮件，这些邮件不再下载任何部件。
+        返回 {uid: {'headers', 'content'}}；服务器未返回结构或结构无法解析的邮件回退为整封 RFC822。
+        """
+        status, data = mail.uid('fetch', ','.join(uids), HEADER_FETCH_ITEMS)
+        if status != 'OK':
+            return {}
+        try:
+            responses = parse_fetch_response(data, normalise_times=False, uid_is_key=True)
+        except Exception as e:
+            logger.warning(f"解析 BODYSTRUCTURE 响应失败，回退整封抓取: {e}")
+            return self._fetch_rfc822_chunk(mail, uids)
+        data = None
+
+        candidates = []
+        for uid, fetched in responses.items():
+            uid = str(uid)
+            structure = fetched.get(b'BODYSTRUCTURE')
+            header_bytes = _fetch_value(fetched, b'BODY[HEADER')
+            if structure is None or header_bytes is None:
+                continue
+            headers = email.message_from_bytes(header_bytes)
+            candidates.append((uid, headers, structure, self._message_key(headers, uid, uid_validity, folder)))
+        scanned = self._scanned_message_ids(user_id, [c[3] for c in candidates])
+
+        messages: Dict[str, Any] = {}
+        for uid, headers, structure, message_id in candidates:
+            try:
+                messages[uid] = self._load_candidate_parts(
+                    mail, uid, user_id, headers, _walk_bodystructure(structure), download=message_id not in scanned
+                )
+            except imaplib.IMAP4.abort:
+                raise
+            except Exception as e:
+                logger.warning(f"按部件抓取邮件失败，回退整封抓取 [UID: {uid}]: {e}")
+
+        fallback = [uid for uid in uids if uid not in messages]
+        if fallback:
+            messages.update(self._fetch_rfc822_chunk(mail, fallback))
+        return messages
+
+    def _scanned_message_ids(self, user_id: int, message_ids: List[str]) -> set:
+        """查询已扫描的邮件唯一键；在抓取线程中调用，使用独立会话"""
+        if not message_ids:
+            return set()
+        db = SessionLocal()
+        try:
+            return EmailListService(db).get_scanned_message_ids(user_id, message_ids)
+        except Exception as e:
+            logger.warning(f"查询已扫描邮件失败，按未扫描抓取: {str(e)}")
+            return set()
+        finally:
+            db.close()
+
+    def _load_candidate_parts(self, mail, uid: str, user_id: int, headers,
+                              parts: List[Dict[str, Any]], download: bool = True) -> Dict[str, Any]:
+        """根据 BODYSTRUCTURE 生成附件信息；候选邮件再用 BODY.PEEK[n] 下载正文，
+        PDF 附件按 BODY.PEEK[n]<offset.length> 分段抓取并直接解码落盘。download 为 False（已扫描）时不下载任何部件。
+        """
+        subject = self._decode_mime_words(headers.get('Subject', ''))
+        attachment_parts = [p for p in parts if p['disposition'] == 'attachment']
+        for part in attachment_parts:
+            part['filename'] = self._decode_mime_words(part['filename']) if part['filename'] else None
+        pdf_parts = [
+            p for p in attachment_parts
+            if (p['filename'] and p['filename'].lower().endswith('.pdf')) or p['content_type'] == 'application/pdf'
+        ]
+        content = {
+            'body_text': None,
+            'body_html': None,
+            'pdf_attachments': [],
+            'attachments': [
+                {
+                    'filename': p['filename'],
+                    'content_type': p['content_type'],
+                    'size': _decoded_size(p['size'], p['encoding']),
+                    'is_pdf': p['filename'].lower().endswith('.pdf'),
+                }
+                for p in attachment_parts if p['filename']
+            ],
+        }
+        if not download or not self._is_invoice_candidate(subject, pdf_parts):
+            return {'headers': headers, 'content': content}
+
+        text_part = next((p for p in parts if p['content_type'] == 'text/plain' and p['disposition'] != 'attachment'), None)
+        html_part = next((p for p in parts if p['content_type'] == 'text/html' and p['disposition'] != 'attachment'), None)
+        text_parts = [p for p in (text_part, html_part) if p]
+        if text_parts:
+            fetched = self._fetch_parts(mail, uid, ' '.join(f"BODY.PEEK[{p['part']}]" for p in text_parts))
+
+            def _text(part) -> Optional[str]:
+                raw = _decode_part(fetched.get(f"BODY[{part['part']}]".encode()), part['encoding'])
+                try:
+                    return raw.decode(part['charset'] or 'utf-8', errors='ignore') or None
+                except LookupError:
+                    return raw.decode('utf-8', errors='ignore') or None
+
+            if text_part:
+                content['body_text'] = _text(text_part)
+            if html_part:
+                content['body_html'] = _text(html_part)
+
+        for part in pdf_parts:
+            stored = store_pdf_stream(
+                user_id, _iter_decoded(self._iter_part_chunks(mail, uid, part['part']), part['encoding'])
+            )
+            if stored:
+                stored['filename'] = part['filename'] or f"invoice_{len(content['pdf_attachments']) + 1}.pdf"
+                content['pdf_attachments'].append(stored)
+        return {'headers': headers, 'content': content}
+
+    def _fetch_parts(self, mail, uid: str, items: str) -> Dict[bytes, Any]:
+        """对单封邮件执行 UID FETCH，返回解析后的数据项字典"""
+        status, data = mail.uid('fetch', uid, f'(UID {items})')
+        if status != 'OK':
+            raise RuntimeError(f"UID FETCH 失败: {status}")
+        responses = parse_fetch_response(data, normalise_times=False, uid_is_key=True)
+        return responses.get(int(uid)) or next(iter(responses.values()), {})
+
+    def _iter_part_chunks(self, mail, uid: str, part: str, chunk_size: int = None):
+        """按 BODY.PEEK[n]<offset.length> 分段抓取单个 MIME 部件的原始载荷，单次驻留内存不超过 chunk_size"""
+        chunk_size = max(4096, chunk_size or settings.EMAIL_ATTACHMENT_FETCH_SIZE)
+        offset = 0
+        while True:
+            fetched = self._fetch_parts(mail, uid, f"BODY.PEEK[{part}]<{offset}.{chunk_size}>")
+            chunk = _fetch_value(fetched, f"BODY[{part}]".encode())
+            if not chunk:
+                return
+            yield chunk
+            offset += len(chunk)
+            if len(chunk) < chunk_size:
+                return
+
+    def _read_email_content(self, user_id: int, email_message) -> Dict[str, Any]:
+        """从完整 RFC822 报文中提取正文、附件信息，PDF 附件解码落盘"""
+        return {
+            'body_text': self._get_email_body(email_message, content_type='text'),
+            'body_html': self._get_email_body(email_message, content_type='html'),
+            'pdf_attachments': self._extract_pdf_attachments(email_message, user_id),
+            'attachments': self._get_all_attachments_info(email_message),
+        }
+
+    @staticmethod
+    def _message_key(email_message, email_id: str, uid_validity: int = None, folder: str = 'INBOX') -> str:
+        """邮件记录唯一键：优先 Message-ID；缺失时使用稳定的 UIDVALIDITY:UID 作为回退键，避免重复记录
+        （UID 仅在文件夹内唯一，收件箱以外的文件夹在回退键中带上文件夹名）
+        """
+        message_id = email_message.get('Message-ID')
+        if message_id:
+            return str(message_id).strip()[:255]
+        if folder != 'INBOX':
+            return f"uid:{folder}:{uid_validity or ''}:{email_id}"[:255]
+        if uid_validity:
+            return f"uid:{uid_validity}:{email_id}"
+        return f"uid:{email_id}"
+
+    def _scan_email_batch(self, user_id: int, batch: List[Tuple[str, Any]], uid_validity: Optional[int],
+                          results: List[Dict], errors: List[str], folder: str = 'INBOX') -> List[str]:
+        """处理一个抓取块：一次查询跳过已扫描的邮件，其余邮件生成记录行（暂不写库）；
+        扫描结果追加到 results，返回已处理的 UID 列表
+        """
+        messages = []
+        for uid, fetched in batch:
+            try:
+                if isinstance(fetched, dict):
+                    headers = fetched['headers']
+                    load_content = (lambda content=fetched['content']: content)
+                else:
+                    headers = email.message_from_bytes(fetched)
+                    load_content = (lambda message=headers: self._read_email_content(user_id, message))
+                messages.append((uid, fetched, headers, load_content, self._message_key(headers, uid, uid_validity, folder)))
+            except Exception as e:
+                error_msg = f"处理邮件失败 [ID: {uid}]: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+
+        try:
+            scanned = self.email_list_service.get_scanned_message_ids(user_id, [m[4] for m in messages])
+        except Exception as e:
+            logger.warning(f"查询已扫描邮件失败: {str(e)}")
+            self.db.rollback()
+            scanned = set()
+
+        processed = []
+        for uid, fetched, headers, load_content, message_id in messages:
+            try:
+                if message_id in scanned:
+                    # 降噪：已处理跳过不再单条记录；按部件抓取时已落盘的附件一并清理
+                    if isinstance(fetched, dict):
+                        discard_stored_files(fetched['content']['pdf_attachments'])
+                else:
+                    results.extend(self._process_email_content(user_id, headers, load_content, uid, message_id))
+                processed.append(uid)
+            except Exception as e:
+                error_msg = f"处理邮件失败 [ID: {uid}]: {str(e)}"
+                logger.error(error_msg)
+                errors.append(error_msg)
+
+        # 收集已完成的正文链接下载；积压过多时等待，避免无限堆积
+        results.extend(self._collect_link_downloads(
+            wait=len(self._pending_link_emails) >= self.MAX_PENDING_LINK_EMAILS
+        ))
+        return processed
+
+    def _process_email_content(self, user_id: int, email_message, load_content: Callable[[], Dict[str, Any]],
+                               email_id: str, message_id: str) -> List[Dict]:
+        """处理单封邮件：email_message 至少包含头部，load_content 返回正文、PDF 附件与附件信息。
+        扫描状态在写库前算好，记录行进入 _pending_email_rows，由 _flush_email_rows 按块写入。
+        """
         results = []
         
         try:
@@ -373,16 +1179,16 @@ class EmailService:
                 except Exception:
                     pass
             
-            # 获取邮件正文
-            email_body_text = self._get_email_body(email_message, content_type='text')
-            email_body_html = self._get_email_body(email_message, content_type='html')
+            # 获取邮件正文与附件
+            content = load_content()
+            email_body_text = content['body_text']
+            email_body_html = content['body_html']
+            pdf_attachments = content['pdf_attachments']
+            all_attachments = content['attachments']
             
-            # 处理附件信息
-            pdf_attachments = self._extract_pdf_attachments(email_message)
-            all_attachments = self._get_all_attachments_info(email_message)
-            
-            # 构建邮件数据
-            email_data = {
+            # 构建邮件记录行
+            row = {
+                'message_id': message_id,
                 'subject': subject,
                 'sender': sender,
                 'recipient': recipient,
@@ -396,48 +1202,21 @@ class EmailService:
                 'processing_status': 'processing'
             }
             
-            # 创建或更新邮件记录
-            # 优先使用 Message-ID；缺失时使用稳定的 UIDVALIDITY:UID 作为回退键，避免重复记录
-            message_id = email_message.get('Message-ID')
-            if not message_id:
-                if uid_validity:
-                    message_id = f"uid:{uid_validity}:{email_id}"
-                else:
-                    message_id = f"uid:{email_id}"
-            email_record = self.email_list_service.create_or_update_email(
-                user_id=user_id,
-                message_id=message_id,
-                email_data=email_data
-            )
-            
-            # 如果是已存在的邮件记录且已处理过，直接跳过处理
-            if email_record.invoice_scan_status in ['has_invoice', 'no_invoice'] and email_record.scanned_at:
-                # 降噪：已处理跳过不再单条记录
-                return results  # 返回空结果，不进行重复处理
-            
-            # 标记处理中
-            try:
-                email_record.processing_status = 'processing'
-                self.db.commit()
-            except Exception:
-                self.db.rollback()
-            
-            # 检查是否可能包含发票
-            if not self._is_invoice_email(subject):
-                # 更新邮件状态为无发票
-                self.email_list_service.update_scan_status(
-                    email_id=email_record.id,
-                    user_id=user_id,
-                    scan_status="no_invoice",
+            # 检查是否可能包含发票（主题关键词或带 PDF 附件）
+            if not self._is_invoice_candidate(subject, pdf_attachments):
+                # 降噪：无发票跳过不再单条记录
+                row.update(
+                    invoice_scan_status='no_invoice',
                     invoice_count=0,
                     scan_result={
                         "reason": "no_invoice_keywords",
                         "subject_checked": True,
-                        "attachments_checked": False
-                    }
+                        "attachments_checked": True
+                    },
+                    processing_status='completed',
+                    scanned_at=datetime.now(),
                 )
-                
-                # 降噪：无发票跳过不再单条记录
+                self._pending_email_rows.append(row)
                 return results
             
             # 处理附件
@@ -446,64 +1225,43 @@ class EmailService:
                 if result:
                     results.append(result)
             
-            # 处理邮件正文中的下载链接
+            # 处理邮件正文中的下载链接：提交到异步下载器，完成后由 _collect_link_downloads 收尾
             pdf_links = self._extract_pdf_links(email_body_text or email_body_html or '')
-            for link in pdf_links:
-                result = self._download_and_process_pdf(user_id, link, email_id)
-                if result:
-                    results.append(result)
-            
-            # 更新邮件扫描状态
-            scan_status = "has_invoice" if results else "no_invoice"
-            scan_result = {
-                "attachments_processed": len(pdf_attachments),
-                "links_processed": len(pdf_links),
-                "invoices_found": len(results),
-                "scan_completed": True,
-                "scan_time": datetime.now().isoformat()
-            }
-            
-            self.email_list_service.update_scan_status(
-                email_id=email_record.id,
-                user_id=user_id,
-                scan_status=scan_status,
-                invoice_count=len(results),
-                scan_result=scan_result
-            )
-            
-            # 处理完成
-            try:
-                email_record.processing_status = 'completed'
-                self.db.commit()
-            except Exception:
-                self.db.rollback()
+            # 已知指纹的链接先按指纹批量做去重判定，命中则无需下载
+            fingerprints = [(link, self.link_cache.get(self.db, link)) for link in pdf_links]
+            duplicates = self._cached_link_duplicates(user_id, fingerprints)
+            downloads = []
+            for link, fingerprint in fingerprints:
+                if link in duplicates:
+                    results.append(duplicates[link])
+                    continue
+                downloads.append((link, get_pdf_link_fetcher().submit(user_id, link, fingerprint)))
+            if downloads:
+                self._pending_link_emails.append({
+                    'uid': email_id,
+                    'user_id': user_id,
+                    'row': row,
+                    'results': results,
+                    'attachments_processed': len(pdf_attachments),
+                    'links_processed': len(pdf_links),
+                    'downloads': downloads,
+                })
+                results = []
+            else:
+                self._complete_email_scan(row, results, len(pdf_attachments), len(pdf_links))
             
         except Exception as e:
             error_msg = f"处理邮件内容失败: {str(e)}"
             logger.error(error_msg)
             
-            # 尝试创建或更新邮件记录为失败状态（仅更新 processing_status，不改变 invoice_scan_status）
-            try:
-                message_id = email_message.get('Message-ID', f"email_{email_id}_{int(datetime.now().timestamp())}")
-                email_record = self.email_list_service.create_or_update_email(
-                    user_id=user_id,
-                    message_id=message_id,
-                    email_data={
-                        'subject': self._decode_mime_words(email_message.get('Subject', '')),
-                        'sender': email_message.get('From', ''),
-                        'processing_status': 'failed',
-                        'error_message': str(e)
-                    }
-                )
-
-                try:
-                    email_record.processing_status = 'failed'
-                    email_record.updated_at = datetime.now()
-                    self.db.commit()
-                except Exception:
-                    self.db.rollback()
-            except Exception as update_error:
-                logger.error(f"更新邮件处理失败状态时出错: {str(update_error)}")
+            # 记录为失败状态（写库时仅更新主题、发件人与处理状态，不改变已有的扫描结果）
+            self._pending_email_rows.append({
+                'message_id': message_id,
+                'subject': self._decode_mime_words(email_message.get('Subject', '')),
+                'sender': email_message.get('From', ''),
+                'processing_status': 'failed',
+                'error_message': str(e)
+            })
             
             logging_service.log_email_event(
                 db=self.db,
@@ -518,13 +1276,68 @@ class EmailService:
                 log_level="ERROR"
             )
         
-        # 确保单邮件处理的日志被提交
+        return results
+    
+    def _complete_email_scan(self, row: Dict[str, Any], results: List[Dict],
+                             attachments_processed: int, links_processed: int) -> None:
+        """填好邮件记录行的扫描状态并加入待写入队列"""
+        row.update(
+            invoice_scan_status="has_invoice" if results else "no_invoice",
+            invoice_count=len(results),
+            scan_result={
+                "attachments_processed": attachments_processed,
+                "links_processed": links_processed,
+                "invoices_found": len(results),
+                "scan_completed": True,
+                "scan_time": datetime.now().isoformat()
+            },
+            processing_status='completed',
+            scanned_at=datetime.now(),
+        )
+        self._pending_email_rows.append(row)
+    
+    def _flush_email_rows(self, user_id: int) -> None:
+        """将待写入的邮件记录一次性 upsert 并提交（连同本块的日志）"""
+        rows, self._pending_email_rows = self._pending_email_rows, []
         try:
+            self.email_list_service.bulk_upsert_emails(user_id, rows)
             self.db.commit()
-        except Exception as commit_error:
-            logger.error(f"提交邮件处理日志失败: {str(commit_error)}")
-        
-        return results
+        except Exception as e:
+            logger.error(f"批量写入邮件记录失败: {str(e)}")
+            self.db.rollback()
+    
+    def _collect_link_downloads(self, wait: bool = False) -> List[Dict]:
+        """收集正文链接下载结果：全部完成的邮件生成扫描结果并算好扫描状态，返回新增的扫描结果。
+        wait=True 时等待所有下载结束（扫描结束或积压过多时）。
+        """
+        collected = []
+        pending = []
+        for entry in self._pending_link_emails:
+            downloads = entry['downloads']
+            if not wait and not all(future.done() for _, future in downloads):
+                pending.append(entry)
+                continue
+            results = entry['results']
+            for link, future in downloads:
+                try:
+                    stored = future.result()
+                except Exception as e:
+                    logger.error(f"下载PDF失败: {link}, 错误: {str(e)}")
+                    stored = None
+                if not stored:
+                    EMAIL_LINK_FETCHES.labels(result="rejected").inc()
+                    continue
+                EMAIL_LINK_FETCHES.labels(result="not_modified" if stored.get('not_modified') else "downloaded").inc()
+                self.link_cache.put(self.db, link, stored)
+                result = self._stored_pdf_result(entry['user_id'], stored, 'download', url=link)
+                if result:
+                    results.append(result)
+            self._complete_email_scan(
+                entry['row'], results, entry['attachments_processed'], entry['links_processed']
+            )
+            collected.extend(results)
+        self._pending_link_emails = pending
+        return collected
     
     def _decode_mime_words(self, s: str) -> str:
         """解码MIME编码的文本"""
@@ -541,16 +1354,15 @@ class EmailService:
     
     def _is_invoice_email(self, subject: str) -> bool:
         """判断邮件是否可能包含发票"""
-        invoice_keywords = [
-            '发票', '票据', 'invoice', '开票', '电子发票', 
-            '增值税发票', '专用发票', '普通发票', '税务'
-        ]
-        
         subject_lower = subject.lower()
-        return any(keyword.lower() in subject_lower for keyword in invoice_keywords)
+        return any(keyword.lower() in subject_lower for keyword in INVOICE_SUBJECT_KEYWORDS)
     
-    def _extract_pdf_attachments(self, email_message) -> List[Dict]:
-        """提取PDF附件"""
+    def _is_invoice_candidate(self, subject: str, pdf_attachments: List) -> bool:
+        """主题命中发票关键词或带有 PDF 附件的邮件才需要下载正文与附件"""
+        return bool(pdf_attachments) or self._is_invoice_email(subject)
+    
+    def _extract_pdf_attachments(self, email_message, user_id: int) -> List[Dict]:
+        """提取PDF附件：按块解码原始载荷并直接写入内容寻址存储，不在内存中保留解码后的副本"""
         attachments = []
         
         for part in email_message.walk():
@@ -573,14 +1385,11 @@ class EmailService:
                     else:
                         decoded_filename = self._decode_mime_words(filename)
                     
-                    content = part.get_payload(decode=True)
-                    
-                    # 验证文件内容确实是PDF
-                    if content and content.startswith(b'%PDF'):
-                        attachments.append({
-                            'filename': decoded_filename,
-                            'content': content
-                        })
+                    encoding = str(part.get('Content-Transfer-Encoding', '')).strip().lower()
+                    stored = store_pdf_stream(user_id, _iter_decoded(_iter_str_slices(part.get_payload()), encoding))
+                    if stored:
+                        stored['filename'] = decoded_filename
+                        attachments.append(stored)
         
         return attachments
     
@@ -648,181 +1457,92 @@ class EmailService:
         return list(set(pdf_links + download_links))
     
     def _process_pdf_attachment(self, user_id: int, attachment: Dict, email_id: str = None) -> Optional[Dict]:
-        """处理PDF附件"""
+        """处理PDF附件（附件已在提取时写入内容寻址存储并计算哈希）"""
         try:
-            # 保存临时文件，并在一次IO中计算哈希
-            content_bytes = attachment['content']
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            temp_file.write(content_bytes)
-            temp_file.close()
-            try:
-                import hashlib as _hashlib
-                file_md5_hash = _hashlib.md5(content_bytes).hexdigest()
-                file_sha256_hash = _hashlib.sha256(content_bytes).hexdigest()
-                file_size = len(content_bytes)
-            except Exception:
-                file_md5_hash = None
-                file_sha256_hash = None
-                file_size = len(content_bytes)
-            # 上游预判重复（基于 (user_id, md5, size)），命中则跳过下游处理
-            try:
-                if file_md5_hash and file_size:
-                    existing = (
-                        self.db.query(Invoice)
-                        .filter(
-                            and_(
-                                Invoice.user_id == user_id,
-                                Invoice.file_md5_hash == file_md5_hash,
-                                Invoice.file_size == file_size,
-                            )
-                        )
-                        .first()
-                    )
-                    if existing:
-                        try:
-                            os.unlink(temp_file.name)
-                        except Exception:
-                            pass
-                        return {
-                            'type': 'attachment',
-                            'filename': attachment['filename'],
-                            'status': 'duplicate',
-                            'file_size': file_size,
-                            'file_md5_hash': file_md5_hash,
-                            'file_sha256_hash': file_sha256_hash,
-                            'existing_invoice_id': existing.id,
-                        }
-            except Exception:
-                # 预判失败不影响后续流程
-                pass
-            
-            # 创建发票记录
-            invoice_data = {
-                'original_filename': attachment['filename'],
-                'file_path': temp_file.name,
-                'file_size': len(attachment['content'])
-            }
-            
-            return {
-                'type': 'attachment',
-                'filename': attachment['filename'],
-                'status': 'processed',
-                'file_path': temp_file.name,
-                'file_size': file_size,
-                'file_md5_hash': file_md5_hash,
-                'file_sha256_hash': file_sha256_hash
-            }
-            
+            if 'content' in attachment:
+                # 兼容直接携带内容的附件
+                stored = store_pdf_stream(user_id, [attachment['content']])
+                if not stored:
+                    return None
+                attachment = dict(stored, filename=attachment['filename'])
+            return self._stored_pdf_result(user_id, attachment, 'attachment')
         except Exception as e:
             logger.error(f"处理PDF附件失败: {str(e)}")
             return None
     
-    def _download_and_process_pdf(self, user_id: int, url: str, email_id: str = None) -> Optional[Dict]:
-        """下载并处理PDF链接"""
+    def _stored_pdf_result(self, user_id: int, stored: Dict, result_type: str, **extra) -> Optional[Dict]:
+        """为已落盘的 PDF 生成扫描结果；重复预判由 _mark_duplicates 按批完成"""
+        return {
+            'type': result_type,
+            'filename': stored['filename'],
+            'status': 'processed',
+            **extra,
+            'file_path': stored['file_path'],
+            'stored_path': stored['relative_path'],
+            'created': stored.get('created', False),
+            'file_size': stored['file_size'],
+            'file_md5_hash': stored['file_md5_hash'],
+            'file_sha256_hash': stored['file_sha256_hash']
+        }
+    
+    def _mark_duplicates(self, user_id: int, results: List[Dict]) -> None:
+        """批量重复预判：本批待入库文件用一次 IN 查询判定是否已存在，本次扫描内重复的只保留第一份；
+        通过判定的结果标记 dedup_checked，创建发票时不再逐个查询（并发写入由唯一约束兜底）。
+        """
+        pending = [r for r in results if r.get('status') == 'processed' and not r.get('dedup_checked')]
+        if not pending:
+            return
         try:
-            # 下载文件
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
-            response.raise_for_status()
-            
-            # 检查内容类型
-            content_type = response.headers.get('content-type', '').lower()
-            is_pdf_ct = ('pdf' in content_type) or ('application/octet-stream' in content_type)
-            if (not is_pdf_ct) and (not url.lower().endswith('.pdf')):
-                return None
-            
-            # 获取文件名
-            filename = self._extract_filename_from_url(url, response)
-            
-            # 保存临时文件，并在一次IO中计算哈希
-            content_bytes = response.content
-            # 验证PDF魔数
-            if not content_bytes or not content_bytes.startswith(b'%PDF'):
-                return None
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            temp_file.write(content_bytes)
-            temp_file.close()
-            try:
-                import hashlib as _hashlib
-                file_md5_hash = _hashlib.md5(content_bytes).hexdigest()
-                file_sha256_hash = _hashlib.sha256(content_bytes).hexdigest()
-                file_size = len(content_bytes)
-            except Exception:
-                file_md5_hash = None
-                file_sha256_hash = None
-                file_size = len(content_bytes)
-
-            # 上游预判重复（基于 (user_id, md5, size)），命中则跳过下游处理
-            try:
-                if file_md5_hash and file_size:
-                    existing = (
-                        self.db.query(Invoice)
-                        .filter(
-                            and_(
-                                Invoice.user_id == user_id,
-                                Invoice.file_md5_hash == file_md5_hash,
-                                Invoice.file_size == file_size,
-                            )
-                        )
-                        .first()
-                    )
-                    if existing:
-                        try:
-                            os.unlink(temp_file.name)
-                        except Exception:
-                            pass
-                        return {
-                            'type': 'download',
-                            'filename': filename,
-                            'status': 'duplicate',
-                            'url': url,
-                            'file_size': file_size,
-                            'file_md5_hash': file_md5_hash,
-                            'file_sha256_hash': file_sha256_hash,
-                            'existing_invoice_id': existing.id,
-                        }
-            except Exception:
-                # 预判失败不影响后续流程
-                pass
-            
-            return {
-                'type': 'download',
-                'filename': filename,
-                'status': 'processed',
-                'url': url,
-                'file_path': temp_file.name,
-                'file_size': file_size,
-                'file_md5_hash': file_md5_hash,
-                'file_sha256_hash': file_sha256_hash
-            }
-            
+            existing_ids = self.invoice_service.find_duplicate_ids(user_id, pending)
         except Exception as e:
-            logger.error(f"下载PDF失败: {url}, 错误: {str(e)}")
-            return None
+            # 预判失败不影响后续流程（创建发票时逐个检查）
+            logger.warning(f"批量重复预判失败: {str(e)}")
+            return
+        for result, existing_id in zip(pending, existing_ids):
+            sha256 = result.get('file_sha256_hash')
+            if existing_id:
+                discard_stored_files([result])
+                result.update(status='duplicate', existing_invoice_id=existing_id)
+            elif sha256 in self._scan_seen_sha256:
+                # 与本次扫描中更早的文件内容相同，共用同一个内容寻址文件，不删除
+                result.update(status='duplicate', existing_invoice_id=None)
+            else:
+                self._scan_seen_sha256.add(sha256)
+                result['dedup_checked'] = True
     
-    def _extract_filename_from_url(self, url: str, response) -> str:
-        """从URL或响应头中提取文件名"""
-        # 尝试从Content-Disposition头获取
-        content_disposition = response.headers.get('content-disposition', '')
-        if content_disposition:
-            filename_match = re.search(r'filename[*]?=([^;]+)', content_disposition)
-            if filename_match:
-                filename = filename_match.group(1).strip('"')
-                return filename
-        
-        # 从URL路径获取
-        parsed_url = urlparse(url)
-        path = parsed_url.path
-        if path:
-            filename = os.path.basename(path)
-            if filename and '.' in filename:
-                return filename
-        
-        # 默认文件名
-        return f"download_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+    def _cached_link_duplicates(self, user_id: int, fingerprints: List[Tuple[str, Optional[Dict]]]) -> Dict[str, Dict]:
+        """链接指纹对应的内容已是该用户的发票时直接生成重复结果（不再下载）；返回 {链接: 结果}"""
+        cached = [(link, fp) for link, fp in fingerprints if fp]
+        if not cached:
+            return {}
+        try:
+            existing_ids = self.invoice_service.find_duplicate_ids(user_id, [
+                {
+                    'file_sha256_hash': fp.get('sha256'),
+                    'file_md5_hash': fp.get('file_md5_hash'),
+                    'file_size': fp.get('file_size'),
+                }
+                for _, fp in cached
+            ])
+        except Exception:
+            return {}
+        duplicates = {}
+        for (link, fp), existing_id in zip(cached, existing_ids):
+            if not existing_id:
+                continue
+            EMAIL_LINK_FETCHES.labels(result="duplicate_skipped").inc()
+            EMAIL_DUPLICATES.labels(type="link_cache").inc()
+            duplicates[link] = {
+                'type': 'download',
+                'filename': fp.get('filename') or os.path.basename(urlparse(link).path) or 'download.pdf',
+                'status': 'duplicate',
+                'url': link,
+                'file_size': fp.get('file_size'),
+                'file_md5_hash': fp.get('file_md5_hash'),
+                'file_sha256_hash': fp.get('sha256'),
+                'existing_invoice_id': existing_id,
+            }
+        return duplicates
     
     def get_user_email_configs(self, user_id: int) -> List[EmailConfig]:
         """获取用户的邮箱配置"""
@@ -0,0 +1,204 @@
+"""
+名称/主题/日志全文检索
+MySQL 使用 ngram 分词的 FULLTEXT 索引：MATCH ... AGAINST 短语检索缩小候选，再以 LIKE 校验，结果与原子串匹配一致；
+索引尚未建立（或 MySQL 不支持）时回退为 LIKE。SQLite 等其他数据库使用进程内的 ngram 倒排索引求候选集，
+按时间戳列增量刷新（回看一段时间以覆盖并发提交的行）；倒排索引只用于缩小范围，最终仍以 LIKE 校验。
+"""
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import and_, bindparam, false, or_, text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 与 MySQL ngram_token_size 默认值一致；更短的检索词无法走索引
+NGRAM_SIZE = 2
+# 回退索引候选超过该数量时不再拼 IN 列表，直接 LIKE
+FALLBACK_MAX_CANDIDATES = 5000
+# FULLTEXT 索引存在性缓存时间（秒），手动执行 schema_upgrades --fulltext 建好索引后无需重启即可被新请求使用
+_INDEX_CACHE_TTL = 300
+# 回退索引增量刷新的回看窗口：时间戳早于水位线、但稍后才提交的行也能被补入
+_REFRESH_OVERLAP = timedelta(seconds=60)
+
+# (表名, 列) -> FULLTEXT 索引名；MATCH 的列必须与索引列完全一致
+FULLTEXT_INDEXES: Dict[Tuple[str, Tuple[str, ...]], str] = {
+    ("invoices", ("seller_name",)): "ft_invoices_seller_name",
+    ("invoices", ("purchaser_name",)): "ft_invoices_purchaser_name",
+    ("emails", ("sender",)): "ft_emails_sender",
+    ("emails", ("subject",)): "ft_emails_subject",
+    ("system_logs", ("message", "resource_id")): "ft_system_logs_search",
+}
+
+# 回退索引增量刷新所依据的时间戳列
+_FALLBACK_TIMESTAMPS = {
+    "invoices": "updated_at",
+    "emails": "updated_at",
+    "system_logs": "created_at",
+}
+
+_index_cache: Dict[str, Tuple[float, Set[str]]] = {}
+_index_cache_lock = threading.Lock()
+
+
+def _like_clause(columns: Sequence, term: str):
+    clauses = [column.ilike(f"%{term}%") for column in columns]
+    return clauses[0] if len(clauses) == 1 else or_(*clauses)
+
+
+def ngrams(value: Optional[str], size: int = NGRAM_SIZE) -> Set[str]:
+    """按 ngram 解析器的规则切分：忽略空白，每段取长度为 size 的滑动窗口"""
+    grams: Set[str] = set()
+    for token in (value or "").lower().split():
+        if len(token) < size:
+            continue
+        for i in range(len(token) - size + 1):
+            grams.add(token[i:i + size])
+    return grams
+
+
+def _boolean_phrase(term: str) -> Optional[str]:
+    """转为布尔模式短语检索；去掉双引号后没有可检索内容时返回 None"""
+    phrase = " ".join(term.replace('"', " ").split())
+    if not ngrams(phrase):
+        return None
+    return f'"{phrase}"'
+
+
+def _mysql_fulltext_indexes(db: Session) -> Set[str]:
+    """当前库中已建立的 FULLTEXT 索引名（带缓存）"""
+    bind = db.get_bind()
+    key = str(bind.url)
+    now = time.monotonic()
+    with _index_cache_lock:
+        cached = _index_cache.get(key)
+        if cached and now - cached[0] < _INDEX_CACHE_TTL:
+            return cached[1]
+    try:
+        rows = db.execute(text(
+            "SELECT DISTINCT index_name FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND index_type = 'FULLTEXT'"
+        )).fetchall()
+        names = {row[0] for row in rows}
+    except Exception as e:
+        logger.warning(f"读取 FULLTEXT 索引失败，回退为 LIKE: {e}")
+        names = set()
+    with _index_cache_lock:
+        _index_cache[key] = (now, names)
+    return names
+
+
+class NgramInvertedIndex:
+    """进程内 ngram 倒排索引（非 MySQL 的回退实现）
+    gram -> 行主键集合；每次检索前按时间戳列增量补充新增/修改的行。
+    行被修改后旧 gram 仍指向该行，只会多出候选，由 LIKE 校验剔除。
+    """
+
+    def __init__(self, model, columns: Sequence[str], timestamp: str):
+        self.model = model
+        self.columns = tuple(columns)
+        self.timestamp = timestamp
+        self.postings: Dict[str, Set] = defaultdict(set)
+        self.watermark: Optional[datetime] = None
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session) -> int:
+        pk = self.model.__mapper__.primary_key[0]
+        ts = getattr(self.model, self.timestamp)
+        query = db.query(pk, ts, *(getattr(self.model, name) for name in self.columns))
+        with self._lock:
+            if self.watermark is not None:
+                query = query.filter(ts >= self.watermark - _REFRESH_OVERLAP)
+            count = 0
+            for row in query.yield_per(1000):
+                row_id, row_ts, values = row[0], row[1], row[2:]
+                for gram in ngrams(" ".join(value for value in values if value)):
+                    self.postings[gram].add(row_id)
+                if row_ts is not None and (self.watermark is None or row_ts > self.watermark):
+                    self.watermark = row_ts
+                count += 1
+            return count
+
+    def candidates(self, term: str) -> Optional[Set]:
+        """包含 term 全部 gram 的行主键；term 过短无法检索时返回 None"""
+        grams = ngrams(term)
+        if not grams:
+            return None
+        with self._lock:
+            lists = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            result = set(lists[0])
+            for posting in lists[1:]:
+                result &= posting
+                if not result:
+                    break
+            return result
+
+
+_fallback_indexes: Dict[Tuple[str, Tuple[str, ...]], NgramInvertedIndex] = {}
+_fallback_lock = threading.Lock()
+
+
+def _fallback_index(model, columns: Tuple[str, ...]) -> Optional[NgramInvertedIndex]:
+    table = model.__tablename__
+    timestamp = _FALLBACK_TIMESTAMPS.get(table)
+    if timestamp is None:
+        return None
+    key = (table, columns)
+    with _fallback_lock:
+        index = _fallback_indexes.get(key)
+        if index is None:
+            index = NgramInvertedIndex(model, columns, timestamp)
+            _fallback_indexes[key] = index
+        return index
+
+
+def text_match(db: Session, columns, term: str):
+    """返回“任一列包含 term”（不区分大小写）的过滤条件，尽量走全文索引
+    columns 为同一模型的一个或多个列属性，须与 FULLTEXT_INDEXES 中登记的列一致才会使用索引。
+    """
+    if not isinstance(columns, (list, tuple)):
+        columns = [columns]
+    columns = list(columns)
+    term = (term or "").strip()
+    like = _like_clause(columns, term)
+    if not term or not settings.FULLTEXT_SEARCH_ENABLED:
+        return like
+
+    model = columns[0].class_
+    names = tuple(column.key for column in columns)
+    index_name = FULLTEXT_INDEXES.get((model.__tablename__, names))
+    if index_name is None:
+        return like
+
+    if db.get_bind().dialect.name == "mysql":
+        phrase = _boolean_phrase(term)
+        if phrase is None or index_name not in _mysql_fulltext_indexes(db):
+            return like
+        column_list = ", ".join(f"`{model.__tablename__}`.`{name}`" for name in names)
+        match = text(f"MATCH ({column_list}) AGAINST (:ft_{index_name} IN BOOLEAN MODE)").bindparams(
+            bindparam(f"ft_{index_name}", phrase)
+        )
+        return and_(match, like)
+
+    index = _fallback_index(model, names)
+    if index is None:
+        return like
+    try:
+        index.refresh(db)
+    except Exception as e:
+        logger.warning(f"刷新倒排索引失败，回退为 LIKE: {e}")
+        return like
+    candidates = index.candidates(term)
+    if candidates is None or len(candidates) > FALLBACK_MAX_CANDIDATES:
+        return like
+    if not candidates:
+        return false()
+    pk = model.__mapper__.primary_key[0]
+    return and_(pk.in_(list(candidates)), like)
+
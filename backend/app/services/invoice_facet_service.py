@@ -0,0 +1,195 @@
+"""
+发票筛选项字典
+按用户维护销售方/购买方/服务类型的取值与发票数（invoice_facets 表），在写入名称（OCR 字段提取、手工修改）
+与删除发票时随同一事务增量更新；筛选器选项读取该表并缓存于 Redis，事务提交后失效缓存。
+用户首次读取（或计数出现偏差需重建）时按 invoices 重新聚合。
+"""
+import json
+import logging
+from collections import Counter
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from sqlalchemy import event, func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.models.invoice import Invoice
+from app.models.invoice_facet import InvoiceFacet
+
+logger = logging.getLogger(__name__)
+
+# 维度 -> 发票字段
+FACET_FIELDS = {
+    "seller": "seller_name",
+    "purchaser": "purchaser_name",
+    "service_type": "service_type",
+}
+# 已构建标记行（facet=_built, value=""）：有该行的用户才做增量更新，否则读取时整体重建
+BUILT_MARKER = "_built"
+FACET_CACHE_PREFIX = "invoice:facets:"
+# 提交后需要失效缓存的用户，挂在 Session.info 上
+_DIRTY_KEY = "invoice_facets_dirty"
+
+FacetDeltas = Counter  # (facet, value) -> 发票数变化
+
+
+def facet_values(source: Any) -> Dict[str, Optional[str]]:
+    """取发票（或批量写回的字段映射）当前的各维度取值"""
+    values = {}
+    for facet, field in FACET_FIELDS.items():
+        value = source.get(field) if isinstance(source, Mapping) else getattr(source, field, None)
+        values[facet] = value or None
+    return values
+
+
+def facet_diff(before: Mapping[str, Optional[str]], after: Mapping[str, Optional[str]],
+               deltas: Optional[FacetDeltas] = None) -> FacetDeltas:
+    """累计一张发票取值变化带来的计数增减；before/after 为 None 表示新增/删除"""
+    deltas = deltas if deltas is not None else Counter()
+    for facet in FACET_FIELDS:
+        old = (before or {}).get(facet)
+        new = (after or {}).get(facet)
+        if old == new:
+            continue
+        if old:
+            deltas[(facet, old)] -= 1
+        if new:
+            deltas[(facet, new)] += 1
+    return deltas
+
+
+def _cache_key(user_id: int) -> str:
+    return f"{FACET_CACHE_PREFIX}{user_id}"
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session: Session) -> None:
+    user_ids = session.info.pop(_DIRTY_KEY, None)
+    if not user_ids or settings.INVOICE_FACET_CACHE_TTL <= 0:
+        return
+    try:
+        get_redis().delete(*(_cache_key(user_id) for user_id in user_ids))
+    except Exception as e:
+        logger.debug(f"失效筛选项缓存失败: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session: Session) -> None:
+    session.info.pop(_DIRTY_KEY, None)
+
+
+class InvoiceFacetService:
+    """发票筛选项字典服务（增量更新不提交，随调用方事务一起提交）"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _is_built(self, user_id: int) -> bool:
+        return self.db.query(InvoiceFacet.id).filter(
+            InvoiceFacet.user_id == user_id,
+            InvoiceFacet.facet == BUILT_MARKER,
+        ).first() is not None
+
+    def apply(self, user_id: int, deltas: FacetDeltas) -> None:
+        """应用一个用户的计数增减；尚未构建的用户跳过（首次读取时整体重建）"""
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas or not self._is_built(user_id):
+            return
+
+        if self.db.get_bind().dialect.name == "mysql":
+            rows = [
+                {"user_id": user_id, "facet": facet, "value": value, "count": delta}
+                for (facet, value), delta in deltas.items()
+            ]
+            stmt = mysql_insert(InvoiceFacet).values(rows)
+            stmt = stmt.on_duplicate_key_update(count=InvoiceFacet.count + stmt.inserted["count"])
+            self.db.execute(stmt)
+        else:
+            for (facet, value), delta in deltas.items():
+                row = self.db.query(InvoiceFacet).filter(
+                    InvoiceFacet.user_id == user_id,
+                    InvoiceFacet.facet == facet,
+                    InvoiceFacet.value == value,
+                ).first()
+                if row:
+                    row.count = (row.count or 0) + delta
+                else:
+                    self.db.add(InvoiceFacet(user_id=user_id, facet=facet, value=value, count=delta))
+            self.db.flush()
+
+        if any(delta < 0 for delta in deltas.values()):
+            self.db.query(InvoiceFacet).filter(
+                InvoiceFacet.user_id == user_id,
+                InvoiceFacet.facet != BUILT_MARKER,
+                InvoiceFacet.count <= 0,
+            ).delete(synchronize_session=False)
+        self.db.info.setdefault(_DIRTY_KEY, set()).add(user_id)
+
+    def apply_many(self, deltas_by_user: Mapping[int, FacetDeltas]) -> None:
+        for user_id, deltas in deltas_by_user.items():
+            self.apply(user_id, deltas)
+
+    def rebuild(self, user_id: int) -> None:
+        """按 invoices 重新聚合该用户的筛选项（提交）"""
+        self.db.query(InvoiceFacet).filter(InvoiceFacet.user_id == user_id).delete(synchronize_session=False)
+        rows = [InvoiceFacet(user_id=user_id, facet=BUILT_MARKER, value="", count=0)]
+        for facet, field in FACET_FIELDS.items():
+            column = getattr(Invoice, field)
+            grouped = (
+                self.db.query(column, func.count(Invoice.id))
+                .filter(Invoice.user_id == user_id, column.isnot(None), column != "")
+                .group_by(column)
+                .all()
+            )
+            rows.extend(
+                InvoiceFacet(user_id=user_id, facet=facet, value=name, count=count)
+                for name, count in grouped
+            )
+        self.db.add_all(rows)
+        self.db.info.setdefault(_DIRTY_KEY, set()).add(user_id)
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # 并发请求已完成重建
+            self.db.rollback()
+            return
+        logger.info(f"重建发票筛选项: user={user_id}, 取值 {len(rows) - 1} 个")
+
+    def _load(self, user_id: int) -> Iterable[Tuple[str, str, int]]:
+        return (
+            self.db.query(InvoiceFacet.facet, InvoiceFacet.value, InvoiceFacet.count)
+            .filter(InvoiceFacet.user_id == user_id)
+            .order_by(InvoiceFacet.facet, InvoiceFacet.value)
+            .all()
+        )
+
+    def get_options(self, user_id: int, rebuild: bool = False) -> Dict[str, Dict[str, int]]:
+        """各维度取值 -> 发票数（按取值排序）；优先读 Redis 缓存"""
+        ttl = settings.INVOICE_FACET_CACHE_TTL
+        if ttl > 0 and not rebuild:
+            try:
+                cached = get_redis().get(_cache_key(user_id))
+                if cached:
+                    return json.loads(cached)
+            except Exception as e:
+                logger.debug(f"读取筛选项缓存失败: {e}")
+
+        rows = self._load(user_id)
+        if rebuild or not any(facet == BUILT_MARKER for facet, _, _ in rows):
+            self.rebuild(user_id)
+            rows = self._load(user_id)
+
+        options: Dict[str, Dict[str, int]] = {facet: {} for facet in FACET_FIELDS}
+        for facet, value, count in rows:
+            if facet in options and count > 0:
+                options[facet][value] = count
+
+        if ttl > 0:
+            try:
+                get_redis().set(_cache_key(user_id), json.dumps(options, ensure_ascii=False), ex=ttl)
+            except Exception as e:
+                logger.debug(f"写入筛选项缓存失败: {e}")
+        return options
@@ -1,22 +1,59 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc
+from sqlalchemy.orm import Session, load_only
+from sqlalchemy import and_, or_, desc, tuple_
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+from collections import Counter, defaultdict
 from datetime import datetime
 import uuid
 import os
 import logging
 import hashlib
+import base64
+import json
 
 from app.models.invoice import Invoice
 from app.models.attachment import Attachment
-from app.schemas.invoice import InvoiceCreate, InvoiceUpdate, InvoiceFilter, PaginationParams
+from app.schemas.invoice import InvoiceCreate, InvoiceUpdate, InvoiceFilter, InvoiceListItem, PaginationParams
 from app.core.config import settings, get_absolute_file_path
+from app.core.redis_client import get_redis
 from app.services.logging_service import logging_service
+from app.services.ocr_payload_store import OCRPayloadStore
+from app.services.fulltext_search import text_match
+from app.services.invoice_facet_service import InvoiceFacetService, facet_diff, facet_values
  # 精简：不再依赖复杂的重复检测服务
 
 logger = logging.getLogger(__name__)
 
+# _extract_ocr_fields 写入的结构化字段（批量写回时整体映射）
+OCR_EXTRACTED_FIELDS = (
+    "invoice_code", "invoice_num", "invoice_date", "invoice_type",
+    "total_amount", "total_tax", "amount_in_words", "amount_in_figures",
+    "purchaser_name", "purchaser_register_num", "purchaser_address", "purchaser_bank",
+    "seller_name", "seller_register_num", "seller_address", "seller_bank",
+    "service_type", "commodity_details",
+)
+
+INVOICE_COUNT_CACHE_PREFIX = "invoice:count:"
+
+# 列表查询只读取 InvoiceListItem 的列
+INVOICE_LIST_COLUMNS = tuple(InvoiceListItem.model_fields)
+
+
+def encode_invoice_cursor(invoice: Invoice) -> str:
+    """列表游标：最后一条记录的 (created_at, id)，对客户端不透明"""
+    raw = json.dumps({"c": invoice.created_at.isoformat(), "i": invoice.id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_invoice_cursor(cursor: str) -> Tuple[datetime, str]:
+    """解析列表游标，格式无效时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["c"]), str(data["i"])
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
 
 class InvoiceService:
     """发票服务类"""
@@ -110,7 +147,13 @@ class InvoiceService:
                     setattr(db_invoice, field, value)
             
             self.db.add(db_invoice)
-            self.db.commit()
+            InvoiceFacetService(self.db).apply(user_id, facet_diff(None, facet_values(db_invoice)))
+            try:
+                self.db.commit()
+            except IntegrityError:
+                # 上游已批量判定不重复时跳过了查询，并发写入的同一文件由唯一约束兜底
+                self.db.rollback()
+                raise ValueError(f"发票文件重复，已存在相同文件: {invoice_data.original_filename}")
             self.db.refresh(db_invoice)
             
             # 降噪：发票创建成功不再记录入库日志
@@ -136,6 +179,35 @@ class InvoiceService:
             )
             raise
     
+    def find_duplicate_ids(self, user_id: int, files: List[Dict]) -> List[Optional[str]]:
+        """批量去重判定：一次 IN 查询返回与 files 一一对应的已存在发票ID（无则 None）。
+        files 元素含 file_sha256_hash / file_md5_hash / file_size，判定规则与 create_invoice 一致。
+        """
+        sha256s = {f.get("file_sha256_hash") for f in files if f.get("file_sha256_hash")}
+        md5_sizes = {
+            (f.get("file_md5_hash"), f.get("file_size"))
+            for f in files if f.get("file_md5_hash") and f.get("file_size")
+        }
+        if not (sha256s or md5_sizes):
+            return [None] * len(files)
+
+        conditions = []
+        if sha256s:
+            conditions.append(Invoice.file_sha256_hash.in_(list(sha256s)))
+        if md5_sizes:
+            conditions.append(tuple_(Invoice.file_md5_hash, Invoice.file_size).in_(list(md5_sizes)))
+        rows = (
+            self.db.query(Invoice.id, Invoice.file_sha256_hash, Invoice.file_md5_hash, Invoice.file_size)
+            .filter(Invoice.user_id == user_id, or_(*conditions))
+            .all()
+        )
+        by_sha256 = {row.file_sha256_hash: row.id for row in rows if row.file_sha256_hash}
+        by_md5_size = {(row.file_md5_hash, row.file_size): row.id for row in rows if row.file_md5_hash}
+        return [
+            by_sha256.get(f.get("file_sha256_hash")) or by_md5_size.get((f.get("file_md5_hash"), f.get("file_size")))
+            for f in files
+        ]
+    
     def get_invoice(self, invoice_id: str, user_id: int) -> Optional[Invoice]:
         """获取发票详情"""
         return self.db.query(Invoice).filter(
@@ -148,9 +220,16 @@ class InvoiceService:
         filters: InvoiceFilter,
         pagination: PaginationParams,
         include_duplicates: bool = False,
-    ) -> Tuple[List[Invoice], int]:
-        """获取发票列表"""
-        query = self.db.query(Invoice).filter(Invoice.user_id == user_id)
+    ) -> Tuple[List[Invoice], Optional[int], Optional[str]]:
+        """获取发票列表，返回 (发票, 总数, 下一页游标)。
+        按 (created_at, id) 倒序；传入 pagination.cursor 时使用键集分页（WHERE (created_at, id) < 游标），
+        不再 OFFSET 扫描，深翻页耗时与页码无关。总数：with_total=False 时不计算（None）；
+        游标翻页时使用短期缓存的总数（INVOICE_COUNT_CACHE_TTL 内可能略有偏差），首页（无游标）为精确值。
+        """
+        # 列表投影：只读取列表展示的列，OCR 原始数据等大字段不出库
+        query = self.db.query(Invoice).options(
+            load_only(*(getattr(Invoice, column) for column in INVOICE_LIST_COLUMNS), raiseload=True)
+        ).filter(Invoice.user_id == user_id)
         # 全局去重：默认不展示重复发票，除非显式请求包含
         if not include_duplicates:
             query = query.filter(Invoice.status != 'duplicate')
@@ -163,13 +242,13 @@ class InvoiceService:
             query = query.filter(Invoice.ocr_status == filters.ocr_status)
         
         if filters.seller_name:
-            query = query.filter(Invoice.seller_name.ilike(f"%{filters.seller_name}%"))
+            query = query.filter(text_match(self.db, Invoice.seller_name, filters.seller_name))
         # Excel 风格多选：销售方
         if getattr(filters, 'seller_names', None):
             query = query.filter(Invoice.seller_name.in_(filters.seller_names))
         
         if filters.purchaser_name:
-            query = query.filter(Invoice.purchaser_name.ilike(f"%{filters.purchaser_name}%"))
+            query = query.filter(text_match(self.db, Invoice.purchaser_name, filters.purchaser_name))
         # Excel 风格多选：购方
         if getattr(filters, 'purchaser_names', None):
             query = query.filter(Invoice.purchaser_name.in_(filters.purchaser_names))
@@ -193,14 +272,53 @@ class InvoiceService:
             query = query.filter(Invoice.total_amount <= filters.amount_max)
         
         # 计算总数
-        total = query.count()
-        
-        # 应用分页和排序
-        invoices = query.order_by(desc(Invoice.created_at)).offset(
-            (pagination.page - 1) * pagination.size
-        ).limit(pagination.size).all()
-        
-        return invoices, total
+        total = None
+        if pagination.with_total:
+            total = self._count_invoices(query, user_id, filters, include_duplicates, cached=bool(pagination.cursor))
+        
+        # 应用分页和排序（id 作为同一时间戳内的稳定次序）
+        query = query.order_by(desc(Invoice.created_at), desc(Invoice.id))
+        if pagination.cursor:
+            created_at, invoice_id = decode_invoice_cursor(pagination.cursor)
+            query = query.filter(or_(
+                Invoice.created_at < created_at,
+                and_(Invoice.created_at == created_at, Invoice.id < invoice_id),
+            ))
+        else:
+            query = query.offset((pagination.page - 1) * pagination.size)
+        # 多取一条判断是否还有下一页
+        invoices = query.limit(pagination.size + 1).all()
+        next_cursor = None
+        if len(invoices) > pagination.size:
+            invoices = invoices[:pagination.size]
+            next_cursor = encode_invoice_cursor(invoices[-1])
+        
+        return invoices, total, next_cursor
+    
+    def _count_invoices(self, query, user_id: int, filters: InvoiceFilter, include_duplicates: bool,
+                        cached: bool) -> int:
+        """筛选结果总数；精确计数写入 Redis 短期缓存，游标翻页时优先读取缓存"""
+        ttl = settings.INVOICE_COUNT_CACHE_TTL
+        key = None
+        if ttl > 0:
+            digest = hashlib.sha1(
+                json.dumps([filters.model_dump(mode="json"), include_duplicates], sort_keys=True).encode("utf-8")
+            ).hexdigest()
+            key = f"{INVOICE_COUNT_CACHE_PREFIX}{user_id}:{digest}"
+            if cached:
+                try:
+                    value = get_redis().get(key)
+                    if value is not None:
+                        return int(value)
+                except Exception as e:
+                    logger.debug(f"读取发票总数缓存失败: {e}")
+        total = query.order_by(None).count()
+        if key:
+            try:
+                get_redis().set(key, total, ex=ttl)
+            except Exception as e:
+                logger.debug(f"写入发票总数缓存失败: {e}")
+        return total
     
     def update_invoice(self, invoice_id: str, user_id: int, invoice_update: InvoiceUpdate) -> Optional[Invoice]:
         """更新发票信息"""
@@ -211,6 +329,7 @@ class InvoiceService:
         # 记录更新前的状态
         old_status = invoice.status
         old_ocr_status = invoice.ocr_status
+        old_facets = facet_values(invoice)
         
         update_data = invoice_update.dict(exclude_unset=True)
         updated_fields = []
@@ -227,6 +346,7 @@ class InvoiceService:
         
         if updated_fields:
             invoice.updated_at = datetime.now()
+            InvoiceFacetService(self.db).apply(user_id, facet_diff(old_facets, facet_values(invoice)))
         self.db.commit()
         self.db.refresh(invoice)
         
@@ -257,6 +377,14 @@ class InvoiceService:
         
         return invoice
     
+    def _assign_ocr_data(self, invoice: Invoice, ocr_data: dict, status: str) -> None:
+        """成功结果存入 ocr_payloads（通常识别时已写入），发票行只保留 sha256 引用；其余情况保存在行内"""
+        if status == "success" and ocr_data and invoice.file_sha256_hash:
+            OCRPayloadStore(self.db).ensure(invoice.file_sha256_hash, ocr_data)
+            invoice.ocr_raw_data = None
+        else:
+            invoice.ocr_raw_data = ocr_data
+
     def update_ocr_result(self, invoice_id: str, ocr_data: dict, status: str = "success") -> bool:
         """更新OCR识别结果（先判重后赋值；重复样本不占用 invoice_num）"""
         invoice = self.db.query(Invoice).filter(Invoice.id == invoice_id).first()
@@ -265,30 +393,15 @@ class InvoiceService:
 
         old_status = invoice.status
         old_ocr_status = invoice.ocr_status
+        old_facets = facet_values(invoice)
 
         invoice.ocr_status = status
-        invoice.ocr_raw_data = ocr_data
+        self._assign_ocr_data(invoice, ocr_data, status)
         invoice.processed_at = datetime.now()
 
         if status == "success" and ocr_data:
             # 从 ocr_data 中先解析发票号码，但暂不写回，避免唯一约束冲突
-            extracted_invoice_num = None
-            try:
-                words_result = ocr_data.get("words_result", {}) if isinstance(ocr_data, dict) else {}
-                if isinstance(words_result, dict):
-                    candidate = words_result.get("InvoiceNum")
-                    # 兼容多种结构：str 或 dict{word|words}
-                    if isinstance(candidate, dict):
-                        candidate = candidate.get("words") or candidate.get("word") or ""
-                    if isinstance(candidate, list) and candidate:
-                        # 取第一项的可读值
-                        first = candidate[0]
-                        candidate = (first.get("words") or first.get("word") if isinstance(first, dict) else str(first))
-                    if isinstance(candidate, str):
-                        candidate = candidate.strip()
-                    extracted_invoice_num = candidate or None
-            except Exception:
-                extracted_invoice_num = None
+            extracted_invoice_num = self._extract_invoice_num(ocr_data)
 
             try:
                 existing_invoice = None
@@ -371,17 +484,28 @@ class InvoiceService:
                 log_level="ERROR",
             )
 
+        # 名称由 _extract_ocr_fields 写入，筛选项随同一事务更新
+        InvoiceFacetService(self.db).apply(invoice.user_id, facet_diff(old_facets, facet_values(invoice)))
+
         # 提交并对唯一约束做兜底处理
         try:
             self.db.commit()
         except IntegrityError as ie:
             self.db.rollback()
             # 命中 (user_id, invoice_num) 唯一键冲突时，回退为 duplicate 并释放占用
-            if "uq_invoice_user_invoicenum" in str(ie.orig) or "1062" in str(ie.orig):
+            if "uq_invoice_user_invoicenum" in str(ie.orig):
+                # 回滚丢弃了本次的全部写入：重新写入 OCR 原始数据与字段（不占用票号），并重新应用筛选项增量
+                self._assign_ocr_data(invoice, ocr_data, status)
+                invoice.processed_at = datetime.now()
+                try:
+                    self._extract_ocr_fields(invoice, ocr_data)
+                except Exception as extract_error:
+                    logger.warning(f"重复发票字段写入失败: {invoice_id}, 错误: {extract_error}")
                 invoice.status = "duplicate"
                 invoice.ocr_status = "success"
                 invoice.ocr_error_message = "发票重复: 唯一票号已被占用"
                 invoice.invoice_num = None
+                InvoiceFacetService(self.db).apply(invoice.user_id, facet_diff(old_facets, facet_values(invoice)))
                 try:
                     self.db.commit()
                 except Exception:
@@ -391,6 +515,169 @@ class InvoiceService:
                 raise
         return True
     
+    def bulk_update_ocr_results(self, results: List[Tuple[str, dict, str]]) -> Dict[str, str]:
+        """批量写回OCR结果（一次判重查询 + 一次批量UPDATE + 一次提交）
+
+        results: [(invoice_id, ocr_data, "success"|"failed"), ...]
+        返回 {invoice_id: 最终发票状态}
+        """
+        if not results:
+            return {}
+
+        ids = [invoice_id for invoice_id, _, _ in results]
+        invoices = {
+            inv.id: inv
+            for inv in self.db.query(Invoice).filter(Invoice.id.in_(ids)).all()
+        }
+
+        # 一次 IN 查询解析本批次所有票号的占用情况
+        extracted_nums = {}
+        for invoice_id, ocr_data, status in results:
+            if status == "success" and ocr_data and invoice_id in invoices:
+                extracted_nums[invoice_id] = self._extract_invoice_num(ocr_data)
+        pairs = {
+            (invoices[invoice_id].user_id, num)
+            for invoice_id, num in extracted_nums.items() if num
+        }
+        taken = {}
+        if pairs:
+            rows = self.db.query(
+                Invoice.id, Invoice.user_id, Invoice.invoice_num, Invoice.original_filename
+            ).filter(
+                tuple_(Invoice.user_id, Invoice.invoice_num).in_(list(pairs)),
+                Invoice.id.notin_(ids),
+            ).all()
+            taken = {(row.user_id, row.invoice_num): (row.id, row.original_filename) for row in rows}
+
+        now = datetime.now()
+        mappings = []
+        final_status = {}
+        pending_logs = []
+        payloads = {}
+        facet_deltas = defaultdict(Counter)
+        for invoice_id, ocr_data, status in results:
+            invoice = invoices.get(invoice_id)
+            if invoice is None:
+                continue
+            mapping = {
+                "id": invoice_id,
+                "ocr_status": status,
+                "ocr_raw_data": ocr_data,
+                "processed_at": now,
+                "updated_at": now,
+            }
+            if status == "success" and ocr_data and invoice.file_sha256_hash:
+                # 成功结果存入 ocr_payloads，发票行只保留 sha256 引用
+                payloads[invoice.file_sha256_hash] = ocr_data
+                mapping["ocr_raw_data"] = None
+
+            if status == "success" and ocr_data:
+                # 在游离对象上解析字段，再整体写入映射
+                scratch = Invoice(original_filename=invoice.original_filename)
+                num = extracted_nums.get(invoice_id)
+                try:
+                    self._extract_ocr_fields(scratch, ocr_data)
+                    duplicate_of = taken.get((invoice.user_id, num)) if num else None
+                    if duplicate_of:
+                        scratch.invoice_num = None
+                        mapping["status"] = "duplicate"
+                        mapping["ocr_error_message"] = (
+                            f"发票重复: 与发票 {duplicate_of[0]} ({duplicate_of[1]}) 重复"
+                        )
+                        pending_logs.append(dict(
+                            event_type="ocr_duplicate_detected",
+                            message=f"OCR完成后检测到重复发票: {invoice.original_filename}",
+                            user_id=invoice.user_id,
+                            invoice_id=invoice_id,
+                            details={
+                                "filename": invoice.original_filename,
+                                "invoice_num": num,
+                                "duplicate_invoice_id": duplicate_of[0],
+                                "duplicate_filename": duplicate_of[1],
+                                "status_changed_to": "duplicate",
+                                "batch": True,
+                            },
+                            log_level="WARNING",
+                        ))
+                    else:
+                        mapping["status"] = "completed"
+                        if num:
+                            # 批次内先到先得，后续同号样本判为重复
+                            taken[(invoice.user_id, num)] = (invoice_id, invoice.original_filename)
+                except Exception as extract_error:
+                    scratch.invoice_num = None
+                    mapping["status"] = "completed"
+                    pending_logs.append(dict(
+                        event_type="ocr_duplicate_check_failed",
+                        message=f"OCR完成后去重检测失败: {str(extract_error)}",
+                        user_id=invoice.user_id,
+                        invoice_id=invoice_id,
+                        details={
+                            "filename": invoice.original_filename,
+                            "invoice_num": num,
+                            "error": str(extract_error),
+                            "exception_type": extract_error.__class__.__name__,
+                            "batch": True,
+                        },
+                        log_level="ERROR",
+                    ))
+                for field in OCR_EXTRACTED_FIELDS:
+                    mapping[field] = getattr(scratch, field)
+                facet_diff(facet_values(invoice), facet_values(mapping), facet_deltas[invoice.user_id])
+            elif status == "failed":
+                error_message = (ocr_data or {}).get("error_message", "OCR识别失败")
+                mapping["status"] = "failed"
+                mapping["ocr_error_message"] = error_message
+                pending_logs.append(dict(
+                    event_type="ocr_failed",
+                    message=f"OCR识别失败: {invoice.original_filename}",
+                    user_id=invoice.user_id,
+                    invoice_id=invoice_id,
+                    details={
+                        "old_status": invoice.status,
+                        "new_status": "failed",
+                        "change_reason": "ocr_failed",
+                        "error_message": error_message,
+                        "processed_at": now.isoformat(),
+                        "batch": True,
+                    },
+                    log_level="ERROR",
+                ))
+
+            mappings.append(mapping)
+            final_status[invoice_id] = mapping.get("status", invoice.status)
+
+        try:
+            if payloads:
+                OCRPayloadStore(self.db).ensure_many(payloads)
+            InvoiceFacetService(self.db).apply_many(facet_deltas)
+            self.db.bulk_update_mappings(Invoice, mappings)
+            self.db.commit()
+        except IntegrityError:
+            # 与并发写入冲突时逐条回退，由单条路径处理唯一约束兜底
+            self.db.rollback()
+            logger.warning("批量写回OCR结果命中唯一约束，回退为逐条写回")
+            for invoice_id, ocr_data, status in results:
+                self.update_ocr_result(invoice_id, ocr_data, status)
+            refreshed = self.db.query(Invoice.id, Invoice.status).filter(Invoice.id.in_(ids)).all()
+            return {row.id: row.status for row in refreshed}
+
+        for log_kwargs in pending_logs:
+            try:
+                logging_service.log_invoice_event(db=self.db, **log_kwargs)
+            except Exception:
+                pass
+
+        return final_status
+    
+    def get_ocr_payload(self, invoice: Invoice) -> Optional[dict]:
+        """获取发票的完整OCR结果：优先行内数据（失败结果/未迁移数据），否则按文件 sha256 查 ocr_payloads"""
+        if invoice.ocr_raw_data is not None:
+            return invoice.ocr_raw_data
+        if not invoice.file_sha256_hash:
+            return None
+        return OCRPayloadStore(self.db).get(invoice.file_sha256_hash)
+
     def delete_invoice(self, invoice_id: str, user_id: int) -> bool:
         """删除发票"""
         invoice = self.get_invoice(invoice_id, user_id)
@@ -412,6 +699,7 @@ class InvoiceService:
             if os.path.exists(attachment_file_path):
                 os.remove(attachment_file_path)
         
+        InvoiceFacetService(self.db).apply(user_id, facet_diff(facet_values(invoice), None))
         self.db.delete(invoice)
         self.db.commit()
         return True
@@ -436,6 +724,26 @@ class InvoiceService:
         return attachment
     
     
+    @staticmethod
+    def _extract_invoice_num(ocr_data: dict) -> Optional[str]:
+        """从OCR数据中解析发票号码（兼容 str / dict{word|words} / list 结构）"""
+        try:
+            words_result = ocr_data.get("words_result", {}) if isinstance(ocr_data, dict) else {}
+            if not isinstance(words_result, dict):
+                return None
+            candidate = words_result.get("InvoiceNum")
+            if isinstance(candidate, dict):
+                candidate = candidate.get("words") or candidate.get("word") or ""
+            if isinstance(candidate, list) and candidate:
+                # 取第一项的可读值
+                first = candidate[0]
+                candidate = (first.get("words") or first.get("word") if isinstance(first, dict) else str(first))
+            if isinstance(candidate, str):
+                candidate = candidate.strip()
+            return candidate or None
+        except Exception:
+            return None
+    
     def _extract_ocr_fields(self, invoice: Invoice, ocr_data: dict):
         """从OCR数据中提取结构化字段"""
         if not isinstance(ocr_data, dict):
@@ -0,0 +1,138 @@
+"""
+下载链接指纹缓存
+规范化 URL -> 内容 sha256/md5/大小与 ETag/Last-Modified，存 Redis（TTL）与 link_cache 表；
+重复出现的链接（提醒、转发、群发）可直接按指纹做去重判定，或用条件请求确认内容未变。
+"""
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.models.link_cache import LinkCache
+
+logger = logging.getLogger(__name__)
+
+# 不影响下载内容的跟踪参数
+_TRACKING_PARAMS = {"spm", "fbclid", "gclid"}
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+FINGERPRINT_FIELDS = (
+    "sha256", "file_md5_hash", "file_size", "stored_path", "filename", "etag", "last_modified",
+)
+
+
+def normalize_url(url: str) -> str:
+    """规范化 URL：协议与主机小写、去默认端口与片段、去跟踪参数并按键排序查询参数"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in _TRACKING_PARAMS and not k.lower().startswith("utm_")
+    )
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def url_hash(url: str) -> str:
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).hexdigest()
+
+
+class LinkFingerprintCache:
+    """链接指纹两级缓存：Redis -> 数据库"""
+
+    REDIS_KEY_PREFIX = "link:fp:"
+
+    def __init__(self, redis_ttl: int = None):
+        self.redis_ttl = redis_ttl if redis_ttl is not None else settings.EMAIL_LINK_CACHE_TTL
+
+    def _get_redis(self):
+        return get_redis()
+
+    def _redis_get(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.redis_ttl <= 0:
+            return None
+        try:
+            raw = self._get_redis().get(self.REDIS_KEY_PREFIX + key)
+            if raw:
+                return json.loads(raw)
+        except Exception as e:
+            logger.debug(f"读取链接指纹Redis缓存失败: {e}")
+        return None
+
+    def _redis_put(self, key: str, fingerprint: Dict[str, Any]) -> None:
+        if self.redis_ttl <= 0:
+            return
+        try:
+            self._get_redis().set(
+                self.REDIS_KEY_PREFIX + key, json.dumps(fingerprint, ensure_ascii=False), ex=self.redis_ttl
+            )
+        except Exception as e:
+            logger.debug(f"写入链接指纹Redis缓存失败: {e}")
+
+    def get(self, db: Session, url: str) -> Optional[Dict[str, Any]]:
+        """按规范化 URL 查找指纹"""
+        key = url_hash(url)
+        fingerprint = self._redis_get(key)
+        if fingerprint is not None:
+            return fingerprint
+        try:
+            row = db.query(LinkCache).filter(LinkCache.url_hash == key).first()
+        except Exception as e:
+            logger.debug(f"读取链接指纹失败: {e}")
+            return None
+        if row is None:
+            return None
+        fingerprint = {field: getattr(row, field) for field in FINGERPRINT_FIELDS}
+        self._redis_put(key, fingerprint)
+        return fingerprint
+
+    def put(self, db: Session, url: str, stored: Dict[str, Any]) -> None:
+        """记录下载结果的指纹（stored 为落盘信息，含 file_sha256_hash 与响应校验器）"""
+        if not stored.get("file_sha256_hash"):
+            return
+        key = url_hash(url)
+        fingerprint = {
+            "sha256": stored["file_sha256_hash"],
+            "file_md5_hash": stored.get("file_md5_hash"),
+            "file_size": stored.get("file_size"),
+            "stored_path": stored.get("relative_path"),
+            "filename": (stored.get("filename") or "")[:255] or None,
+            "etag": (stored.get("etag") or "")[:255] or None,
+            "last_modified": (stored.get("last_modified") or "")[:64] or None,
+        }
+        try:
+            row = db.query(LinkCache).filter(LinkCache.url_hash == key).first()
+            if row is None:
+                row = LinkCache(url_hash=key, url=normalize_url(url))
+                db.add(row)
+            for field, value in fingerprint.items():
+                setattr(row, field, value)
+            row.updated_at = datetime.now()
+            db.commit()
+        except Exception as e:
+            logger.debug(f"写入链接指纹失败: {e}")
+            db.rollback()
+        self._redis_put(key, fingerprint)
+
+
+_cache: Optional[LinkFingerprintCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_link_fingerprint_cache() -> LinkFingerprintCache:
+    """获取进程级共享链接指纹缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LinkFingerprintCache()
+    return _cache
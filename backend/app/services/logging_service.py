@@ -11,6 +11,7 @@ from fastapi import Request
 from app.models.system_log import SystemLog
 from app.models.user import User
 from app.core.database import get_db
+from app.services.fulltext_search import text_match
 
 
 class LoggingService:
@@ -245,12 +246,7 @@ class LoggingService:
                 filters.append(SystemLog.created_at <= date_to)
             
             if search:
-                filters.append(
-                    or_(
-                        SystemLog.message.contains(search),
-                        SystemLog.resource_id.contains(search) if SystemLog.resource_id else False
-                    )
-                )
+                filters.append(text_match(db, [SystemLog.message, SystemLog.resource_id], search))
             
             # 应用筛选条件
             if filters:
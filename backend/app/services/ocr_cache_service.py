@@ -0,0 +1,185 @@
+"""
+OCR 结果分层缓存（按文件 sha256）
+查找顺序：进程内 LRU -> Redis（zlib 压缩 JSON + TTL）-> 数据库（ocr_payloads 存储，未迁移的旧数据仍查 invoices / ocr_cache）；
+下层命中时回填上层，识别成功时写穿三层，避免重复识别风暴反复读取 MySQL 大字段。
+"""
+import json
+import threading
+import zlib
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+from app.core.metrics import OCR_CACHE_LOOKUPS
+from app.models.invoice import Invoice
+from app.models.ocr_cache import OCRCache
+from app.services.ocr_payload_store import OCRPayloadStore
+
+logger = logging.getLogger(__name__)
+
+
+# 本地文本层解析的结果（缺服务类型与商品金额等字段）不作为共享结果复用，
+# 以免同一文件之后切换引擎或重新识别时始终命中不完整的结果
+LOCAL_RESULT_ENGINES = ("local_pdf_text",)
+
+
+def is_shareable_result(result: Any) -> bool:
+    return isinstance(result, dict) and result.get("engine") not in LOCAL_RESULT_ENGINES
+
+
+class OCRResultCache:
+    """OCR 结果三级缓存"""
+
+    REDIS_KEY_PREFIX = "ocr:result:"
+
+    def __init__(self, max_entries: int = None, redis_ttl: int = None):
+        self.max_entries = max_entries if max_entries is not None else settings.OCR_CACHE_LRU_SIZE
+        self.redis_ttl = redis_ttl if redis_ttl is not None else settings.OCR_CACHE_REDIS_TTL
+        self._lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_redis(self):
+        return get_redis()
+
+    # ---- 进程内 LRU ----
+    def _lru_get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            value = self._lru.get(sha256)
+            if value is not None:
+                self._lru.move_to_end(sha256)
+            return value
+
+    def _lru_put(self, sha256: str, result: Dict[str, Any]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._lru[sha256] = result
+            self._lru.move_to_end(sha256)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+
+    # ---- Redis ----
+    def _redis_get(self, sha256: str) -> Optional[Dict[str, Any]]:
+        if self.redis_ttl <= 0:
+            return None
+        try:
+            raw = self._get_redis().get(self.REDIS_KEY_PREFIX + sha256)
+            if raw:
+                return json.loads(zlib.decompress(raw))
+        except Exception as e:
+            logger.debug(f"读取OCR结果Redis缓存失败: {e}")
+        return None
+
+    def _redis_put(self, sha256: str, result: Dict[str, Any]) -> None:
+        if self.redis_ttl <= 0:
+            return
+        try:
+            payload = zlib.compress(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+            self._get_redis().set(self.REDIS_KEY_PREFIX + sha256, payload, ex=self.redis_ttl)
+        except Exception as e:
+            logger.debug(f"写入OCR结果Redis缓存失败: {e}")
+
+    # ---- 数据库 ----
+    @staticmethod
+    def _db_get(db: Session, sha256: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        try:
+            result = OCRPayloadStore(db).get(sha256)
+            if is_shareable_result(result):
+                return result, "db"
+        except Exception:
+            pass
+        # 未迁移的旧数据
+        try:
+            row = (
+                db.query(Invoice.ocr_raw_data)
+                .filter(Invoice.file_sha256_hash == sha256, Invoice.ocr_status == "success")
+                .first()
+            )
+            if row and is_shareable_result(row.ocr_raw_data):
+                return row.ocr_raw_data, "invoice"
+        except Exception:
+            pass
+        try:
+            row = (
+                db.query(OCRCache.ocr_json)
+                .filter(OCRCache.sha256 == sha256, OCRCache.status == "success")
+                .first()
+            )
+            if row and row.ocr_json:
+                return row.ocr_json, "db"
+        except Exception:
+            pass
+        return None, None
+
+    @staticmethod
+    def _db_put(db: Session, sha256: str, result: Dict[str, Any]) -> None:
+        try:
+            # 完整结果只存一份（ocr_payloads），ocr_cache 仅记录状态
+            OCRPayloadStore(db).put(sha256, result)
+            cache = db.query(OCRCache).filter(OCRCache.sha256 == sha256).first()
+            if cache:
+                cache.status = "success"
+                cache.ocr_json = None
+                cache.updated_at = datetime.now()
+            else:
+                db.add(OCRCache(sha256=sha256, status="success"))
+            db.commit()
+        except Exception:
+            db.rollback()
+
+    def get(self, db: Optional[Session], sha256: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """查找缓存，返回 (结果, 命中层级: memory/redis/invoice/db)"""
+        if not sha256:
+            return None, None
+
+        result = self._lru_get(sha256)
+        if result is not None:
+            OCR_CACHE_LOOKUPS.labels(tier="memory", result="hit").inc()
+            return result, "memory"
+        OCR_CACHE_LOOKUPS.labels(tier="memory", result="miss").inc()
+
+        result = self._redis_get(sha256)
+        if result is not None:
+            OCR_CACHE_LOOKUPS.labels(tier="redis", result="hit").inc()
+            self._lru_put(sha256, result)
+            return result, "redis"
+        OCR_CACHE_LOOKUPS.labels(tier="redis", result="miss").inc()
+
+        if db is None:
+            return None, None
+        result, tier = self._db_get(db, sha256)
+        if result is not None:
+            OCR_CACHE_LOOKUPS.labels(tier="db", result="hit").inc()
+            self._redis_put(sha256, result)
+            self._lru_put(sha256, result)
+            return result, tier
+        OCR_CACHE_LOOKUPS.labels(tier="db", result="miss").inc()
+        return None, None
+
+    def put(self, db: Optional[Session], sha256: str, result: Dict[str, Any]) -> None:
+        """识别成功后写穿三层缓存（本地解析结果不写入）"""
+        if not sha256 or not is_shareable_result(result):
+            return
+        if db is not None:
+            self._db_put(db, sha256, result)
+        self._redis_put(sha256, result)
+        self._lru_put(sha256, result)
+
+
+_cache: Optional[OCRResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_result_cache() -> OCRResultCache:
+    """获取进程级共享OCR结果缓存"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = OCRResultCache()
+    return _cache
@@ -0,0 +1,224 @@
+"""
+百度OCR共享客户端
+进程级单例：缓存 access_token（Redis + 进程内），复用 keep-alive HTTP 连接池
+"""
+import os
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+import logging
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.core.config import settings
+from app.core.redis_client import get_redis, get_redis_pipeline
+
+logger = logging.getLogger(__name__)
+
+# 令牌失效相关的错误码（110: Access token invalid, 111: Access token expired）
+TOKEN_INVALID_ERROR_CODES = {110, 111}
+
+# 流式编码的读块大小（3 的倍数，保证分块 base64 拼接后与整体编码一致）
+_ENCODE_CHUNK_SIZE = 3 * 64 * 1024
+
+
+class OCRTokenError(Exception):
+    """无法获取OCR访问令牌"""
+
+
+def compute_file_sha256(file_path: str) -> str:
+    """分块计算文件 sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(_ENCODE_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FormFileBody:
+    """application/x-www-form-urlencoded 请求体，内容为 `<field>=<urlencode(base64(文件))>`
+    小文件留在内存，超过 OCR_BODY_SPOOL_MAX_SIZE 落盘；提供 __len__ 以便 requests 设置 Content-Length 并分块发送。
+    """
+
+    def __init__(self, spool):
+        self._spool = spool
+        self._length = spool.tell()
+        spool.seek(0)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        return self._spool.read(size)
+
+    def __iter__(self):
+        return iter(lambda: self._spool.read(_ENCODE_CHUNK_SIZE), b"")
+
+    def rewind(self) -> None:
+        self._spool.seek(0)
+
+    def close(self) -> None:
+        self._spool.close()
+
+
+def build_form_file_body(field: str, file_path: str) -> FormFileBody:
+    """流式读取文件并编码为表单请求体（原始字节与编码结果不会整体同时驻留内存）"""
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.OCR_BODY_SPOOL_MAX_SIZE)
+    try:
+        spool.write(quote(field, safe="").encode("ascii") + b"=")
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(_ENCODE_CHUNK_SIZE), b""):
+                spool.write(quote(base64.b64encode(chunk), safe="").encode("ascii"))
+    except Exception:
+        spool.close()
+        raise
+    return FormFileBody(spool)
+
+
+class BaiduOCRClient:
+    """百度OCR HTTP客户端（连接池 + 令牌缓存）"""
+
+    TOKEN_CACHE_KEY = "ocr:baidu:access_token"
+
+    def __init__(self, base_url: str = None, api_key: str = None, secret_key: str = None):
+        self.base_url = (base_url or settings.BAIDU_OCR_BASE_URL).rstrip("/")
+        self.api_key = api_key if api_key is not None else settings.BAIDU_OCR_API_KEY
+        self.secret_key = secret_key if secret_key is not None else settings.BAIDU_OCR_SECRET_KEY
+        self._lock = threading.RLock()
+        self._session: Optional[requests.Session] = None
+        self._session_pid: Optional[int] = None
+        self._token: Optional[str] = None
+        self._token_expires_at: float = 0.0
+
+    @property
+    def session(self) -> requests.Session:
+        """keep-alive 连接池；fork 后（Celery prefork）在子进程内重建，避免共享套接字"""
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=settings.OCR_HTTP_POOL_SIZE,
+                        pool_maxsize=settings.OCR_HTTP_POOL_SIZE,
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def _token_cache_key(self) -> str:
+        # 按 API Key 区分，避免更换凭据后复用旧令牌
+        return f"{self.TOKEN_CACHE_KEY}:{(self.api_key or '')[-8:]}"
+
+    def get_access_token(self, force_refresh: bool = False) -> Optional[str]:
+        """获取访问令牌：进程内缓存 -> Redis 缓存 -> OAuth 接口"""
+        if not self.api_key or not self.secret_key:
+            logger.error(
+                f"百度OCR API密钥未配置 - API_KEY: {'已设置' if self.api_key else '未设置'}, "
+                f"SECRET_KEY: {'已设置' if self.secret_key else '未设置'}"
+            )
+            return None
+
+        now = time.time()
+        if not force_refresh and self._token and now < self._token_expires_at:
+            return self._token
+
+        with self._lock:
+            now = time.time()
+            if not force_refresh and self._token and now < self._token_expires_at:
+                return self._token
+
+            if not force_refresh:
+                try:
+                    pipe = get_redis_pipeline()
+                    pipe.get(self._token_cache_key())
+                    pipe.ttl(self._token_cache_key())
+                    cached, ttl = pipe.execute()
+                    if cached and ttl and int(ttl) > 0:
+                        self._token = cached.decode() if isinstance(cached, bytes) else cached
+                        self._token_expires_at = now + int(ttl)
+                        return self._token
+                except Exception as e:
+                    logger.debug(f"读取OCR令牌缓存失败，回退到直接获取: {e}")
+
+            return self._fetch_access_token()
+
+    def _fetch_access_token(self) -> Optional[str]:
+        """调用 OAuth 接口获取新令牌，并按有效期写入 Redis（提前刷新）"""
+        url = f"{self.base_url}/oauth/2.0/token"
+        params = {
+            "grant_type": "client_credentials",
+            "client_id": self.api_key,
+            "client_secret": self.secret_key,
+        }
+        try:
+            response = self.session.get(url, params=params, timeout=settings.OCR_TIMEOUT)
+            response.raise_for_status()
+            result = response.json()
+        except Exception as e:
+            logger.error(f"获取百度OCR访问令牌异常: {str(e)}")
+            return None
+
+        token = result.get("access_token")
+        if not token:
+            logger.error(f"获取访问令牌失败: {result}")
+            return None
+
+        # 有效期默认30天；提前 OCR_TOKEN_REFRESH_MARGIN 秒视为过期，以便在真正失效前刷新
+        try:
+            expires_in = int(result.get("expires_in") or 2592000)
+        except (TypeError, ValueError):
+            expires_in = 2592000
+        ttl = max(60, expires_in - settings.OCR_TOKEN_REFRESH_MARGIN)
+
+        self._token = token
+        self._token_expires_at = time.time() + ttl
+        try:
+            get_redis().set(self._token_cache_key(), token, ex=ttl)
+        except Exception as e:
+            logger.debug(f"写入OCR令牌缓存失败: {e}")
+        return token
+
+    def invalidate_token(self) -> None:
+        """令牌被服务端判定失效时清除缓存"""
+        with self._lock:
+            self._token = None
+            self._token_expires_at = 0.0
+        try:
+            get_redis().delete(self._token_cache_key())
+        except Exception:
+            pass
+
+    def post(self, path: str, data: Any, timeout: int = None, headers: Dict[str, str] = None) -> requests.Response:
+        """使用连接池发起 API 请求（自动附带 access_token）"""
+        token = self.get_access_token()
+        if not token:
+            raise OCRTokenError("无法获取访问令牌")
+        return self.session.post(
+            f"{self.base_url}{path}",
+            headers=headers or {"Content-Type": "application/x-www-form-urlencoded"},
+            params={"access_token": token},
+            data=data,
+            timeout=timeout or settings.OCR_TIMEOUT,
+        )
+
+
+_client: Optional[BaiduOCRClient] = None
+_client_lock = threading.Lock()
+
+
+def get_ocr_client() -> BaiduOCRClient:
+    """获取进程级共享OCR客户端"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = BaiduOCRClient()
+    return _client
@@ -0,0 +1,259 @@
+"""
+OCR 识别引擎
+电子发票（全电发票、增值税电子发票）通常带有文本层：本地引擎直接解析 PDF 文本，
+输出与百度 vat_invoice 接口一致的 words_result 结构；缺少必需字段时返回 None，由调用方回退远程接口。
+"""
+import os
+import re
+import math
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional
+
+import fitz  # PyMuPDF
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 本地结果可直接采用所需的字段；缺任一项即回退远程 OCR
+REQUIRED_FIELDS = ("InvoiceNum", "InvoiceDate", "AmountInFiguers", "PurchaserName", "SellerName")
+
+_AMOUNT = r"(-?[\d,]+\.\d{2})"
+_CN_AMOUNT_CHARS = "零壹贰叁肆伍陆柒捌玖拾佰仟万亿元圆角分整正负"
+
+_PATTERNS = {
+    "InvoiceCode": re.compile(r"发票代码:(\d{10,12})"),
+    "InvoiceNum": re.compile(r"发票号码:(\d{8,20})"),
+    "InvoiceDate": re.compile(r"开票日期:(\d{4}年\d{1,2}月\d{1,2}日)"),
+    "CheckCode": re.compile(r"校验码:([\d]{20})"),
+    "AmountInFiguers": re.compile(r"\(小写\)¥?" + _AMOUNT),
+    "AmountInWords": re.compile(r"价税合计\(大写\)[^" + _CN_AMOUNT_CHARS + r"\n]*([" + _CN_AMOUNT_CHARS + r"]+)"),
+    "InvoiceType": re.compile(r"((?:电子发票|增值税电子)[^\n]*?(?:普通发票|专用发票)\)?)"),
+}
+_TOTAL_PATTERN = re.compile(r"(?<!价税)合计¥?" + _AMOUNT + r"(?:¥?" + _AMOUNT + r")?")
+# 名称可能与标签同行，也可能在下一行；取到行尾，避免把后续标签当作名称
+_NAME_PATTERN = re.compile(r"名称:\n?([^\n:]+)(?=\n|\Z)")
+# 商品行以 "*税收分类*商品名" 开头
+_COMMODITY_PATTERN = re.compile(r"^(\*[^*\n]+\*[^\n]*)$", re.MULTILINE)
+_REGISTER_PATTERN = re.compile(r"(?:统一社会信用代码/纳税人识别号|纳税人识别号):([0-9A-Z]{15,20})")
+
+
+def extract_pdf_text(file_path: str, max_pages: int = None) -> str:
+    """读取 PDF 前若干页的文本层（无文本层时返回空串）"""
+    max_pages = max_pages or settings.OCR_LOCAL_MAX_PAGES
+    with fitz.open(file_path) as doc:
+        return "\n".join(doc[i].get_text("text") for i in range(min(max_pages, doc.page_count)))
+
+
+def _normalize(text: str) -> str:
+    # 统一全角标点，去掉行内空白（PDF 文本层常见 "名 称 ：" 之类的字间空格），保留换行
+    text = (
+        text.replace("：", ":")
+        .replace("￥", "¥")
+        .replace("（", "(")
+        .replace("）", ")")
+    )
+    return re.sub(r"[ \t　\xa0]+", "", text)
+
+
+def _clean_amount(value: Optional[str]) -> str:
+    return value.replace(",", "") if value else ""
+
+
+def parse_invoice_text(text: str) -> Dict[str, Any]:
+    """从发票文本层解析出 words_result 结构（字段名与百度 vat_invoice 接口一致）"""
+    text = _normalize(text)
+    words: Dict[str, Any] = {}
+
+    for field, pattern in _PATTERNS.items():
+        match = pattern.search(text)
+        if match:
+            words[field] = match.group(1)
+    words["AmountInFiguers"] = _clean_amount(words.get("AmountInFiguers"))
+
+    total = _TOTAL_PATTERN.search(text)
+    if total:
+        words["TotalAmount"] = _clean_amount(total.group(1))
+        words["TotalTax"] = _clean_amount(total.group(2))
+
+    # 票面固定为购买方在前、销售方在后
+    names = [n.strip() for n in _NAME_PATTERN.findall(text) if n.strip()]
+    registers = _REGISTER_PATTERN.findall(text)
+    if names:
+        words["PurchaserName"] = names[0]
+    if len(names) > 1:
+        words["SellerName"] = names[1]
+    if registers:
+        words["PurchaserRegisterNum"] = registers[0]
+    if len(registers) > 1:
+        words["SellerRegisterNum"] = registers[1]
+
+    # 商品明细仅解析名称（金额/税率列在文本层中的排布因版式而异）；服务类型无法从文本层可靠推断
+    commodities = [name.strip() for name in _COMMODITY_PATTERN.findall(text) if name.strip()]
+    if commodities:
+        words["CommodityName"] = [{"row": str(i + 1), "word": name} for i, name in enumerate(commodities)]
+
+    return {k: v for k, v in words.items() if v}
+
+
+def is_consistent(words: Dict[str, Any]) -> bool:
+    """必需字段齐全且金额可自洽（合计 + 税额 = 价税合计）"""
+    if any(not words.get(field) for field in REQUIRED_FIELDS):
+        return False
+    try:
+        gross = float(words["AmountInFiguers"])
+        if words.get("TotalAmount") and words.get("TotalTax"):
+            return abs(float(words["TotalAmount"]) + float(words["TotalTax"]) - gross) < 0.011
+    except ValueError:
+        return False
+    return True
+
+
+def recognize_pdf_text(file_path: str) -> Optional[Dict[str, Any]]:
+    """解析 PDF 文本层，返回与远程接口同构的结果；无法可靠提取时返回 None"""
+    text = extract_pdf_text(file_path)
+    if not text.strip():
+        return None
+    words = parse_invoice_text(text)
+    if not is_consistent(words):
+        return None
+    return {
+        "words_result": words,
+        "words_result_num": len(words),
+        "engine": LocalPDFTextEngine.name,
+    }
+
+
+class OCREngine:
+    """OCR 引擎接口：recognize 返回 words_result 结构，无法识别时返回 None"""
+
+    name = "base"
+
+    def recognize(self, file_path: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def recognize_many(self, file_paths: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """批量识别，结果与输入一一对应"""
+        return [self.recognize(path) for path in file_paths]
+
+
+class LocalPDFTextEngine(OCREngine):
+    """基于 PyMuPDF 文本层的本地解析引擎（仅 CPU，无 QPS 限制）"""
+
+    name = "local_pdf_text"
+
+    def recognize(self, file_path: str) -> Optional[Dict[str, Any]]:
+        try:
+            return recognize_pdf_text(file_path)
+        except Exception as e:
+            logger.debug(f"本地文本层解析失败，回退远程OCR: {file_path}, {e}")
+            return None
+
+
+class ProcessPoolPDFTextEngine(LocalPDFTextEngine):
+    """多进程本地解析引擎
+    文本层解析为 CPU 密集型，放到 spawn 方式的进程池中并行执行；
+    子进程处理 max_tasks_per_child 份文档后回收，限制 MuPDF 内存增长；单文档超时即回退远程 OCR。
+    """
+
+    def __init__(self, workers: int = None, timeout: float = None, max_tasks_per_child: int = None):
+        self.workers = max(1, workers or settings.OCR_LOCAL_WORKERS or 1)
+        self.timeout = float(timeout or settings.OCR_LOCAL_TIMEOUT)
+        self.max_tasks_per_child = max_tasks_per_child or settings.OCR_LOCAL_MAX_TASKS_PER_CHILD
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+        # 当前进程不允许创建子进程（如 Celery prefork 的守护子进程）时改为进程内解析
+        self._inline = False
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+                self._executor_pid = pid
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        """丢弃当前进程池并终止其子进程（超时任务无法单独取消）"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            try:
+                process.terminate()
+            except Exception:
+                pass
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def recognize(self, file_path: str) -> Optional[Dict[str, Any]]:
+        return self.recognize_many([file_path])[0]
+
+    def recognize_many(self, file_paths: List[str]) -> List[Optional[Dict[str, Any]]]:
+        if not file_paths:
+            return []
+        if self._inline:
+            return [super(ProcessPoolPDFTextEngine, self).recognize(path) for path in file_paths]
+
+        try:
+            executor = self._get_executor()
+            futures = [executor.submit(recognize_pdf_text, path) for path in file_paths]
+        except (AssertionError, OSError, RuntimeError) as e:
+            logger.warning(f"无法创建本地解析进程池，改为进程内解析: {e}")
+            self._inline = True
+            self._reset_executor()
+            return [super(ProcessPoolPDFTextEngine, self).recognize(path) for path in file_paths]
+
+        # 按轮次放宽总期限：每个文档最多占用 timeout 秒的 worker 时间
+        deadline = time.monotonic() + self.timeout * math.ceil(len(file_paths) / self.workers)
+        results: List[Optional[Dict[str, Any]]] = []
+        broken = False
+        for path, future in zip(file_paths, futures):
+            try:
+                results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                logger.warning(f"本地文本层解析超时，回退远程OCR: {path}")
+                future.cancel()
+                broken = True
+                results.append(None)
+            except BrokenProcessPool as e:
+                logger.warning(f"本地解析进程池异常退出，回退远程OCR: {path}, {e}")
+                broken = True
+                results.append(None)
+            except Exception as e:
+                logger.debug(f"本地文本层解析失败，回退远程OCR: {path}, {e}")
+                results.append(None)
+        if broken:
+            self._reset_executor()
+        return results
+
+
+_engine: Optional[OCREngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_local_ocr_engine() -> Optional[OCREngine]:
+    """按 OCR_ENGINE 返回进程级共享的本地引擎；baidu 模式下不启用。
+    OCR_LOCAL_WORKERS > 1 时使用进程池，否则在当前进程内解析。
+    """
+    global _engine
+    if settings.OCR_ENGINE not in ("auto", "local"):
+        return None
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if settings.OCR_LOCAL_WORKERS > 1:
+                    _engine = ProcessPoolPDFTextEngine()
+                else:
+                    _engine = LocalPDFTextEngine()
+    return _engine
@@ -0,0 +1,258 @@
+"""
+OCR 原始数据存储
+识别结果 JSON 按文件 sha256 内容寻址存于 ocr_payloads 表，zstd 压缩（未安装 zstandard 时为 gzip）；
+invoices、ocr_cache 与 OCR 成功日志只保存 sha256 引用，热表不再携带完整 JSON。
+OCRPayloadMigration 把历史数据从三处迁入存储并回收表空间，同时给出迁移前后的表大小与列表查询耗时。
+"""
+import gzip
+import json
+import logging
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from app.models.invoice import Invoice
+from app.models.ocr_cache import OCRCache
+from app.models.ocr_payload import OCRPayload
+from app.models.system_log import SystemLog
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，缺失时使用 gzip
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+ZSTD_LEVEL = 10
+GZIP_LEVEL = 6
+
+# 迁移涉及的表（表大小对比）
+MIGRATION_TABLES = ("invoices", "ocr_cache", "system_logs", "ocr_payloads")
+
+
+def encode_payload(data: Dict[str, Any]) -> Tuple[str, bytes, int]:
+    """压缩 JSON，返回 (codec, 压缩数据, 原始字节数)"""
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw), len(raw)
+    return "gzip", gzip.compress(raw, compresslevel=GZIP_LEVEL), len(raw)
+
+
+def decode_payload(codec: str, blob: bytes) -> Dict[str, Any]:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("读取 zstd 压缩的 OCR 数据需要安装 zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(blob)
+    elif codec == "gzip":
+        raw = gzip.decompress(blob)
+    else:
+        raise ValueError(f"未知的 OCR 数据压缩格式: {codec}")
+    return json.loads(raw)
+
+
+class OCRPayloadStore:
+    """OCR 原始数据存储（写入随调用方事务提交）"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get(self, sha256: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not sha256:
+            return None
+        row = self.db.query(OCRPayload.codec, OCRPayload.payload).filter(OCRPayload.sha256 == sha256).first()
+        if row is None:
+            return None
+        try:
+            return decode_payload(row.codec, row.payload)
+        except Exception as e:
+            logger.error(f"读取OCR原始数据失败: {sha256}, 错误: {e}")
+            return None
+
+    def put(self, sha256: str, data: Dict[str, Any]) -> None:
+        """写入（已存在则覆盖）"""
+        codec, blob, raw_size = encode_payload(data)
+        self.db.merge(OCRPayload(sha256=sha256, codec=codec, payload=blob, raw_size=raw_size, stored_size=len(blob)))
+
+    def ensure_many(self, payloads: Dict[str, Dict[str, Any]]) -> int:
+        """仅写入尚不存在的 sha256（一次 IN 查询），返回新写入条数
+        MySQL 上以 ON DUPLICATE KEY 写入：查询之后被并发请求写入的同一 sha256 保留已有行，不会引发唯一键冲突。
+        """
+        if not payloads:
+            return 0
+        existing = {
+            row.sha256 for row in
+            self.db.query(OCRPayload.sha256).filter(OCRPayload.sha256.in_(list(payloads))).all()
+        }
+        rows = []
+        for sha256, data in payloads.items():
+            if sha256 in existing or not isinstance(data, dict):
+                continue
+            codec, blob, raw_size = encode_payload(data)
+            rows.append({"sha256": sha256, "codec": codec, "payload": blob,
+                         "raw_size": raw_size, "stored_size": len(blob)})
+        if not rows:
+            return 0
+
+        if self.db.get_bind().dialect.name == "mysql":
+            stmt = mysql_insert(OCRPayload).values(rows)
+            self.db.execute(stmt.on_duplicate_key_update(codec=OCRPayload.codec))
+        else:
+            self.db.add_all(OCRPayload(**row) for row in rows)
+        return len(rows)
+
+    def ensure(self, sha256: str, data: Dict[str, Any]) -> None:
+        self.ensure_many({sha256: data})
+
+
+class OCRPayloadMigration:
+    """把 invoices.ocr_raw_data、ocr_cache.ocr_json 与 OCR 成功日志中的 api_response 迁入 ocr_payloads。
+    各阶段按主键分批推进（after_id 之后的 limit 条），每批一次提交，可中断后从返回的位置继续。
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.store = OCRPayloadStore(db)
+
+    def migrate_invoices(self, after_id: str, limit: int) -> Tuple[Optional[str], int]:
+        rows = (
+            self.db.query(Invoice.id, Invoice.file_sha256_hash, Invoice.ocr_raw_data)
+            .filter(
+                Invoice.id > after_id,
+                Invoice.ocr_status == "success",
+                Invoice.file_sha256_hash.isnot(None),
+                Invoice.ocr_raw_data.isnot(None),
+            )
+            .order_by(Invoice.id)
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            return None, 0
+        self.store.ensure_many({row.file_sha256_hash: row.ocr_raw_data for row in rows if row.ocr_raw_data})
+        ids = [row.id for row in rows]
+        self.db.query(Invoice).filter(Invoice.id.in_(ids)).update(
+            {Invoice.ocr_raw_data: None}, synchronize_session=False
+        )
+        self.db.commit()
+        return ids[-1], len(rows)
+
+    def migrate_ocr_cache(self, after_id: int, limit: int) -> Tuple[Optional[int], int]:
+        rows = (
+            self.db.query(OCRCache.id, OCRCache.sha256, OCRCache.ocr_json)
+            .filter(OCRCache.id > after_id, OCRCache.ocr_json.isnot(None))
+            .order_by(OCRCache.id)
+            .limit(limit)
+            .all()
+        )
+        if not rows:
+            return None, 0
+        self.store.ensure_many({row.sha256: row.ocr_json for row in rows if row.ocr_json})
+        ids = [row.id for row in rows]
+        self.db.query(OCRCache).filter(OCRCache.id.in_(ids)).update(
+            {OCRCache.ocr_json: None}, synchronize_session=False
+        )
+        self.db.commit()
+        return ids[-1], len(rows)
+
+    def migrate_logs(self, after_id: int, limit: int) -> Tuple[Optional[int], int]:
+        """OCR 成功日志：api_response 换成 ocr_payload_sha256 引用（发票缺少 sha256 时保留原文）。仅 MySQL"""
+        if self.db.get_bind().dialect.name != "mysql":
+            return None, 0
+        logs = (
+            self.db.query(SystemLog)
+            .filter(
+                SystemLog.id > after_id,
+                SystemLog.log_type == "ocr",
+                SystemLog.resource_type == "invoice",
+                func.json_contains_path(SystemLog.details, "one", "$.api_response.words_result") == 1,
+            )
+            .order_by(SystemLog.id)
+            .limit(limit)
+            .all()
+        )
+        if not logs:
+            return None, 0
+        invoice_ids = {log.resource_id for log in logs if log.resource_id}
+        hashes = dict(
+            self.db.query(Invoice.id, Invoice.file_sha256_hash)
+            .filter(Invoice.id.in_(list(invoice_ids)), Invoice.file_sha256_hash.isnot(None))
+            .all()
+        ) if invoice_ids else {}
+        payloads = {}
+        for log in logs:
+            sha256 = hashes.get(log.resource_id)
+            details = dict(log.details or {})
+            if not sha256 or not isinstance(details.get("api_response"), dict):
+                continue
+            payloads.setdefault(sha256, details.pop("api_response"))
+            details["ocr_payload_sha256"] = sha256
+            log.details = details
+        self.store.ensure_many(payloads)
+        self.db.commit()
+        return logs[-1].id, len(logs)
+
+    def reclaim_space(self) -> None:
+        """重建表以回收迁出大字段后的空间（InnoDB 为在线重建）。仅 MySQL"""
+        if self.db.get_bind().dialect.name != "mysql":
+            return
+        with self.db.get_bind().connect() as conn:
+            conn.execute(text("OPTIMIZE TABLE `invoices`, `ocr_cache`, `system_logs`")).fetchall()
+
+    def measure(self, runs: int = 5) -> Dict[str, Any]:
+        """迁移前后对比：各表数据/索引大小（字节）与发票最多的用户首页 SELECT * 的中位耗时（毫秒）"""
+        result: Dict[str, Any] = {"tables": {}, "list_query_ms": None}
+        bind = self.db.get_bind()
+        if bind.dialect.name == "mysql":
+            try:
+                with bind.connect() as conn:
+                    tables = ", ".join(f"`{name}`" for name in MIGRATION_TABLES)
+                    conn.execute(text(f"ANALYZE TABLE {tables}")).fetchall()
+                    names = ", ".join(f"'{name}'" for name in MIGRATION_TABLES)
+                    rows = conn.execute(text(
+                        "SELECT table_name, data_length, index_length, data_free FROM information_schema.tables "
+                        f"WHERE table_schema = DATABASE() AND table_name IN ({names})"
+                    )).fetchall()
+                    result["tables"] = {
+                        row[0]: {"data_length": int(row[1] or 0), "index_length": int(row[2] or 0),
+                                 "data_free": int(row[3] or 0)}
+                        for row in rows
+                    }
+            except Exception as e:
+                logger.warning(f"读取表大小失败: {e}")
+
+        top_user = (
+            self.db.query(Invoice.user_id)
+            .group_by(Invoice.user_id)
+            .order_by(func.count(Invoice.id).desc())
+            .first()
+        )
+        if top_user is not None:
+            timings = []
+            statement = text(
+                "SELECT * FROM invoices WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 100"
+            )
+            for _ in range(runs):
+                started = time.perf_counter()
+                self.db.execute(statement, {"user_id": top_user.user_id}).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            result["list_query_ms"] = round(statistics.median(timings), 3)
+        self.db.rollback()
+        return result
+
+
+def summarize_sizes(before: Dict[str, Any], after: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """按表汇总迁移前后的大小变化"""
+    summary = []
+    for name in MIGRATION_TABLES:
+        old = (before.get("tables") or {}).get(name, {})
+        new = (after.get("tables") or {}).get(name, {})
+        old_total = old.get("data_length", 0) + old.get("index_length", 0)
+        new_total = new.get("data_length", 0) + new.get("index_length", 0)
+        summary.append({"table": name, "before_bytes": old_total, "after_bytes": new_total,
+                        "delta_bytes": new_total - old_total})
+    return summary
+
@@ -0,0 +1,216 @@
+"""
+OCR 分布式限流器
+基于 Redis Lua 脚本的令牌桶（GCRA 实现）：原子地预约调用时隙并返回精确等待时间，
+并按活跃用户的权重划分配额，避免单个用户的大批量任务饿死其他用户。
+"""
+import time
+import threading
+import logging
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+import redis
+
+from app.core.config import settings
+from app.core.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# KEYS[1] 全局 TAT（theoretical arrival time）
+# KEYS[2] 用户 TAT
+# KEYS[3] 活跃用户 ZSET（score = 最近请求时间）
+# KEYS[4] 活跃用户权重 HASH
+# ARGV: rate(次/秒), burst, user, weight, active_window_us, max_wait_us
+# 返回 {reserved(1/0), wait_us}
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local user = ARGV[3]
+local weight = tonumber(ARGV[4])
+local window = tonumber(ARGV[5])
+local max_wait = tonumber(ARGV[6])
+
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000000 + tonumber(t[2])
+
+-- 维护活跃用户集合及其权重
+redis.call('ZADD', KEYS[3], now, user)
+redis.call('HSET', KEYS[4], user, weight)
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now - window)
+if #expired > 0 then
+  redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now - window)
+  redis.call('HDEL', KEYS[4], unpack(expired))
+end
+local active = redis.call('ZRANGE', KEYS[3], 0, -1)
+local total_weight = 0
+local weights = redis.call('HMGET', KEYS[4], unpack(active))
+for i = 1, #weights do
+  total_weight = total_weight + (tonumber(weights[i]) or 1)
+end
+if total_weight <= 0 then total_weight = weight end
+
+-- 用户份额：rate * weight / sum(weights)
+local user_rate = rate * weight / total_weight
+local user_interval = 1000000 / user_rate
+local global_interval = 1000000 / rate
+
+-- 用户桶：最早可执行时间
+local user_tat = tonumber(redis.call('GET', KEYS[2]) or now)
+if user_tat < now then user_tat = now end
+local user_allow = user_tat + user_interval - burst * user_interval
+if user_allow < now then user_allow = now end
+
+-- 全局桶：在用户最早可执行时间之后预约
+local global_tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if global_tat < user_allow then global_tat = user_allow end
+local global_new = global_tat + global_interval
+local allow_at = global_new - burst * global_interval
+if allow_at < user_allow then allow_at = user_allow end
+
+local wait = allow_at - now
+if wait > max_wait then
+  return {0, string.format('%.0f', wait)}
+end
+
+local ttl = math.ceil((global_new - now) / 1000000) + 2
+redis.call('SET', KEYS[1], string.format('%.0f', global_new), 'EX', ttl)
+local user_new = user_tat + user_interval
+if user_new < allow_at + user_interval then user_new = allow_at + user_interval end
+redis.call('SET', KEYS[2], string.format('%.0f', user_new), 'EX', math.ceil((user_new - now) / 1000000) + 2)
+redis.call('PEXPIRE', KEYS[3], math.ceil(window / 1000) + 1000)
+redis.call('PEXPIRE', KEYS[4], math.ceil(window / 1000) + 1000)
+return {1, string.format('%.0f', wait)}
+"""
+
+
+class OCRRateLimitExceeded(Exception):
+    """等待时间超过上限，本次未预约时隙"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"OCR限流：需等待 {retry_after:.2f} 秒")
+        self.retry_after = retry_after
+
+
+def parse_user_weights(raw: str) -> Dict[str, float]:
+    """解析 OCR_USER_WEIGHTS，格式: "user_id:weight,user_id:weight" """
+    weights: Dict[str, float] = {}
+    for item in (raw or "").split(","):
+        if ":" not in item:
+            continue
+        user, weight = item.split(":", 1)
+        try:
+            w = float(weight)
+        except ValueError:
+            continue
+        if user.strip() and w > 0:
+            weights[user.strip()] = w
+    return weights
+
+
+class OCRRateLimiter:
+    """OCR 令牌桶限流器（Redis 全局 + 进程内回退）"""
+
+    KEY_PREFIX = "rate:ocr:baidu"
+
+    def __init__(
+        self,
+        rate: float = None,
+        burst: int = None,
+        active_window: float = None,
+        max_wait: float = None,
+    ):
+        self.rate = float(rate or settings.OCR_QPS_LIMIT or 2)
+        self.burst = max(1, int(burst or settings.OCR_RATE_BURST))
+        self.active_window = float(active_window or settings.OCR_RATE_ACTIVE_WINDOW)
+        self.max_wait = float(max_wait if max_wait is not None else settings.OCR_RATE_MAX_WAIT)
+        self.user_weights = parse_user_weights(settings.OCR_USER_WEIGHTS)
+        self._script = None
+        # Redis 不可用时的进程内回退（同一进程内所有线程共享）
+        self._local_lock = threading.Lock()
+        self._local_calls = deque()
+
+    def _get_script(self):
+        if self._script is None:
+            self._script = get_redis().register_script(TOKEN_BUCKET_SCRIPT)
+        return self._script
+
+    def weight_for(self, user_id: Optional[int]) -> float:
+        if user_id is None:
+            return 1.0
+        return self.user_weights.get(str(user_id), 1.0)
+
+    def reserve(self, user_id: Optional[int] = None, weight: float = None) -> Tuple[bool, float]:
+        """原子预约一个调用时隙，返回 (是否已预约, 需等待秒数)"""
+        if self.rate <= 0:
+            return True, 0.0
+        user = str(user_id) if user_id is not None else "anonymous"
+        w = float(weight or self.weight_for(user_id))
+        script = self._get_script()
+        reserved, wait_us = script(
+            keys=[
+                f"{self.KEY_PREFIX}:tat",
+                f"{self.KEY_PREFIX}:user:{user}:tat",
+                f"{self.KEY_PREFIX}:active",
+                f"{self.KEY_PREFIX}:weights",
+            ],
+            args=[
+                self.rate,
+                self.burst,
+                user,
+                w,
+                int(self.active_window * 1_000_000),
+                int(self.max_wait * 1_000_000),
+            ],
+            # 执行时取当前进程的共享客户端（fork 后已重建）；EVALSHA 未命中时自动回退 EVAL
+            client=get_redis(),
+        )
+        return bool(int(reserved)), max(0.0, int(wait_us) / 1_000_000)
+
+    def acquire(self, user_id: Optional[int] = None, weight: float = None) -> float:
+        """阻塞直到获得调用时隙，返回实际等待秒数。
+        等待超过 OCR_RATE_MAX_WAIT 时不预约并抛出 OCRRateLimitExceeded，由调用方延后重试。
+        """
+        try:
+            reserved, wait = self.reserve(user_id, weight)
+        except redis.RedisError as e:
+            logger.debug(f"Redis限流不可用，回退到进程内限流: {e}")
+            return self._acquire_local()
+
+        if not reserved:
+            raise OCRRateLimitExceeded(wait)
+        if wait > 0:
+            logger.debug(f"OCR限流：等待 {wait:.3f} 秒 (user={user_id})")
+            time.sleep(wait)
+        return wait
+
+    def _acquire_local(self) -> float:
+        """进程内滑动窗口限流（仅在 Redis 不可用时使用）"""
+        limit = max(1, int(self.rate))
+        waited = 0.0
+        with self._local_lock:
+            now = time.monotonic()
+            while self._local_calls and (now - self._local_calls[0]) > 1.0:
+                self._local_calls.popleft()
+            if len(self._local_calls) >= limit:
+                waited = 1.0 - (now - self._local_calls[0]) + 0.01
+                if waited > 0:
+                    time.sleep(waited)
+                now = time.monotonic()
+                while self._local_calls and (now - self._local_calls[0]) > 1.0:
+                    self._local_calls.popleft()
+            self._local_calls.append(time.monotonic())
+        return max(0.0, waited)
+
+
+_limiter: Optional[OCRRateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_ocr_rate_limiter() -> OCRRateLimiter:
+    """获取进程级共享限流器"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = OCRRateLimiter()
+    return _limiter
@@ -1,22 +1,28 @@
 import requests
 import json
-import base64
 import traceback
 import os
-import time
-from collections import deque
 from typing import Dict, Any, Optional
 from datetime import datetime
 from app.core.config import settings, get_absolute_file_path
-import redis
 from app.core.metrics import OCR_REQUESTS_TOTAL, OCR_DURATION_SECONDS
 from app.services.logging_service import logging_service
 from sqlalchemy.orm import Session
-from app.models.ocr_cache import OCRCache
+from app.services.ocr_cache_service import get_ocr_result_cache
+from app.services.ocr_engines import get_local_ocr_engine
+from app.services.ocr_client import (
+    get_ocr_client,
+    build_form_file_body,
+    compute_file_sha256,
+    TOKEN_INVALID_ERROR_CODES,
+)
+from app.services.ocr_rate_limiter import get_ocr_rate_limiter, OCRRateLimitExceeded
 import logging
 
 logger = logging.getLogger(__name__)
 
+VAT_INVOICE_PATH = "/rest/2.0/ocr/v1/vat_invoice"
+
 
 class OCRService:
     """百度OCR服务类"""
@@ -24,114 +30,68 @@ class OCRService:
     def __init__(self, db: Session = None):
         self.api_key = settings.BAIDU_OCR_API_KEY
         self.secret_key = settings.BAIDU_OCR_SECRET_KEY
+        # 进程级共享客户端：令牌缓存 + keep-alive 连接池，跨任务复用
+        self.client = get_ocr_client()
         self.access_token = None
         self.db = db
-        # 进程内QPS限流（2次/秒，OCR配额QPS=2）
-        self._qps_recent_calls = deque()
+        # 分布式令牌桶限流（按用户权重公平分配 OCR_QPS_LIMIT）
+        self.rate_limiter = get_ocr_rate_limiter()
+        # 按 sha256 的分层结果缓存，进程内共享
+        self.result_cache = get_ocr_result_cache()
+        # 本地文本层引擎（OCR_ENGINE=baidu 时为 None）
+        self.local_engine = get_local_ocr_engine()
     
-    def _wait_for_qps_limit(self):
-        """进程内限流：确保QPS不超过2（每秒最多2次）。"""
-        now = time.monotonic()
-        # 清理1秒窗口之外的时间戳
-        while self._qps_recent_calls and (now - self._qps_recent_calls[0]) > 1.0:
-            self._qps_recent_calls.popleft()
-
-        if len(self._qps_recent_calls) >= 2:
-            # 需要等待到最早一次调用超过1秒
-            wait_seconds = 1.0 - (now - self._qps_recent_calls[0]) + 0.01
-            if wait_seconds > 0:
-                logger.debug(f"OCR QPS限制：等待 {wait_seconds:.2f} 秒")
-                time.sleep(wait_seconds)
-            # 再次清理并记录
-            now = time.monotonic()
-            while self._qps_recent_calls and (now - self._qps_recent_calls[0]) > 1.0:
-                self._qps_recent_calls.popleft()
-
-        self._qps_recent_calls.append(time.monotonic())
-
-    def _acquire_distributed_qps_token(self, limit_per_sec: int = None) -> None:
-        """分布式全局1秒窗口限流，基于Redis计数。
-        超过限制时，短暂sleep并重试，带抖动以减少惊群。
-        """
+    def get_access_token(self) -> Optional[str]:
+        """获取百度OCR访问令牌（优先复用共享客户端缓存的令牌）"""
+        self.access_token = self.client.get_access_token()
+        return self.access_token
+    
+    @staticmethod
+    def _is_token_invalid(result: Dict[str, Any]) -> bool:
         try:
-            limit = limit_per_sec or settings.OCR_QPS_LIMIT or 2
-            if limit <= 0:
-                return
-            r = redis.from_url(settings.REDIS_URL)
-            epoch = int(time.time())
-            key = f"rate:ocr:baidu:{epoch}"
-            pipe = r.pipeline()
-            pipe.incr(key, 1)
-            pipe.expire(key, 2)
-            cnt, _ = pipe.execute()
-            if cnt and int(cnt) > int(limit):
-                # 计算需要等待到下一秒的时间，加 10-60ms 抖动
-                now = time.time()
-                wait = (epoch + 1) - now
-                if wait < 0:
-                    wait = 0.05
-                jitter = 0.01 + (now % 0.05)  # 10-60ms 之间
-                time.sleep(max(0.0, wait + jitter))
-        except Exception:
-            # Redis 不可用时，回退到仅进程内限流
-            return
+            return int(result.get("error_code", 0)) in TOKEN_INVALID_ERROR_CODES
+        except (TypeError, ValueError):
+            return False
     
-    def get_access_token(self) -> Optional[str]:
-        """获取百度OCR访问令牌"""
-        if not self.api_key or not self.secret_key:
-            error_msg = f"百度OCR API密钥未配置 - API_KEY: {'已设置' if self.api_key else '未设置'}, SECRET_KEY: {'已设置' if self.secret_key else '未设置'}"
-            logger.error(error_msg)
+    def _lookup_stored_sha256(self, invoice_id: Optional[str]) -> Optional[str]:
+        """读取发票入库时记录的文件 sha256（仅查询单列）"""
+        if not (self.db and invoice_id):
             return None
-        
-        url = "https://aip.baidubce.com/oauth/2.0/token"
-        params = {
-            "grant_type": "client_credentials",
-            "client_id": self.api_key,
-            "client_secret": self.secret_key
-        }
-        
         try:
-            response = requests.get(url, params=params, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-            
-            if "access_token" in result:
-                self.access_token = result["access_token"]
-                return self.access_token
-            else:
-                logger.error(f"获取访问令牌失败: {result}")
-                return None
-                
-        except Exception as e:
-            logger.error(f"获取百度OCR访问令牌异常: {str(e)}")
+            from app.models.invoice import Invoice
+            row = self.db.query(Invoice.file_sha256_hash).filter(Invoice.id == invoice_id).first()
+            return row.file_sha256_hash if row else None
+        except Exception:
             return None
     
-    def recognize_invoice(self, file_path: str, user_id: int = None, invoice_id: str = None) -> Dict[str, Any]:
-        """识别PDF格式的增值税发票"""
+    def _get_cached_result(self, file_sha256: Optional[str], started: datetime) -> Optional[Dict[str, Any]]:
+        """OCR 结果复用：进程内 LRU -> Redis -> 数据库（ocr_payloads，未迁移的旧数据查 invoices / ocr_cache）"""
+        if not file_sha256:
+            return None
+        cached, tier = self.result_cache.get(self.db, file_sha256)
+        if cached is None:
+            return None
+        label = "reused_invoice" if tier == "invoice" else "cache_hit"
+        OCR_REQUESTS_TOTAL.labels(result=label).inc()
+        OCR_DURATION_SECONDS.labels(result=label).observe((datetime.now() - started).total_seconds())
+        return cached
+
+    def recognize_invoice(
+        self,
+        file_path: str,
+        user_id: int = None,
+        invoice_id: str = None,
+        file_sha256: Optional[str] = None,
+        skip_local: bool = False,
+    ) -> Dict[str, Any]:
+        """识别PDF格式的增值税发票
+        file_sha256 为入库时已记录的文件哈希；缓存命中时无需读取文件。
+        skip_local 用于调用方已批量尝试过本地解析的场景。
+        """
         ocr_start_time = datetime.now()
         
         # 先不记录开始日志（降噪），接下来将尝试OCR缓存
         
-        if not self.access_token:
-            if not self.get_access_token():
-                error_result = {"error_code": -1, "error_msg": "无法获取访问令牌"}
-                
-                if self.db and user_id:
-                    logging_service.log_ocr_event(
-                        db=self.db,
-                        event_type="ocr_failed",
-                        message="OCR识别失败: 无法获取百度API访问令牌",
-                        user_id=user_id,
-                        invoice_id=invoice_id,
-                        details={
-                            "error": "access_token_failed",
-                            "file_path": file_path
-                        },
-                        log_level="ERROR"
-                    )
-                
-                return error_result
-        
         try:
             # 确保路径转换为当前环境的绝对路径
             if not os.path.isabs(file_path):
@@ -143,6 +103,14 @@ class OCRService:
                 logger.debug(f"接收到绝对路径: {file_path}")
             logger.debug(f"最终OCR文件路径: {file_path}")
             logger.debug(f"当前环境UPLOAD_DIR: {os.getenv('UPLOAD_DIR', 'not set')}")
+
+            # 先按入库时记录的 sha256 查找结果缓存；命中时不访问文件（文件被移动或删除也能返回已识别结果）
+            if not file_sha256:
+                file_sha256 = self._lookup_stored_sha256(invoice_id)
+            cached = self._get_cached_result(file_sha256, ocr_start_time)
+            if cached is not None:
+                return cached
+
             # 检查文件是否存在
             if not os.path.exists(file_path):
                 error_msg = f"OCR文件不存在: {file_path}"
@@ -166,84 +134,78 @@ class OCRService:
                 
                 return error_result
             
-            # 读取PDF文件并转换为base64，同时计算哈希（供OCR缓存）
-            # 如果传入相对路径，转换为绝对路径
-            file_path_to_read = file_path
-            try:
-                import os as _os
-                if not _os.path.isabs(file_path_to_read):
-                    file_path_to_read = get_absolute_file_path(file_path_to_read)
-            except Exception:
-                pass
-            with open(file_path_to_read, "rb") as f:
-                file_data = f.read()
-            try:
-                import hashlib as _hashlib
-                file_sha256 = _hashlib.sha256(file_data).hexdigest()
-            except Exception:
-                file_sha256 = None
-            
-            file_size = len(file_data)
-            file_base64 = base64.b64encode(file_data).decode('utf-8')
-            
-
-            # OCR 结果复用优先级：1) invoices 表中已有同 sha256 的成功结果 2) OCR 缓存表
-            if self.db and file_sha256:
+            # 没有记录哈希时流式计算（不整体读入内存），再查一次缓存
+            if not file_sha256:
                 try:
-                    from app.models.invoice import Invoice
-                    existing_invoice = (
-                        self.db.query(Invoice)
-                        .filter(Invoice.file_sha256_hash == file_sha256, Invoice.ocr_status == 'success')
-                        .first()
-                    )
-                    if existing_invoice and isinstance(existing_invoice.ocr_raw_data, dict):
-                        OCR_REQUESTS_TOTAL.labels(result="reused_invoice").inc()
-                        OCR_DURATION_SECONDS.labels(result="reused_invoice").observe((datetime.now() - ocr_start_time).total_seconds())
-                        return existing_invoice.ocr_raw_data
-                except Exception:
-                    pass
-                try:
-                    cache = self.db.query(OCRCache).filter(OCRCache.sha256 == file_sha256).first()
-                    if cache and cache.status == 'success' and cache.ocr_json:
-                        OCR_REQUESTS_TOTAL.labels(result="cache_hit").inc()
-                        OCR_DURATION_SECONDS.labels(result="cache_hit").observe((datetime.now() - ocr_start_time).total_seconds())
-                        return cache.ocr_json
-                except Exception:
-                    pass
+                    file_sha256 = compute_file_sha256(file_path)
+                except OSError:
+                    file_sha256 = None
+                cached = self._get_cached_result(file_sha256, ocr_start_time)
+                if cached is not None:
+                    return cached
+            file_size = os.path.getsize(file_path)
 
-            # 调用百度OCR增值税发票识别API
-            url = "https://aip.baidubce.com/rest/2.0/ocr/v1/vat_invoice"
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded"
-            }
-            params = {
-                "access_token": self.access_token
-            }
-            
-            # 处理PDF文件参数
-            data = {
-                "pdf_file": file_base64
-            }
+            # 本地文本层解析：电子发票多带文本层，必需字段齐全时无需占用远程接口配额
+            if self.local_engine is not None and not skip_local:
+                local_result = self.local_engine.recognize(file_path)
+                if local_result is not None:
+                    # 本地结果不写入共享结果缓存，之后重新识别仍可走远程接口
+                    OCR_REQUESTS_TOTAL.labels(result="local").inc()
+                    OCR_DURATION_SECONDS.labels(result="local").observe((datetime.now() - ocr_start_time).total_seconds())
+                    return local_result
+            if settings.OCR_ENGINE == "local":
+                OCR_REQUESTS_TOTAL.labels(result="failed").inc()
+                return {"error_code": -7, "error_msg": "本地解析未能提取发票必需字段"}
+
+            # 缓存未命中才需要访问令牌与文件内容
+            if not self.access_token:
+                if not self.get_access_token():
+                    error_result = {"error_code": -1, "error_msg": "无法获取访问令牌"}
+                    
+                    if self.db and user_id:
+                        logging_service.log_ocr_event(
+                            db=self.db,
+                            event_type="ocr_failed",
+                            message="OCR识别失败: 无法获取百度API访问令牌",
+                            user_id=user_id,
+                            invoice_id=invoice_id,
+                            details={
+                                "error": "access_token_failed",
+                                "file_path": file_path
+                            },
+                            log_level="ERROR"
+                        )
+                    
+                    return error_result
             
-            # QPS限制：分布式全局 + 本地双限流
-            self._acquire_distributed_qps_token(settings.OCR_QPS_LIMIT)
-            self._wait_for_qps_limit()
+            # QPS限制：Redis 令牌桶原子预约时隙，精确等待（先于构建请求体，限流异常时不遗留临时文件）
+            self.rate_limiter.acquire(user_id)
             
+            # 流式 base64 + 表单编码写入临时文件，避免原始字节与编码副本同时驻留内存
+            body = build_form_file_body("pdf_file", file_path)
             api_call_time = datetime.now()
-            response = requests.post(
-                url, 
-                headers=headers, 
-                params=params, 
-                data=data,
-                timeout=settings.OCR_TIMEOUT
-            )
-            response.raise_for_status()
+            try:
+                response = self.client.post(VAT_INVOICE_PATH, data=body)
+                response.raise_for_status()
+                result = response.json()
+                
+                # 缓存的令牌被服务端判定失效：清除缓存后重试一次
+                if self._is_token_invalid(result):
+                    logger.warning("OCR访问令牌已失效，刷新后重试")
+                    self.client.invalidate_token()
+                    self.get_access_token()
+                    body.rewind()
+                    # 重试同样是一次服务商调用，需占用令牌桶时隙
+                    self.rate_limiter.acquire(user_id)
+                    response = self.client.post(VAT_INVOICE_PATH, data=body)
+                    response.raise_for_status()
+                    result = response.json()
+            finally:
+                body.close()
             
             api_response_time = datetime.now()
             response_time = (api_response_time - api_call_time).total_seconds()
             
-            result = response.json()
-            
             # 检查OCR响应
             if "error_code" in result:
                 error_msg = f"OCR API错误: {result.get('error_msg', 'Unknown error')}"
@@ -336,24 +298,13 @@ class OCRService:
                         "total_duration": total_duration,
                         "recognized_fields": recognized_fields,
                         "fields_count": len(recognized_fields),
-                        "api_response": result
+                        # 完整返回随结果缓存写入 ocr_payloads，日志只引用 sha256
+                        **({"ocr_payload_sha256": file_sha256} if file_sha256 else {"api_response": result})
                     }
                 )
-            # 写入 OCR 缓存
-            if self.db and file_sha256 and isinstance(result, dict):
-                try:
-                    cache = self.db.query(OCRCache).filter(OCRCache.sha256 == file_sha256).first()
-                    if cache:
-                        cache.status = 'success'
-                        cache.ocr_json = result
-                        cache.updated_at = datetime.now()
-                    else:
-                        cache = OCRCache(sha256=file_sha256, status='success', ocr_json=result)
-                        self.db.add(cache)
-                    self.db.commit()
-                except Exception:
-                    self.db.rollback()
-                    pass
+            # 写穿 OCR 结果缓存（数据库 + Redis + 进程内）
+            if file_sha256:
+                self.result_cache.put(self.db, file_sha256, result)
             try:
                 OCR_REQUESTS_TOTAL.labels(result="success").inc()
                 OCR_DURATION_SECONDS.labels(result="success").observe(total_duration)
@@ -362,6 +313,11 @@ class OCRService:
 
             return result
             
+        except OCRRateLimitExceeded as e:
+            # 排队过长：不占用时隙，交由任务层按 retry_after 延后重试
+            logger.info(f"OCR限流排队过长，{e.retry_after:.1f}s 后重试: {invoice_id}")
+            return {"error_code": 18, "error_msg": str(e), "retry_after": e.retry_after}
+            
         except requests.exceptions.Timeout:
             error_msg = f"OCR请求超时: {file_path}"
             logger.error(error_msg)
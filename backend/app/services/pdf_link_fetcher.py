@@ -0,0 +1,198 @@
+"""
+邮件正文 PDF 链接下载器
+后台线程运行 asyncio 事件循环，复用 httpx.AsyncClient 连接池并发下载，按主机限制并发数；
+响应流式写入内容寻址存储并同时计算哈希，首字节不是 %PDF 或 Content-Length 超过 MAX_FILE_SIZE 时立即中止。
+已知指纹且带 ETag/Last-Modified 的链接发起条件请求，304 时复用已落盘的文件。
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Any, Dict, Optional
+from urllib.parse import unquote, urlparse
+
+import httpx
+
+from app.core.config import settings, get_absolute_file_path
+from app.services.pdf_storage import PDFSpool, SPOOL_CHUNK_SIZE, reuse_stored_file
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+
+def filename_from_response(url: str, headers) -> str:
+    """从响应头或URL中提取文件名"""
+    # 尝试从Content-Disposition头获取
+    content_disposition = headers.get('content-disposition', '')
+    if content_disposition:
+        filename_match = re.search(r'filename[*]?=([^;]+)', content_disposition)
+        if filename_match:
+            filename = filename_match.group(1).strip().strip('"')
+            if "''" in filename:
+                # RFC 5987: filename*=UTF-8''%E5%8F%91%E7%A5%A8.pdf
+                charset, _, filename = filename.partition("''")
+                try:
+                    filename = unquote(filename, encoding=charset or 'utf-8')
+                except LookupError:
+                    filename = unquote(filename)
+            return filename
+
+    # 从URL路径获取
+    path = urlparse(url).path
+    if path:
+        filename = os.path.basename(path)
+        if filename and '.' in filename:
+            return filename
+
+    # 默认文件名
+    return f"download_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+
+
+class PDFLinkFetcher:
+    """异步 PDF 链接下载器：submit 返回 concurrent.futures.Future，调用方线程不阻塞"""
+
+    def __init__(self, per_host: int = None, max_connections: int = None,
+                 timeout: float = None, total_timeout: float = None, max_size: int = None):
+        self.per_host = max(1, per_host or settings.EMAIL_LINK_PER_HOST_CONCURRENCY)
+        self.max_connections = max(1, max_connections or settings.EMAIL_LINK_MAX_CONNECTIONS)
+        self.timeout = float(timeout or settings.EMAIL_LINK_TIMEOUT)
+        self.total_timeout = float(total_timeout or settings.EMAIL_LINK_TOTAL_TIMEOUT)
+        self.max_size = max_size or settings.MAX_FILE_SIZE
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_pid: Optional[int] = None
+        # 以下对象只在事件循环线程内访问
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        # fork 后在子进程内重建事件循环线程
+        pid = os.getpid()
+        with self._lock:
+            if self._loop is None or self._loop_pid != pid:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="pdf-link-fetcher", daemon=True).start()
+                self._loop, self._loop_pid = loop, pid
+                self._client = None
+                self._host_limits = {}
+            return self._loop
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={'User-Agent': USER_AGENT},
+                follow_redirects=True,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+        return self._client
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = (urlparse(url).hostname or '').lower()
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return limit
+
+    def submit(self, user_id: int, url: str, fingerprint: Optional[Dict[str, Any]] = None) -> Future:
+        """提交下载任务，Future 结果为落盘信息字典（非 PDF、超限或失败时为 None）。
+        fingerprint 为该链接已知的指纹，用于条件请求。
+        """
+        return asyncio.run_coroutine_threadsafe(self._download(user_id, url, fingerprint), self._get_loop())
+
+    async def _download(self, user_id: int, url: str, fingerprint: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        try:
+            async with self._host_limit(url):
+                return await asyncio.wait_for(
+                    self._stream_to_storage(user_id, url, fingerprint), self.total_timeout
+                )
+        except Exception as e:
+            logger.error(f"下载PDF失败: {url}, 错误: {str(e)}")
+            return None
+
+    @staticmethod
+    def _conditional_headers(fingerprint: Optional[Dict[str, Any]]):
+        """已知指纹的文件仍在存储中时返回 (条件请求头, 文件绝对路径)，否则 ({}, None)"""
+        if not fingerprint or not fingerprint.get('stored_path') or not fingerprint.get('sha256'):
+            return {}, None
+        headers = {}
+        if fingerprint.get('etag'):
+            headers['If-None-Match'] = fingerprint['etag']
+        if fingerprint.get('last_modified'):
+            headers['If-Modified-Since'] = fingerprint['last_modified']
+        source_path = get_absolute_file_path(fingerprint['stored_path'])
+        if not headers or not os.path.exists(source_path):
+            return {}, None
+        return headers, source_path
+
+    async def _stream_to_storage(self, user_id: int, url: str,
+                                 fingerprint: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        headers, source_path = self._conditional_headers(fingerprint)
+        async with self._get_client().stream('GET', url, headers=headers) as response:
+            if response.status_code == 304 and source_path:
+                stored = await asyncio.to_thread(reuse_stored_file, user_id, source_path, fingerprint)
+                stored.update(
+                    filename=fingerprint.get('filename') or filename_from_response(url, response.headers),
+                    url=url,
+                    etag=response.headers.get('etag') or fingerprint.get('etag'),
+                    last_modified=response.headers.get('last-modified') or fingerprint.get('last_modified'),
+                    not_modified=True,
+                )
+                return stored
+            response.raise_for_status()
+
+            # 检查内容类型
+            content_type = response.headers.get('content-type', '').lower()
+            is_pdf_ct = ('pdf' in content_type) or ('application/octet-stream' in content_type)
+            if (not is_pdf_ct) and (not url.lower().endswith('.pdf')):
+                return None
+
+            content_length = response.headers.get('content-length', '')
+            if content_length.isdigit() and int(content_length) > self.max_size:
+                logger.info(f"PDF链接超过大小限制，跳过下载: {url}, {content_length} bytes")
+                return None
+
+            # 临时文件的创建、写入、重命名与删除都是阻塞的文件操作，放到线程池执行，不占用事件循环
+            spool = await asyncio.to_thread(PDFSpool, user_id)
+            try:
+                async for chunk in response.aiter_bytes(SPOOL_CHUNK_SIZE):
+                    # 首字节不是 %PDF 或实际大小超限时立即中止，不再读取剩余响应
+                    if not await asyncio.to_thread(spool.write, chunk) or spool.size > self.max_size:
+                        await asyncio.to_thread(spool.abort)
+                        return None
+                stored = await asyncio.to_thread(spool.finish)
+            except BaseException:
+                # 任务可能已被取消，此处不能再 await，直接同步清理临时文件
+                spool.abort()
+                raise
+
+        if stored:
+            stored.update(
+                filename=filename_from_response(url, response.headers),
+                url=url,
+                etag=response.headers.get('etag'),
+                last_modified=response.headers.get('last-modified'),
+                not_modified=False,
+            )
+        return stored
+
+
+_fetcher: Optional[PDFLinkFetcher] = None
+_fetcher_lock = threading.Lock()
+
+
+def get_pdf_link_fetcher() -> PDFLinkFetcher:
+    """获取进程级共享PDF链接下载器"""
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = PDFLinkFetcher()
+    return _fetcher
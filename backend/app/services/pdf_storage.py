@@ -0,0 +1,132 @@
+"""
+PDF 内容寻址存储
+数据流边写入 storage/invoices/<user>/ 下的临时文件边计算 md5/sha256，完成后按 sha256 重命名；
+邮件附件与正文链接下载共用，单个文件的内存占用只与写入块大小有关。
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, Iterable, Optional
+
+from app.core.config import get_absolute_file_path
+
+# 每次解码/写入的块大小
+SPOOL_CHUNK_SIZE = 64 * 1024
+
+
+class PDFSpool:
+    """流式写入 PDF：首 4 字节必须是 %PDF，finish 后得到内容寻址文件"""
+
+    def __init__(self, user_id: int):
+        self.relative_dir = os.path.join("storage", "invoices", str(user_id))
+        self.upload_dir = get_absolute_file_path(self.relative_dir)
+        os.makedirs(self.upload_dir, exist_ok=True)
+        self.size = 0
+        self._head = b''
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=self.upload_dir, prefix='.spool-', suffix='.part', delete=False)
+
+    def write(self, chunk: bytes) -> bool:
+        """写入一块数据；内容不是 PDF 时返回 False（调用方应 abort）"""
+        if not chunk:
+            return True
+        if len(self._head) < 4:
+            self._head += chunk[:4 - len(self._head)]
+            if len(self._head) == 4 and self._head != b'%PDF':
+                return False
+        self._md5.update(chunk)
+        self._sha256.update(chunk)
+        self._file.write(chunk)
+        self.size += len(chunk)
+        return True
+
+    def abort(self) -> None:
+        """丢弃临时文件"""
+        try:
+            self._file.close()
+        except Exception:
+            pass
+        try:
+            os.unlink(self._file.name)
+        except OSError:
+            pass
+
+    def finish(self) -> Optional[Dict[str, Any]]:
+        """按 sha256 重命名为内容寻址文件（已存在则丢弃临时文件）；内容不是 PDF 时返回 None"""
+        self._file.close()
+        if self._head != b'%PDF':
+            self.abort()
+            return None
+
+        file_sha256_hash = self._sha256.hexdigest()
+        filename = f"{file_sha256_hash}.pdf"
+        final_path = os.path.join(self.upload_dir, filename)
+        created = not os.path.exists(final_path)
+        if created:
+            os.replace(self._file.name, final_path)
+        else:
+            os.unlink(self._file.name)
+        return {
+            'file_path': final_path,
+            'relative_path': os.path.join(self.relative_dir, filename),
+            'file_size': self.size,
+            'file_md5_hash': self._md5.hexdigest(),
+            'file_sha256_hash': file_sha256_hash,
+            'created': created,
+        }
+
+
+def store_pdf_stream(user_id: int, chunks: Iterable[bytes]) -> Optional[Dict[str, Any]]:
+    """将解码后的 PDF 数据流写入内容寻址存储；内容不是 PDF 时返回 None"""
+    spool = PDFSpool(user_id)
+    try:
+        for chunk in chunks:
+            if not spool.write(chunk):
+                spool.abort()
+                return None
+        return spool.finish()
+    except Exception:
+        spool.abort()
+        raise
+
+
+def reuse_stored_file(user_id: int, source_path: str, fingerprint: Dict[str, Any]) -> Dict[str, Any]:
+    """复用已落盘的同内容文件（如链接条件请求返回 304）：不在当前用户目录时复制一份"""
+    relative_dir = os.path.join("storage", "invoices", str(user_id))
+    upload_dir = get_absolute_file_path(relative_dir)
+    os.makedirs(upload_dir, exist_ok=True)
+    filename = f"{fingerprint['sha256']}.pdf"
+    final_path = os.path.join(upload_dir, filename)
+    created = not os.path.exists(final_path)
+    if created:
+        spool = tempfile.NamedTemporaryFile(dir=upload_dir, prefix='.spool-', suffix='.part', delete=False)
+        spool.close()
+        try:
+            shutil.copyfile(source_path, spool.name)
+            os.replace(spool.name, final_path)
+        except Exception:
+            try:
+                os.unlink(spool.name)
+            except OSError:
+                pass
+            raise
+    return {
+        'file_path': final_path,
+        'relative_path': os.path.join(relative_dir, filename),
+        'file_size': fingerprint.get('file_size') or os.path.getsize(final_path),
+        'file_md5_hash': fingerprint.get('file_md5_hash'),
+        'file_sha256_hash': fingerprint['sha256'],
+        'created': created,
+    }
+
+
+def discard_stored_files(stored_files: Iterable[Dict[str, Any]]) -> None:
+    """删除本次新落盘但不再需要的文件（已存在的内容寻址文件可能被其他发票引用，保留）"""
+    for stored in stored_files:
+        if stored.get('created'):
+            try:
+                os.unlink(stored['file_path'])
+            except OSError:
+                pass
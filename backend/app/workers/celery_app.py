@@ -26,10 +26,10 @@ celery_app.conf.update(
     #     "app.workers.email_tasks.*": {"queue": "email"},
     # },
     beat_schedule={
-        # 每30分钟扫描一次邮箱
-        "scan-emails-every-30-minutes": {
+        # 定时扫描邮箱（默认每30分钟；启用 IDLE 监听后作为兜底）
+        "scan-emails-periodic": {
             "task": "app.workers.email_tasks.scan_emails_task",
-            "schedule": 30.0 * 60,
+            "schedule": settings.EMAIL_SCAN_INTERVAL,
         },
         # 监控类周期任务
         "collect-system-metrics-every-5-minutes": {
@@ -48,5 +48,12 @@ celery_app.conf.update(
     },
 )
 
+# 批量OCR模式：周期性调度批处理任务
+if settings.OCR_BATCH_MODE:
+    celery_app.conf.beat_schedule["process-pending-ocr-batch"] = {
+        "task": "app.workers.ocr_tasks.process_pending_ocr_batch",
+        "schedule": settings.OCR_BATCH_INTERVAL,
+    }
+
 # 自动发现任务
 celery_app.autodiscover_tasks(['app.workers'])
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""
+IMAP IDLE 推送监听
+每个启用的邮箱配置保持一条 IDLE 长连接，收到 EXISTS 通知后投递该配置的扫描任务（沿用 last_seen_uid 只抓新 UID），
+断线按指数退避重连；定时扫描（EMAIL_SCAN_INTERVAL）退为兜底。
+IDLE 只能监听一个已选中的文件夹，这里只监听 INBOX；触发的扫描仍会扫描配置的全部文件夹（EMAIL_SCAN_FOLDERS / scan_folders），
+但 INBOX 以外文件夹（如服务端规则投递的文件夹）收到新邮件不会触发，只能等下一次定时扫描。
+
+运行：python -m app.workers.email_idle
+"""
+import logging
+import random
+import signal
+import ssl
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from imapclient import IMAPClient
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.email_config import EmailConfig
+from app.services.email_service import EmailService
+
+logger = logging.getLogger(__name__)
+
+# 单次 idle_check 的最长阻塞时间，用于及时响应停止信号与防抖
+IDLE_CHECK_SLICE = 30
+
+
+def _config_signature(config: EmailConfig) -> Tuple:
+    """连接相关字段，变化时需要重建连接"""
+    return (config.imap_server, config.imap_port, config.username, config.password_encrypted)
+
+
+def _enqueue_scan(config_id: int, days: int) -> None:
+    # 延迟导入，避免监听进程启动时加载全部 Celery 任务模块
+    from app.workers.email_tasks import scan_emails_task
+    scan_emails_task.delay(config_id=config_id, days=days)
+
+
+class MailboxIdleListener(threading.Thread):
+    """单个邮箱配置的 IDLE 监听线程"""
+
+    def __init__(self, config: EmailConfig, password: str, enqueue=_enqueue_scan, client_factory=None):
+        super().__init__(name=f"email-idle-{config.id}", daemon=True)
+        self.config_id = config.id
+        self.email_address = config.email_address
+        self.host = config.imap_server
+        self.port = config.imap_port or 993
+        self.username = config.username
+        self.scan_days = config.scan_days or 7
+        self.signature = _config_signature(config)
+        self._password = password
+        self._enqueue = enqueue
+        self._client_factory = client_factory or self._connect
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _connect(self) -> IMAPClient:
+        # 与扫描使用的 imaplib.IMAP4_SSL 默认行为一致：不校验证书（兼容自签名的自建/测试服务器）
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        return IMAPClient(self.host, port=self.port, ssl=True, ssl_context=context,
+                          timeout=settings.EMAIL_IDLE_SOCKET_TIMEOUT)
+
+    def run(self) -> None:
+        backoff = 1.0
+        connected_before = False
+        while not self._stop_event.is_set():
+            client = None
+            try:
+                client = self._client_factory()
+                client.login(self.username, self._password)
+                if not client.has_capability('IDLE'):
+                    # 不支持 IDLE 的服务器仅依赖定时扫描
+                    logger.warning(f"邮箱服务器不支持 IDLE，停止监听: {self.email_address}")
+                    return
+                # 只监听 INBOX；其他文件夹的新邮件依赖定时扫描
+                exists = client.select_folder('INBOX', readonly=True).get(b'EXISTS', 0)
+                logger.info(f"IDLE 监听已连接: {self.email_address}")
+                if connected_before:
+                    # 断线期间可能有新邮件，重连后补扫一次
+                    self._trigger("reconnected")
+                connected_before = True
+                backoff = 1.0
+                self._idle_loop(client, exists)
+            except Exception as e:
+                if self._stop_event.is_set():
+                    break
+                delay = min(backoff, settings.EMAIL_IDLE_RECONNECT_MAX)
+                logger.warning(f"IDLE 连接中断: {self.email_address}, {delay:.0f}秒后重连, 错误: {e}")
+                # 加随机抖动，避免服务器恢复时所有连接同时重连
+                self._stop_event.wait(delay * random.uniform(0.5, 1.0))
+                backoff = min(backoff * 2, settings.EMAIL_IDLE_RECONNECT_MAX)
+            finally:
+                if client is not None:
+                    try:
+                        client.logout()
+                    except Exception:
+                        pass
+
+    def _idle_loop(self, client: IMAPClient, exists: int) -> None:
+        """保持 IDLE，收到新邮件通知后防抖投递扫描；按 EMAIL_IDLE_RENEW 周期重新发起 IDLE（RFC 2177 建议不超过 29 分钟）"""
+        pending_since: Optional[float] = None
+        while not self._stop_event.is_set():
+            client.idle()
+            renew_at = time.monotonic() + settings.EMAIL_IDLE_RENEW
+            try:
+                while not self._stop_event.is_set() and time.monotonic() < renew_at:
+                    timeout = IDLE_CHECK_SLICE
+                    if pending_since is not None:
+                        timeout = max(0.0, pending_since + settings.EMAIL_IDLE_DEBOUNCE - time.monotonic())
+                    started = time.monotonic()
+                    responses = client.idle_check(timeout=timeout)
+                    for response in responses:
+                        if len(response) >= 2 and response[1] == b'EXISTS' and isinstance(response[0], int):
+                            if response[0] > exists and pending_since is None:
+                                pending_since = time.monotonic()
+                            exists = response[0]
+                        elif len(response) >= 2 and response[1] == b'EXPUNGE':
+                            exists = max(0, exists - 1)
+                    if pending_since is not None and time.monotonic() - pending_since >= settings.EMAIL_IDLE_DEBOUNCE:
+                        # 防抖窗口内的多封新邮件合并为一次扫描
+                        self._trigger("exists")
+                        pending_since = None
+                    if not responses and timeout > 1 and time.monotonic() - started < 1:
+                        # 套接字可读却没有响应多为对端已关闭，结束 IDLE 以暴露断线
+                        break
+            finally:
+                client.idle_done()
+
+    def _trigger(self, reason: str) -> None:
+        try:
+            self._enqueue(self.config_id, self.scan_days)
+            logger.info(f"IDLE 触发邮箱扫描: {self.email_address}, 原因: {reason}")
+        except Exception as e:
+            logger.error(f"投递邮箱扫描任务失败: {self.email_address}, 错误: {e}")
+
+
+class EmailIdleSupervisor:
+    """按启用的邮箱配置维护监听线程：新增配置启动监听，停用/删除或连接信息变化时停止或重建"""
+
+    def __init__(self, enqueue=_enqueue_scan):
+        self._enqueue = enqueue
+        self._listeners: Dict[int, MailboxIdleListener] = {}
+        self._stop_event = threading.Event()
+
+    def stop(self, *_args) -> None:
+        self._stop_event.set()
+
+    def reconcile(self) -> None:
+        db = SessionLocal()
+        try:
+            configs = db.query(EmailConfig).filter(EmailConfig.is_active == True).all()
+            email_service = EmailService(db)
+            active_ids = set()
+            for config in configs:
+                active_ids.add(config.id)
+                listener = self._listeners.get(config.id)
+                if listener is not None and listener.is_alive() and listener.signature == _config_signature(config):
+                    continue
+                if listener is not None:
+                    listener.stop()
+                try:
+                    password = email_service.decrypt_password(config.password_encrypted)
+                except Exception as e:
+                    logger.error(f"解密邮箱密码失败，跳过 IDLE 监听: {config.email_address}, 错误: {e}")
+                    self._listeners.pop(config.id, None)
+                    continue
+                listener = MailboxIdleListener(config, password, enqueue=self._enqueue)
+                self._listeners[config.id] = listener
+                listener.start()
+            for config_id in list(self._listeners):
+                if config_id not in active_ids:
+                    self._listeners.pop(config_id).stop()
+        finally:
+            db.close()
+
+    def run(self) -> None:
+        logger.info("IMAP IDLE 监听服务启动")
+        while not self._stop_event.is_set():
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.error(f"刷新 IDLE 监听配置失败: {e}")
+            self._stop_event.wait(settings.EMAIL_IDLE_REFRESH_INTERVAL)
+        for listener in self._listeners.values():
+            listener.stop()
+        for listener in self._listeners.values():
+            listener.join(timeout=IDLE_CHECK_SLICE + 5)
+        logger.info("IMAP IDLE 监听服务已停止")
+
+
+def main() -> None:
+    from app.core.logging_config import configure_logging
+    configure_logging(settings.LOG_LEVEL)
+    supervisor = EmailIdleSupervisor()
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
-from celery import Task
+from celery import Task, chord
 from app.workers.celery_app import celery_app
 from app.core.database import SessionLocal
 from app.core.config import settings
+from app.core.redis_client import get_redis, get_redis_pipeline
 from app.services.email_service import EmailService
 from app.services.invoice_service import InvoiceService
 from app.services.email_list_service import EmailListService
@@ -9,9 +10,10 @@ from app.services.logging_service import logging_service
 from app.models.email_config import EmailConfig
 from app.models.system_log import SystemLog
 import logging
-import redis
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import List
 from app.core.metrics import FILES_PROCESSED, EMAILS_INVOICES_FOUND, EMAIL_DUPLICATES
 
 logger = logging.getLogger(__name__)
@@ -28,7 +30,7 @@ def get_email_scan_lock_key(user_id: int, config_id: int = None) -> str:
 def acquire_email_scan_lock(user_id: int, config_id: int = None, timeout: int = 3600) -> bool:
     """获取邮箱扫描锁"""
     try:
-        redis_client = redis.from_url(settings.REDIS_URL)
+        redis_client = get_redis()
         lock_key = get_email_scan_lock_key(user_id, config_id)
         
         # 设置锁，过期时间为1小时
@@ -49,10 +51,9 @@ def acquire_email_scan_lock(user_id: int, config_id: int = None, timeout: int =
 def release_email_scan_lock(user_id: int, config_id: int = None):
     """释放邮箱扫描锁"""
     try:
-        redis_client = redis.from_url(settings.REDIS_URL)
         lock_key = get_email_scan_lock_key(user_id, config_id)
         
-        redis_client.delete(lock_key)
+        get_redis().delete(lock_key)
         logger.info(f"释放邮箱扫描锁: {lock_key}")
         
     except Exception as e:
@@ -74,15 +75,11 @@ class EmailScanLockMixin:
 def is_email_scan_running(user_id: int, config_id: int = None) -> bool:
     """检查是否有正在运行的邮箱扫描任务（基于Redis锁）"""
     try:
-        redis_client = redis.from_url(settings.REDIS_URL)
-        # 优先检查指定配置锁
+        # 指定配置锁与用户全局锁一条 EXISTS 命令检查
+        keys = [get_email_scan_lock_key(user_id, None)]
         if config_id:
-            if redis_client.exists(get_email_scan_lock_key(user_id, config_id)):
-                return True
-        # 检查用户全局锁
-        if redis_client.exists(get_email_scan_lock_key(user_id, None)):
-            return True
-        return False
+            keys.append(get_email_scan_lock_key(user_id, config_id))
+        return get_redis().exists(*keys) > 0
     except Exception as e:
         logger.warning(f"检查邮箱扫描锁失败: {e}")
         return False
@@ -103,31 +100,446 @@ class DatabaseTask(Task):
             self._db.close()
 
 
-@celery_app.task(base=DatabaseTask, bind=True)
+def _scan_single_config(config_id: int, days: int, task_id: str, manual: bool = False,
+                        deadline: float = None) -> dict:
+    """扫描单个邮箱配置并将结果入库为发票
+    使用独立的数据库会话，可在线程池中与其他配置并发执行。
+    deadline 到期时扫描在块边界停止，返回 incomplete=True，由调用方投递续扫。
+    """
+    db = SessionLocal()
+    config_start_time = datetime.now()
+    config = None
+    try:
+        config = db.query(EmailConfig).filter(EmailConfig.id == config_id).first()
+        if config is None:
+            raise ValueError(f"邮箱配置不存在: {config_id}")
+
+        email_service = EmailService(db)
+        invoice_service = InvoiceService(db)
+
+        if not manual:
+            logger.info(f"开始扫描邮箱: {config.email_address}")
+            # 记录开始扫描日志
+            logging_service.log_email_event(
+                db=db,
+                event_type="scan_started",
+                message=f"开始扫描邮箱: {config.email_address}",
+                user_id=config.user_id,
+                details={"task_id": task_id, "days": days, "config_id": config.id}
+            )
+
+        # 执行邮箱扫描
+        scan_results, scan_stats = email_service.scan_emails(config, days, with_stats=True, deadline=deadline)
+
+        processed_count = len(scan_results)
+        if not manual:
+            FILES_PROCESSED.inc(processed_count)
+        success_count = 0
+        error_count = 0
+        duplicate_count = 0
+        processed_files = []
+        errors = []
+        event_prefix = "manual_" if manual else ""
+
+        # 处理扫描结果
+        for result in scan_results:
+            try:
+                # 将临时文件移动到正式位置并创建发票记录
+                # 如果上游或下游已经标记重复，计数后跳过
+                if result.get("status") == "duplicate":
+                    duplicate_count += 1
+                    if not manual:
+                        EMAIL_DUPLICATES.labels(type="attachment").inc()
+                    continue
+
+                invoice_result = _process_scanned_file(config.user_id, result, invoice_service)
+
+                if invoice_result == "DUPLICATE":
+                    duplicate_count += 1
+                    if not manual:
+                        EMAIL_DUPLICATES.labels(type="create_invoice").inc()
+                elif invoice_result:
+                    success_count += 1
+                    processed_files.append({
+                        "filename": result.get("filename"),
+                        "type": result.get("type"),
+                        "status": "success",
+                        "invoice_id": invoice_result
+                    })
+                    if not manual:
+                        EMAILS_INVOICES_FOUND.inc()
+                else:
+                    error_count += 1
+                    error_msg = f"处理文件失败: {result.get('filename')}"
+                    errors.append(error_msg)
+
+                    # 记录失败
+                    logging_service.log_email_event(
+                        db=db,
+                        event_type=f"{event_prefix}file_processing_failed",
+                        message=error_msg,
+                        user_id=config.user_id,
+                        details={
+                            "filename": result.get("filename"),
+                            "task_id": task_id,
+                            "config_id": config.id
+                        },
+                        log_level="ERROR"
+                    )
+
+            except Exception as e:
+                logger.error(f"处理扫描文件失败: {str(e)}")
+                error_count += 1
+                error_msg = f"处理文件异常: {result.get('filename')}, {str(e)}"
+                errors.append(error_msg)
+
+                # 记录异常
+                logging_service.log_email_event(
+                    db=db,
+                    event_type=f"{event_prefix}file_processing_error",
+                    message=error_msg,
+                    user_id=config.user_id,
+                    details={
+                        "filename": result.get("filename"),
+                        "error": str(e),
+                        "task_id": task_id,
+                        "config_id": config.id
+                    },
+                    log_level="ERROR"
+                )
+
+        config_duration = (datetime.now() - config_start_time).total_seconds()
+
+        # 记录扫描结果日志（统计聚合）
+        summary = (
+            f"{config.email_address} - 共处理{processed_count}张，其中"
+            f"{duplicate_count}张重复，{success_count}张成功，{error_count}张失败"
+        )
+        if manual:
+            logging_service.log_email_event(
+                db=db,
+                event_type="manual_scan_config_completed",
+                message=f"手动扫描完成: {summary}",
+                user_id=config.user_id,
+                details={
+                    "task_id": task_id,
+                    "processed_count": processed_count,
+                    "success_count": success_count,
+                    "duplicate_count": duplicate_count,
+                    "error_count": error_count,
+                    "duration": config_duration,
+                    "files": processed_files[:5],  # 只记录前5个文件
+                    "config_id": config.id
+                }
+            )
+        else:
+            logging_service.log_email_event(
+                db=db,
+                event_type="scan_completed",
+                message=f"邮箱扫描完成: {summary}",
+                user_id=config.user_id,
+                details={
+                    "task_id": task_id,
+                    "processed": processed_count,
+                    "success": success_count,
+                    "duplicates": duplicate_count,
+                    "errors": error_count,
+                    "duration": config_duration,
+                    "files": processed_files[:5],  # 只记录前5个文件
+                    "config_id": config.id
+                }
+            )
+            logger.info(f"邮箱扫描完成: {config.email_address}, 处理{processed_count}个文件")
+
+        try:
+            db.commit()
+        except Exception as commit_error:
+            logger.error(f"提交邮箱扫描日志失败: {str(commit_error)}")
+
+        return {
+            "config_id": config.id,
+            "email_address": config.email_address,
+            "processed": processed_count,
+            "success": success_count,
+            "duplicates": duplicate_count,
+            "errors": error_count,
+            "error_messages": errors,
+            "processed_files": processed_files,
+            "duration": config_duration,
+            "incomplete": scan_stats.get("incomplete", False),
+        }
+
+    except Exception as e:
+        email_address = config.email_address if config is not None else None
+        user_id = config.user_id if config is not None else None
+        logger.error(f"扫描邮箱失败: {email_address}, 错误: {str(e)}")
+        try:
+            db.rollback()
+            logging_service.log_email_event(
+                db=db,
+                event_type="manual_scan_config_error" if manual else "scan_failed",
+                message=f"{'手动扫描错误' if manual else '邮箱扫描失败'}: {email_address}",
+                user_id=user_id,
+                details={"task_id": task_id, "error": str(e), "config_id": config_id},
+                log_level="ERROR"
+            )
+            db.commit()
+        except Exception as log_error:
+            logger.error(f"记录邮箱扫描失败日志失败: {str(log_error)}")
+
+        return {
+            "config_id": config_id,
+            "email_address": email_address,
+            "processed": 0,
+            "success": 0,
+            "duplicates": 0,
+            "errors": 1,
+            "error_messages": [str(e)],
+            "processed_files": [],
+            "error": str(e),
+        }
+    finally:
+        db.close()
+
+
+def _scan_configs_concurrently(config_ids: List[int], days: int, task_id: str, manual: bool = False,
+                               deadline: float = None) -> List[dict]:
+    """使用有界线程池并发扫描多个邮箱配置（EMAIL_SCAN_CONCURRENCY），结果顺序与输入一致"""
+    if not config_ids:
+        return []
+    workers = max(1, min(settings.EMAIL_SCAN_CONCURRENCY, len(config_ids)))
+    if workers == 1:
+        return [_scan_single_config(config_id, days, task_id, manual, deadline) for config_id in config_ids]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="email-scan") as executor:
+        return list(executor.map(
+            lambda config_id: _scan_single_config(config_id, days, task_id, manual, deadline), config_ids
+        ))
+
+
+def _scan_deadline() -> float:
+    """本次任务的扫描时间片截止时间（time.monotonic()），须小于任务软超时"""
+    return time.monotonic() + settings.EMAIL_SCAN_SLICE_SECONDS
+
+
+def _enqueue_scan_continuations(scanned: List[dict], days: int, manual: bool = False) -> List[int]:
+    """时间片内未扫完的邮箱配置投递续扫任务，从检查点继续；返回续扫的配置ID"""
+    continued = []
+    for item in scanned:
+        if not item.get("incomplete"):
+            continue
+        try:
+            if settings.EMAIL_SCAN_FANOUT:
+                scan_email_config_task.apply_async(
+                    kwargs={"config_id": item["config_id"], "days": days, "manual": manual}, countdown=1
+                )
+            else:
+                scan_emails_task.apply_async(kwargs={"config_id": item["config_id"], "days": days}, countdown=1)
+            continued.append(item["config_id"])
+        except Exception as e:
+            logger.error(f"投递续扫任务失败: config_id={item['config_id']}, 错误: {e}")
+    if continued:
+        logger.info(f"邮箱扫描未在时间片内完成，已投递续扫: {continued}")
+    return continued
+
+
+def _running_scan_config_ids(configs: List[EmailConfig], config_level: bool = False) -> List[int]:
+    """一次 Redis 往返（pipeline）检查多个配置的扫描锁；config_level 为 True 时同时检查配置级锁"""
+    if not configs:
+        return []
+    try:
+        pipe = get_redis_pipeline()
+        for config in configs:
+            pipe.exists(get_email_scan_lock_key(config.user_id, None))
+            if config_level:
+                pipe.exists(get_email_scan_lock_key(config.user_id, config.id))
+        flags = pipe.execute()
+    except Exception as e:
+        logger.warning(f"检查邮箱扫描锁失败: {e}")
+        return []
+    step = 2 if config_level else 1
+    return [config.id for index, config in enumerate(configs) if any(flags[index * step:(index + 1) * step])]
+
+
+def _scan_lock_timeout() -> int:
+    """扫描锁过期时间：覆盖任务硬超时，进程崩溃后锁也会自动过期"""
+    return settings.EMAIL_SCAN_SOFT_TIME_LIMIT + 120
+
+
+def _summarize_scheduled_scan(db, task_id: str, scanned: List[dict], start_time: datetime,
+                              continued: List[int]) -> dict:
+    """汇总定时扫描各配置的统计并记录系统日志（串行与扇出模式共用）"""
+    config_results = []
+    for item in scanned:
+        entry = {
+            "config_id": item["config_id"],
+            "email_address": item["email_address"],
+            "processed": item["processed"],
+            "success": item["success"],
+            "errors": item["errors"],
+        }
+        if "error" in item:
+            entry["error"] = item["error"]
+        else:
+            entry["duplicates"] = item["duplicates"]
+            entry["duration"] = item["duration"]
+        config_results.append(entry)
+
+    total_processed = sum(item["processed"] for item in scanned)
+    total_success = sum(item["success"] for item in scanned)
+    total_errors = sum(item["errors"] for item in scanned)
+    total_duplicates = sum(item["duplicates"] for item in scanned)
+    
+    total_duration = (datetime.now() - start_time).total_seconds()
+    
+    result_summary = {
+        "status": "completed",
+        "total_processed": total_processed,
+        "total_success": total_success,
+        "total_errors": total_errors,
+        "total_duplicates": total_duplicates,
+        "scanned_configs": len(scanned),
+        "duration": total_duration,
+        "config_results": config_results,
+        "continued_configs": continued
+    }
+    
+    # 记录任务完成（统计聚合）
+    logging_service.log_system_event(
+        db=db,
+        event_type="email_scan_completed",
+        message=(
+            f"定时邮箱扫描任务完成 - 共处理{total_processed}张，其中{total_duplicates}张重复，"
+            f"{total_success}张成功，{total_errors}张失败"
+        ),
+        details={
+            "task_id": task_id,
+            "total_processed": total_processed,
+            "total_success": total_success,
+            "total_errors": total_errors,
+            "total_duplicates": total_duplicates,
+            "duration": total_duration,
+            "scanned_configs": len(scanned)
+        }
+    )
+    
+    # 确保所有日志提交到数据库
+    try:
+        db.commit()
+    except Exception as commit_error:
+        logger.error(f"提交邮箱扫描任务日志失败: {str(commit_error)}")
+    
+    logger.info(f"邮箱扫描任务完成: {result_summary}")
+    return result_summary
+
+
+def _summarize_manual_scan(db, user_id: int, config_id: int, task_id: str, scanned: List[dict],
+                           start_time: datetime) -> dict:
+    """汇总手动扫描各配置的统计并记录日志（串行与扇出模式共用）"""
+    results = []
+    for item in scanned:
+        entry = {
+            "config_id": item["config_id"],
+            "email_address": item["email_address"],
+            "processed_count": item["processed"],
+            "success_count": item["success"],
+            "error_count": item["errors"],
+            "errors": item["error_messages"],
+            "processed_files": item["processed_files"],
+        }
+        if "error" not in item:
+            entry["duplicate_count"] = item["duplicates"]
+            entry["duration"] = item["duration"]
+        results.append(entry)
+    
+    total_duration = (datetime.now() - start_time).total_seconds()
+    total_processed = sum(r["processed_count"] for r in results)
+    total_success = sum(r["success_count"] for r in results)
+    total_errors = sum(r["error_count"] for r in results)
+    total_duplicates = sum(r.get("duplicate_count", 0) for r in results)
+    
+    # 记录任务完成（统计聚合）
+    logging_service.log_email_event(
+        db=db,
+        event_type="manual_scan_completed",
+        message=(
+            f"手动邮箱扫描任务完成 - 共处理{total_processed}张，其中{total_duplicates}张重复，"
+            f"{total_success}张成功，{total_errors}张失败"
+        ),
+        user_id=user_id,
+        details={
+            "task_id": task_id,
+            "total_processed": total_processed,
+            "total_success": total_success,
+            "total_errors": total_errors,
+            "total_duplicates": total_duplicates,
+            "duration": total_duration,
+            "scanned_configs": len(results),
+            "config_id": config_id
+        }
+    )
+    
+    # 确保所有日志提交到数据库
+    try:
+        db.commit()
+    except Exception as commit_error:
+        logger.error(f"提交手动邮箱扫描任务日志失败: {str(commit_error)}")
+    
+    return {
+        "status": "completed",
+        "results": results,
+        "summary": {
+            "total_processed": total_processed,
+            "total_success": total_success,
+            "total_errors": total_errors,
+            "total_duplicates": total_duplicates,
+            "duration": total_duration
+        }
+    }
+
+
+def _dispatch_scan_chord(config_ids: List[int], days: int, task_id: str, start_time: datetime,
+                         manual: bool = False, user_id: int = None, config_id: int = None):
+    """扇出模式：每个配置一个子任务（各自持有配置级锁；手动扫描的用户锁键不同，互不冲突），chord 回调汇总统计与日志"""
+    header = [
+        scan_email_config_task.s(cid, days, task_id=task_id, manual=manual)
+        for cid in config_ids
+    ]
+    callback = aggregate_email_scan_task.s(
+        task_id=task_id, started_at=start_time.isoformat(), days=days,
+        manual=manual, user_id=user_id, config_id=config_id
+    )
+    return chord(header)(callback)
+
+
+@celery_app.task(
+    base=DatabaseTask, bind=True,
+    soft_time_limit=settings.EMAIL_SCAN_SOFT_TIME_LIMIT, time_limit=settings.EMAIL_SCAN_SOFT_TIME_LIMIT + 60
+)
 def scan_emails_task(self, config_id: int = None, days: int = 7):
     """邮箱扫描定时任务"""
     start_time = datetime.now()
     task_id = self.request.id
     
     # 检查是否有邮箱扫描任务正在运行
+    locked_user_id = None
     if config_id:
-        # 单个邮箱配置扫描，检查该配置的锁
+        # 单个邮箱配置扫描（IDLE 触发、续扫）：与扇出子任务一样持有配置级锁，避免同一邮箱被并发扫描
         config = self.db.query(EmailConfig).filter(EmailConfig.id == config_id).first()
         if config:
-            if is_email_scan_running(config.user_id, config_id):
+            if is_email_scan_running(config.user_id, None) or not acquire_email_scan_lock(
+                config.user_id, config_id, timeout=_scan_lock_timeout()
+            ):
                 logger.info(f"邮箱扫描任务已在运行中: config_id={config_id}")
                 return {
                     "status": "skipped", 
                     "message": "扫描任务已在运行中",
                     "duration": 0
                 }
-    else:
-        # 全局扫描，检查是否有任何用户的全局扫描在运行
+            locked_user_id = config.user_id
+    elif not settings.EMAIL_SCAN_FANOUT:
+        # 全局扫描，检查是否有任何用户的全局扫描在运行（一次 pipeline 检查全部配置）
         configs = self.db.query(EmailConfig).filter(EmailConfig.is_active == True).all()
-        running_configs = []
-        for config in configs:
-            if is_email_scan_running(config.user_id):
-                running_configs.append(config.id)
+        running_configs = _running_scan_config_ids(configs)
         
         if running_configs:
             logger.info(f"以下邮箱配置的扫描任务已在运行中: {running_configs}")
@@ -153,9 +565,6 @@ def scan_emails_task(self, config_id: int = None, days: int = 7):
             }
         )
         
-        email_service = EmailService(self.db)
-        invoice_service = InvoiceService(self.db)
-        
         # 获取要扫描的邮箱配置
         if config_id:
             configs = [self.db.query(EmailConfig).filter(
@@ -181,208 +590,38 @@ def scan_emails_task(self, config_id: int = None, days: int = 7):
             
             return {"status": "no_configs", "message": "没有活跃的邮箱配置"}
         
-        total_processed = 0
-        total_success = 0
-        total_errors = 0
-        total_duplicates = 0
-        config_results = []
-        
-        for config in configs:
-            config_start_time = datetime.now()
-            
+        if settings.EMAIL_SCAN_FANOUT and not config_id:
+            # 扇出模式：跳过正在扫描的配置，其余每个配置一个子任务，总耗时随 worker 数扩展
+            running_configs = set(_running_scan_config_ids(configs, config_level=True))
+            config_ids = [config.id for config in configs if config.id not in running_configs]
+            if running_configs:
+                logger.info(f"以下邮箱配置的扫描任务已在运行中，本轮跳过: {sorted(running_configs)}")
+            if not config_ids:
+                return {
+                    "status": "skipped",
+                    "message": f"扫描任务已在运行中: {sorted(running_configs)}",
+                    "duration": 0
+                }
             try:
-                logger.info(f"开始扫描邮箱: {config.email_address}")
-                
-                # 记录开始扫描日志
-                logging_service.log_email_event(
-                    db=self.db,
-                    event_type="scan_started",
-                    message=f"开始扫描邮箱: {config.email_address}",
-                    user_id=config.user_id,
-                    details={"task_id": task_id, "days": days, "config_id": config.id}
-                )
-                
-                # 执行邮箱扫描
-                scan_results = email_service.scan_emails(config, days)
-                
-                processed_count = len(scan_results)
-                FILES_PROCESSED.inc(processed_count)
-                success_count = 0
-                error_count = 0
-                duplicate_count = 0
-                processed_files = []
-                errors = []
-                
-                # 处理扫描结果
-                for result in scan_results:
-                    try:
-                        # 将临时文件移动到正式位置并创建发票记录
-                        # 如果上游或下游已经标记重复，计数后跳过
-                        if result.get("status") == "duplicate":
-                            duplicate_count += 1
-                            EMAIL_DUPLICATES.labels(type="attachment").inc()
-                            continue
-
-                        invoice_result = _process_scanned_file(
-                            config.user_id,
-                            result,
-                            invoice_service
-                        )
-                        
-                        if invoice_result == "DUPLICATE":
-                            duplicate_count += 1
-                            EMAIL_DUPLICATES.labels(type="create_invoice").inc()
-                        elif invoice_result:
-                            success_count += 1
-                            processed_files.append({
-                                "filename": result.get("filename"),
-                                "invoice_id": invoice_result,
-                                "status": "success"
-                            })
-                            EMAILS_INVOICES_FOUND.inc()
-                        else:
-                            error_count += 1
-                            error_msg = f"处理文件失败: {result.get('filename')}"
-                            errors.append(error_msg)
-                            
-                            # 记录失败
-                            logging_service.log_email_event(
-                                db=self.db,
-                                event_type="file_processing_failed",
-                                message=error_msg,
-                                user_id=config.user_id,
-                                details={
-                                    "filename": result.get("filename"),
-                                    "task_id": task_id,
-                                    "config_id": config.id
-                                },
-                                log_level="ERROR"
-                            )
-                            
-                    except Exception as e:
-                        logger.error(f"处理扫描文件失败: {str(e)}")
-                        error_count += 1
-                        error_msg = f"处理文件异常: {result.get('filename')}, {str(e)}"
-                        errors.append(error_msg)
-                        
-                        # 记录异常
-                        logging_service.log_email_event(
-                            db=self.db,
-                            event_type="file_processing_error",
-                            message=error_msg,
-                            user_id=config.user_id,
-                            details={
-                                "filename": result.get("filename"),
-                                "error": str(e),
-                                "task_id": task_id,
-                                "config_id": config.id
-                            },
-                            log_level="ERROR"
-                        )
-                
-                total_processed += processed_count
-                total_success += success_count
-                total_errors += error_count
-                total_duplicates += duplicate_count
-                
-                config_duration = (datetime.now() - config_start_time).total_seconds()
-                
-                # 记录扫描结果日志（统计聚合）
-                logging_service.log_email_event(
-                    db=self.db,
-                    event_type="scan_completed",
-                    message=(
-                        f"邮箱扫描完成: {config.email_address} - 共处理{processed_count}张，其中"
-                        f"{duplicate_count}张重复，{success_count}张成功，{error_count}张失败"
-                    ),
-                    user_id=config.user_id,
-                    details={
-                        "task_id": task_id,
-                        "processed": processed_count,
-                        "success": success_count,
-                        "duplicates": duplicate_count,
-                        "errors": error_count,
-                        "duration": config_duration,
-                        "files": processed_files[:5],  # 只记录前5个文件
-                        "config_id": config.id
-                    }
-                )
-                
-                config_results.append({
-                    "config_id": config.id,
-                    "email_address": config.email_address,
-                    "processed": processed_count,
-                    "success": success_count,
-                    "duplicates": duplicate_count,
-                    "errors": error_count,
-                    "duration": config_duration
-                })
-                
-                logger.info(f"邮箱扫描完成: {config.email_address}, 处理{processed_count}个文件")
-                
-            except Exception as e:
-                logger.error(f"扫描邮箱失败: {config.email_address}, 错误: {str(e)}")
-                total_errors += 1
-                
-                # 记录错误日志
-                logging_service.log_email_event(
-                    db=self.db,
-                    event_type="scan_failed",
-                    message=f"邮箱扫描失败: {config.email_address}",
-                    user_id=config.user_id,
-                    details={"task_id": task_id, "error": str(e), "config_id": config.id},
-                    log_level="ERROR"
-                )
-                
-                config_results.append({
-                    "config_id": config.id,
-                    "email_address": config.email_address,
-                    "processed": 0,
-                    "success": 0,
-                    "errors": 1,
-                    "error": str(e)
-                })
-        
-        total_duration = (datetime.now() - start_time).total_seconds()
-        
-        result_summary = {
-            "status": "completed",
-            "total_processed": total_processed,
-            "total_success": total_success,
-            "total_errors": total_errors,
-            "total_duplicates": total_duplicates,
-            "scanned_configs": len([c for c in configs if c is not None]),
-            "duration": total_duration,
-            "config_results": config_results
-        }
-        
-        # 记录任务完成（统计聚合）
-        logging_service.log_system_event(
-            db=self.db,
-            event_type="email_scan_completed",
-            message=(
-                f"定时邮箱扫描任务完成 - 共处理{total_processed}张，其中{total_duplicates}张重复，"
-                f"{total_success}张成功，{total_errors}张失败"
-            ),
-            details={
-                "task_id": task_id,
-                "total_processed": total_processed,
-                "total_success": total_success,
-                "total_errors": total_errors,
-                "total_duplicates": total_duplicates,
-                "duration": total_duration,
-                "scanned_configs": len([c for c in configs if c is not None])
+                self.db.commit()
+            except Exception as commit_error:
+                logger.error(f"提交邮箱扫描任务日志失败: {str(commit_error)}")
+            result = _dispatch_scan_chord(config_ids, days, task_id, start_time)
+            return {
+                "status": "dispatched",
+                "chord_id": result.id,
+                "dispatched_configs": config_ids,
+                "skipped_configs": sorted(running_configs),
             }
-        )
         
-        # 确保所有日志提交到数据库
-        try:
-            self.db.commit()
-        except Exception as commit_error:
-            logger.error(f"提交邮箱扫描任务日志失败: {str(commit_error)}")
-        
-        logger.info(f"邮箱扫描任务完成: {result_summary}")
-        return result_summary
+        # 多个邮箱配置并发扫描（每个配置独立 IMAP 连接与数据库会话）
+        scanned = _scan_configs_concurrently([config.id for config in configs], days, task_id, deadline=_scan_deadline())
+        if locked_user_id is not None:
+            # 先释放配置级锁再投递续扫，避免续扫任务因锁未释放而被跳过
+            release_email_scan_lock(locked_user_id, config_id)
+            locked_user_id = None
+        continued = _enqueue_scan_continuations(scanned, days)
+        return _summarize_scheduled_scan(self.db, task_id, scanned, start_time, continued)
         
     except Exception as exc:
         total_duration = (datetime.now() - start_time).total_seconds()
@@ -414,16 +653,94 @@ def scan_emails_task(self, config_id: int = None, days: int = 7):
             "message": str(exc),
             "duration": total_duration
         }
+    finally:
+        if locked_user_id is not None:
+            release_email_scan_lock(locked_user_id, config_id)
+
+
+@celery_app.task(
+    bind=True,
+    soft_time_limit=settings.EMAIL_SCAN_SOFT_TIME_LIMIT, time_limit=settings.EMAIL_SCAN_SOFT_TIME_LIMIT + 60
+)
+def scan_email_config_task(self, config_id: int, days: int = 7, task_id: str = None, manual: bool = False) -> dict:
+    """扇出模式的单配置扫描子任务：持有配置级锁扫描一个邮箱，时间片用完时投递续扫。
+    始终返回统计字典（不抛异常），保证 chord 回调能够执行。
+    """
+    task_id = task_id or self.request.id
+    db = SessionLocal()
+    try:
+        config = db.query(EmailConfig).filter(EmailConfig.id == config_id).first()
+        user_id = config.user_id if config is not None else None
+    finally:
+        db.close()
+
+    locked = False
+    if user_id is not None:
+        locked = acquire_email_scan_lock(user_id, config_id, timeout=_scan_lock_timeout())
+        if not locked:
+            return {
+                "config_id": config_id,
+                "email_address": config.email_address,
+                "processed": 0,
+                "success": 0,
+                "duplicates": 0,
+                "errors": 0,
+                "error_messages": [],
+                "processed_files": [],
+                "duration": 0,
+                "skipped": True,
+            }
+    try:
+        item = _scan_single_config(config_id, days, task_id, manual, _scan_deadline())
+    except Exception as e:
+        logger.error(f"扫描邮箱配置子任务异常: config_id={config_id}, 错误: {str(e)}")
+        item = {
+            "config_id": config_id,
+            "email_address": None,
+            "processed": 0,
+            "success": 0,
+            "duplicates": 0,
+            "errors": 1,
+            "error_messages": [str(e)],
+            "processed_files": [],
+            "error": str(e),
+        }
+    finally:
+        if locked:
+            release_email_scan_lock(user_id, config_id)
+    _enqueue_scan_continuations([item], days, manual=manual)
+    return item
 
 
 @celery_app.task(base=DatabaseTask, bind=True)
+def aggregate_email_scan_task(self, scanned: List[dict], task_id: str, started_at: str, days: int = 7,
+                              manual: bool = False, user_id: int = None, config_id: int = None) -> dict:
+    """扇出模式的 chord 回调：汇总各配置统计并记录日志；手动扫描在此释放用户扫描锁"""
+    start_time = datetime.fromisoformat(started_at)
+    try:
+        if manual:
+            return _summarize_manual_scan(self.db, user_id, config_id, task_id, scanned, start_time)
+        continued = [item["config_id"] for item in scanned if item.get("incomplete")]
+        return _summarize_scheduled_scan(self.db, task_id, scanned, start_time, continued)
+    finally:
+        if manual:
+            release_email_scan_lock(user_id, config_id)
+
+
+@celery_app.task(
+    base=DatabaseTask, bind=True,
+    soft_time_limit=settings.EMAIL_SCAN_SOFT_TIME_LIMIT, time_limit=settings.EMAIL_SCAN_SOFT_TIME_LIMIT + 60
+)
 def manual_email_scan_task(self, user_id: int, config_id: int = None, days: int = 7):
     """手动邮箱扫描任务"""
     start_time = datetime.now()
     task_id = self.request.id
+    scanned = []
+    # 扇出模式下用户扫描锁交由 chord 回调释放
+    release_lock = True
     
     # 获取分布式锁
-    if not acquire_email_scan_lock(user_id, config_id):
+    if not acquire_email_scan_lock(user_id, config_id, timeout=_scan_lock_timeout()):
         logger.warning(f"邮箱扫描任务已在运行中: user_id={user_id}, config_id={config_id}")
         return {
             "success": False,
@@ -451,7 +768,6 @@ def manual_email_scan_task(self, user_id: int, config_id: int = None, days: int
                 )
         
         email_service = EmailService(self.db)
-        invoice_service = InvoiceService(self.db)
         
         # 获取用户的邮箱配置
         if config_id:
@@ -479,185 +795,24 @@ def manual_email_scan_task(self, user_id: int, config_id: int = None, days: int
                 "message": "没有找到邮箱配置"
             }
         
-        results = []
-        
-        for config in configs:
-            if config is None:
-                continue
-            
-            config_start_time = datetime.now()
-                
+        config_ids = [config.id for config in configs if config is not None]
+        if settings.EMAIL_SCAN_FANOUT and len(config_ids) > 1:
             try:
-                # 执行扫描
-                scan_results = email_service.scan_emails(config, days)
-                
-                processed_files = []
-                success_count = 0
-                error_count = 0
-                duplicate_count = 0
-                errors = []
-                
-                for result in scan_results:
-                    try:
-                        # 如果上游或下游已经标记重复，计数后跳过
-                        if result.get("status") == "duplicate":
-                            duplicate_count += 1
-                            continue
-
-                        invoice_result = _process_scanned_file(
-                            user_id, result, invoice_service
-                        )
-                        
-                        if invoice_result == "DUPLICATE":
-                            duplicate_count += 1
-                        elif invoice_result:
-                            success_count += 1
-                            processed_files.append({
-                                "filename": result.get("filename"),
-                                "type": result.get("type"),
-                                "status": "success",
-                                "invoice_id": invoice_result
-                            })
-                            
-                        else:
-                            error_count += 1
-                            error_msg = f"处理文件失败: {result.get('filename')}"
-                            errors.append(error_msg)
-                            
-                            # 记录失败
-                            logging_service.log_email_event(
-                                db=self.db,
-                                event_type="manual_file_processing_failed",
-                                message=error_msg,
-                                user_id=user_id,
-                                details={
-                                    "filename": result.get("filename"),
-                                    "task_id": task_id,
-                                    "config_id": config.id
-                                },
-                                log_level="ERROR"
-                            )
-                            
-                    except Exception as e:
-                        error_count += 1
-                        error_msg = f"处理文件异常: {result.get('filename')}, {str(e)}"
-                        errors.append(error_msg)
-                        
-                        # 记录异常
-                        logging_service.log_email_event(
-                    db=self.db,
-                    event_type="manual_file_processing_error",
-                    message=error_msg,
-                    user_id=user_id,
-                    details={
-                                "filename": result.get("filename"),
-                                "error": str(e),
-                                "task_id": task_id
-, "config_id": config.id},
-                    log_level="ERROR"
-                )
-                
-                config_duration = (datetime.now() - config_start_time).total_seconds()
-                
-                # 记录配置的扫描结果（统计聚合）
-                logging_service.log_email_event(
-                    db=self.db,
-                    event_type="manual_scan_config_completed",
-                    message=(
-                        f"手动扫描完成: {config.email_address} - 共处理{len(scan_results)}张，其中"
-                        f"{duplicate_count}张重复，{success_count}张成功，{error_count}张失败"
-                    ),
-                    user_id=user_id,
-                    details={
-                        "task_id": task_id,
-                        "processed_count": len(scan_results),
-                        "success_count": success_count,
-                        "duplicate_count": duplicate_count,
-                        "error_count": error_count,
-                        "duration": config_duration,
-                        "files": processed_files[:5],  # 只记录前5个文件
-                        "config_id": config.id
-                    }
-                )
-                
-                results.append({
-                    "config_id": config.id,
-                    "email_address": config.email_address,
-                    "processed_count": len(scan_results),
-                    "success_count": success_count,
-                    "duplicate_count": duplicate_count,
-                    "error_count": error_count,
-                    "errors": errors,
-                    "processed_files": processed_files,
-                    "duration": config_duration
-                })
-                
-            except Exception as e:
-                error_msg = str(e)
-                results.append({
-                    "config_id": config.id,
-                    "email_address": config.email_address,
-                    "processed_count": 0,
-                    "success_count": 0,
-                    "error_count": 1,
-                    "errors": [error_msg],
-                    "processed_files": []
-                })
-                
-                # 记录配置错误
-                logging_service.log_email_event(
-                    db=self.db,
-                    event_type="manual_scan_config_error",
-                    message=f"手动扫描错误: {config.email_address}",
-                    user_id=user_id,
-                    details={"task_id": task_id, "error": error_msg, "config_id": config.id},
-                    log_level="ERROR"
-                )
-        
-        total_duration = (datetime.now() - start_time).total_seconds()
-        total_processed = sum(r["processed_count"] for r in results)
-        total_success = sum(r["success_count"] for r in results)
-        total_errors = sum(r["error_count"] for r in results)
-        total_duplicates = sum(r.get("duplicate_count", 0) for r in results)
-        
-        # 记录任务完成（统计聚合）
-        logging_service.log_email_event(
-            db=self.db,
-            event_type="manual_scan_completed",
-            message=(
-                f"手动邮箱扫描任务完成 - 共处理{total_processed}张，其中{total_duplicates}张重复，"
-                f"{total_success}张成功，{total_errors}张失败"
-            ),
-            user_id=user_id,
-            details={
-                "task_id": task_id,
-                "total_processed": total_processed,
-                "total_success": total_success,
-                "total_errors": total_errors,
-                "total_duplicates": total_duplicates,
-                "duration": total_duration,
-                "scanned_configs": len(results),
-                "config_id": config_id
+                self.db.commit()
+            except Exception as commit_error:
+                logger.error(f"提交手动邮箱扫描任务日志失败: {str(commit_error)}")
+            result = _dispatch_scan_chord(
+                config_ids, days, task_id, start_time, manual=True, user_id=user_id, config_id=config_id
+            )
+            release_lock = False
+            return {
+                "status": "dispatched",
+                "chord_id": result.id,
+                "dispatched_configs": config_ids,
             }
-        )
-        
-        # 确保所有日志提交到数据库
-        try:
-            self.db.commit()
-        except Exception as commit_error:
-            logger.error(f"提交手动邮箱扫描任务日志失败: {str(commit_error)}")
         
-        return {
-            "status": "completed",
-            "results": results,
-            "summary": {
-                "total_processed": total_processed,
-                "total_success": total_success,
-                "total_errors": total_errors,
-                "total_duplicates": total_duplicates,
-                "duration": total_duration
-            }
-        }
+        scanned = _scan_configs_concurrently(config_ids, days, task_id, manual=True, deadline=_scan_deadline())
+        return _summarize_manual_scan(self.db, user_id, config_id, task_id, scanned, start_time)
         
     except Exception as exc:
         total_duration = (datetime.now() - start_time).total_seconds()
@@ -692,8 +847,11 @@ def manual_email_scan_task(self, user_id: int, config_id: int = None, days: int
             "duration": total_duration
         }
     finally:
-        # 在finally块中释放锁，确保无论成功还是异常都会释放
-        release_email_scan_lock(user_id, config_id)
+        if release_lock:
+            # 在finally块中释放锁，确保无论成功还是异常都会释放
+            release_email_scan_lock(user_id, config_id)
+            # 释放锁之后再投递续扫，避免续扫任务因锁仍存在而跳过
+            _enqueue_scan_continuations(scanned, days, manual=True)
 
 
 def _process_scanned_file(user_id: int, scan_result: dict, invoice_service: InvoiceService) -> str:
@@ -703,7 +861,7 @@ def _process_scanned_file(user_id: int, scan_result: dict, invoice_service: Invo
     import os
     from pathlib import Path
     from app.core.config import settings, get_absolute_file_path, get_relative_file_path
-    from app.workers.ocr_tasks import process_invoice_ocr
+    from app.workers.ocr_tasks import enqueue_invoice_ocr
     from app.services.logging_service import logging_service
     from datetime import datetime
     
@@ -766,27 +924,32 @@ def _process_scanned_file(user_id: int, scan_result: dict, invoice_service: Invo
         filename = scan_result.get("filename", "email_scan.pdf")
         file_extension = Path(filename).suffix or ".pdf"
 
-        upstream_sha256 = scan_result.get("file_sha256_hash")
-        if not upstream_sha256:
-            # 回退计算一次（仅在缺失时）
-            with open(temp_path, 'rb') as _f:
-                import hashlib as _hashlib
-                upstream_sha256 = _hashlib.sha256(_f.read()).hexdigest()
-        new_filename = f"{upstream_sha256}{file_extension}"
-
-        # 最终路径
-        absolute_final_path = upload_dir / new_filename
-        relative_file_path = os.path.join(relative_upload_dir, new_filename)
-
-        # 若目标已存在则删除临时文件，否则移动
-        if absolute_final_path.exists():
-            os.unlink(temp_path)
-            try:
-                EMAIL_DUPLICATES.labels(type="file_store_skip").inc()
-            except Exception:
-                pass
+        if scan_result.get("stored_path"):
+            # 附件在提取时已直接写入内容寻址存储，无需再移动
+            absolute_final_path = Path(temp_path)
+            relative_file_path = scan_result["stored_path"]
         else:
-            shutil.move(temp_path, str(absolute_final_path))
+            upstream_sha256 = scan_result.get("file_sha256_hash")
+            if not upstream_sha256:
+                # 回退计算一次（仅在缺失时）
+                with open(temp_path, 'rb') as _f:
+                    import hashlib as _hashlib
+                    upstream_sha256 = _hashlib.sha256(_f.read()).hexdigest()
+            new_filename = f"{upstream_sha256}{file_extension}"
+
+            # 最终路径
+            absolute_final_path = upload_dir / new_filename
+            relative_file_path = os.path.join(relative_upload_dir, new_filename)
+
+            # 若目标已存在则删除临时文件，否则移动
+            if absolute_final_path.exists():
+                os.unlink(temp_path)
+                try:
+                    EMAIL_DUPLICATES.labels(type="file_store_skip").inc()
+                except Exception:
+                    pass
+            else:
+                shutil.move(temp_path, str(absolute_final_path))
         
         
         # 创建发票记录（启用去重检测，使用相对路径）
@@ -805,8 +968,10 @@ def _process_scanned_file(user_id: int, scan_result: dict, invoice_service: Invo
         )
         
         try:
-            # 创建发票时启用去重检测
-            invoice = invoice_service.create_invoice(user_id, invoice_data, skip_duplicate_check=False)
+            # 扫描阶段已批量判定不重复的文件跳过逐个查询（唯一约束兜底）
+            invoice = invoice_service.create_invoice(
+                user_id, invoice_data, skip_duplicate_check=bool(scan_result.get("dedup_checked"))
+            )
         except ValueError as e:
             # 如果是重复文件错误，记录并返回None
             if "重复" in str(e):
@@ -838,7 +1003,7 @@ def _process_scanned_file(user_id: int, scan_result: dict, invoice_service: Invo
         
         
         # 启动OCR识别任务（传递相对路径，让OCR任务根据运行环境转换）
-        process_invoice_ocr.delay(invoice.id, relative_file_path, user_id)
+        enqueue_invoice_ocr(invoice.id, relative_file_path, user_id)
         
         return invoice.id
         
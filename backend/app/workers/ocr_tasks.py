@@ -1,4 +1,5 @@
 from celery import Task
+from celery.exceptions import Retry
 from app.workers.celery_app import celery_app
 from app.core.database import SessionLocal
 from app.services.invoice_service import InvoiceService
@@ -7,9 +8,17 @@ from app.services.ocr_service import OCRService
 from app.services.logging_service import logging_service
 from app.models.invoice import Invoice
 import logging
+import time
 import traceback
-from datetime import datetime
-# 指标在服务层统一记录，这里不再导入指标
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import and_, or_
+from app.core.config import settings, get_absolute_file_path
+from app.core.metrics import OCR_INVOICES_PROCESSED, OCR_REQUESTS_TOTAL
+from app.services.ocr_engines import get_local_ocr_engine
+from app.services.ocr_payload_store import OCRPayloadMigration, summarize_sizes
+# OCR 请求级指标在服务层统一记录，这里仅记录发票级吞吐
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +38,24 @@ class DatabaseTask(Task):
             self._db.close()
 
 
+def _is_ocr_success(ocr_result: Dict[str, Any]) -> bool:
+    """判断OCR是否成功：有非空words_result且没有error_code，或者error_code为0"""
+    if "words_result" in ocr_result and "error_code" not in ocr_result:
+        # words_result不为空才算成功
+        return bool(ocr_result.get("words_result", {}))
+    return ocr_result.get("error_code") == 0
+
+
+def enqueue_invoice_ocr(invoice_id: str, file_path: str, user_id: int = None):
+    """提交发票OCR识别
+    批量模式下发票保持 ocr_status=pending，由 process_pending_ocr_batch 周期领取；
+    否则为该发票投递独立的 process_invoice_ocr 任务。
+    """
+    if settings.OCR_BATCH_MODE:
+        return None
+    return process_invoice_ocr.delay(invoice_id, file_path, user_id)
+
+
 @celery_app.task(base=DatabaseTask, bind=True, max_retries=3, rate_limit="2/s")
 def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = None):
     """处理发票OCR识别任务"""
@@ -87,23 +114,15 @@ def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = No
         self.db.commit()
         
         # 执行OCR识别
-        ocr_result = ocr_service.recognize_invoice(file_path, user_id=user_id, invoice_id=invoice_id)
+        ocr_result = ocr_service.recognize_invoice(
+            file_path, user_id=user_id, invoice_id=invoice_id, file_sha256=invoice.file_sha256_hash
+        )
         processing_time = (datetime.now() - start_time).total_seconds()
         
-        # 判断OCR是否成功：有words_result且没有error_code，或者error_code为0
-        is_success = False
-        if "words_result" in ocr_result and "error_code" not in ocr_result:
-            # 检查words_result是否为空
-            words_result = ocr_result.get("words_result", {})
-            if words_result:  # words_result不为空才算成功
-                is_success = True
-        elif ocr_result.get("error_code") == 0:
-            # 有error_code但为0也表示成功
-            is_success = True
-        
-        if is_success:
+        if _is_ocr_success(ocr_result):
             # OCR成功
             invoice_service.update_ocr_result(invoice_id, ocr_result, "success")
+            OCR_INVOICES_PROCESSED.labels(mode="task", result="success").inc()
             # 成功不打入库日志，这里仅调试输出
             logger.debug(f"发票OCR识别成功: {invoice_id}")
             
@@ -129,6 +148,9 @@ def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = No
             try:
                 if int(error_code) == 18 and self.request.retries < self.max_retries:
                     backoff_seconds = min(60, (2 ** self.request.retries))  # 1, 2, 4, ... 上限60
+                    # 本地令牌桶给出了精确的排队时间时，按其延后重试
+                    if ocr_result.get("retry_after"):
+                        backoff_seconds = max(1, int(ocr_result["retry_after"]) + 1)
                     logger.warning(f"OCR QPS超限，{backoff_seconds}s后重试: {invoice_id}")
                     # 记录重试日志
                     try:
@@ -148,7 +170,10 @@ def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = No
                         )
                     except Exception:
                         pass
+                    OCR_INVOICES_PROCESSED.labels(mode="task", result="throttled").inc()
                     raise self.retry(countdown=backoff_seconds)
+            except Retry:
+                raise
             except Exception:
                 pass
             invoice_service.update_ocr_result(
@@ -156,6 +181,7 @@ def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = No
                 {"error_message": error_msg}, 
                 "failed"
             )
+            OCR_INVOICES_PROCESSED.labels(mode="task", result="failed").inc()
             logger.error(f"发票OCR识别失败: {invoice_id}, 错误: {error_msg}")
             
             # 记录失败日志
@@ -209,6 +235,9 @@ def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = No
             
             return {"status": "failed", "message": error_msg}
             
+    except Retry:
+        # 限流退避的重试已安排，不再按异常记录与重复重试
+        raise
     except Exception as exc:
         processing_time = (datetime.now() - start_time).total_seconds()
         logger.error(f"发票OCR识别异常: {invoice_id}, 错误: {str(exc)}")
@@ -269,6 +298,7 @@ def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = No
             raise self.retry(countdown=60 * (self.request.retries + 1))
         
         # 标记为失败
+        OCR_INVOICES_PROCESSED.labels(mode="task", result="error").inc()
         try:
             invoice_service = InvoiceService(self.db)
             invoice_service.update_ocr_result(
@@ -305,4 +335,192 @@ def process_invoice_ocr(self, invoice_id: str, file_path: str, user_id: int = No
         except:
             pass
         
-        return {"status": "error", "message": str(exc)}
\ No newline at end of file
+        return {"status": "error", "message": str(exc)}
+
+
+def _claim_pending_invoices(db, limit: int) -> List[Tuple[str, str, int, Optional[str]]]:
+    """领取待识别发票并置为 processing（MySQL 下 SKIP LOCKED，多个调度实例互不重复领取）
+    超过 OCR_BATCH_STALE_SECONDS 仍处于 processing 的发票视为上次批处理中断，重新领取。
+    """
+    stale_before = datetime.now() - timedelta(seconds=settings.OCR_BATCH_STALE_SECONDS)
+    query = db.query(Invoice.id, Invoice.file_path, Invoice.user_id, Invoice.file_sha256_hash).filter(
+        or_(
+            Invoice.ocr_status == "pending",
+            and_(Invoice.ocr_status == "processing", Invoice.updated_at < stale_before),
+        )
+    ).order_by(Invoice.created_at).limit(limit)
+    if db.bind.dialect.name == "mysql":
+        query = query.with_for_update(skip_locked=True)
+
+    rows = query.all()
+    if rows:
+        db.query(Invoice).filter(Invoice.id.in_([row.id for row in rows])).update(
+            {Invoice.ocr_status: "processing", Invoice.updated_at: datetime.now()},
+            synchronize_session=False,
+        )
+    db.commit()
+    return [(row.id, row.file_path, row.user_id, row.file_sha256_hash) for row in rows]
+
+
+def _recognize_claimed_locally(db, claimed: List[Tuple[str, str, int, Optional[str]]]) -> List[Optional[Dict[str, Any]]]:
+    """整批提交本地文本层解析（进程池并行）；本地结果不写入共享结果缓存"""
+    engine = get_local_ocr_engine()
+    if engine is None:
+        return [None] * len(claimed)
+
+    paths = [
+        file_path if os.path.isabs(file_path) else get_absolute_file_path(file_path)
+        for _, file_path, _, _ in claimed
+    ]
+    local_results = engine.recognize_many(paths)
+    for local_result in local_results:
+        if local_result is not None:
+            OCR_REQUESTS_TOTAL.labels(result="local").inc()
+    return local_results
+
+
+def _recognize_claimed_invoice(
+    invoice_id: str, file_path: str, user_id: int, file_sha256: Optional[str]
+) -> Dict[str, Any]:
+    """批处理线程内识别单张发票（每个线程独立会话；OCR客户端、限流器为进程级共享）"""
+    db = SessionLocal()
+    try:
+        # 本地解析已在整批阶段尝试过，这里只走缓存与远程接口
+        return OCRService(db).recognize_invoice(
+            file_path, user_id=user_id, invoice_id=invoice_id, file_sha256=file_sha256, skip_local=True
+        )
+    except Exception as e:
+        logger.error(f"批量OCR识别异常: {invoice_id}, 错误: {str(e)}")
+        return {"error_code": -1, "error_msg": f"OCR处理异常: {str(e)}", "exception": True}
+    finally:
+        db.close()
+
+
+@celery_app.task(base=DatabaseTask, bind=True)
+def process_pending_ocr_batch(self, batch_size: Optional[int] = None):
+    """批量OCR调度任务
+    每次领取一批 pending 发票：先在本地解析进程池中整批提取文本层字段，
+    其余在线程池内完成 缓存查找 -> API 调用，API 调用节奏由共享令牌桶控制在服务商 QPS；结果一次性批量写回。
+    """
+    start = time.monotonic()
+    batch_size = batch_size or settings.OCR_BATCH_SIZE
+    claimed = _claim_pending_invoices(self.db, batch_size)
+    if not claimed:
+        return {"status": "idle", "claimed": 0}
+
+    # 先整批本地解析（CPU 并行），仅未能本地提取的发票进入远程识别（受 QPS 约束）
+    ocr_results = _recognize_claimed_locally(self.db, claimed)
+    remote_indexes = [i for i, result in enumerate(ocr_results) if result is None]
+    if remote_indexes:
+        concurrency = max(1, min(settings.OCR_BATCH_CONCURRENCY, len(remote_indexes)))
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ocr-batch") as executor:
+            remote_results = executor.map(lambda i: _recognize_claimed_invoice(*claimed[i]), remote_indexes)
+            for i, result in zip(remote_indexes, remote_results):
+                ocr_results[i] = result
+
+    results = []
+    throttled_ids = []
+    counts = {"success": 0, "failed": 0, "throttled": 0, "error": 0}
+    for (invoice_id, _, _, _), ocr_result in zip(claimed, ocr_results):
+        if _is_ocr_success(ocr_result):
+            results.append((invoice_id, ocr_result, "success"))
+            counts["success"] += 1
+        elif str(ocr_result.get("error_code")) == "18":
+            # 限流：放回待处理队列，由下一轮调度领取
+            throttled_ids.append(invoice_id)
+            counts["throttled"] += 1
+        else:
+            results.append((invoice_id, {"error_message": ocr_result.get("error_msg", "OCR识别失败")}, "failed"))
+            counts["error" if ocr_result.get("exception") else "failed"] += 1
+
+    InvoiceService(self.db).bulk_update_ocr_results(results)
+    if throttled_ids:
+        self.db.query(Invoice).filter(Invoice.id.in_(throttled_ids)).update(
+            {Invoice.ocr_status: "pending"}, synchronize_session=False
+        )
+        self.db.commit()
+
+    for result, count in counts.items():
+        if count:
+            OCR_INVOICES_PROCESSED.labels(mode="batch", result=result).inc(count)
+
+    duration = time.monotonic() - start
+    throughput = round(len(claimed) / duration, 3) if duration > 0 else None
+    summary = {
+        "status": "completed",
+        "claimed": len(claimed),
+        **counts,
+        "duration": round(duration, 3),
+        "throughput": throughput,  # 张/秒，可与逐张任务模式的 ocr_invoices_processed_total 速率对比
+    }
+    logger.info(f"批量OCR完成: {summary}")
+
+    if counts["failed"] or counts["error"]:
+        try:
+            logging_service.log_ocr_event(
+                db=self.db,
+                event_type="ocr_batch_partial_failed",
+                message=f"批量OCR部分失败: 失败 {counts['failed'] + counts['error']}/{len(claimed)}",
+                details={**summary, "task_id": self.request.id},
+                log_level="WARNING",
+            )
+        except Exception:
+            pass
+
+    # 队列仍有积压时立即续跑，而不是等待下一个调度周期
+    if len(claimed) >= batch_size and not throttled_ids:
+        process_pending_ocr_batch.delay(batch_size)
+
+    return summary
+
+
+# 迁移阶段及各阶段主键起点（invoices 主键为字符串）
+_PAYLOAD_MIGRATION_PHASES = (("invoices", ""), ("ocr_cache", 0), ("logs", 0))
+
+
+@celery_app.task(base=DatabaseTask, bind=True)
+def migrate_ocr_payloads(self, state: Optional[Dict[str, Any]] = None):
+    """后台迁移：把行内 OCR 结果迁入 ocr_payloads，完成后重建表回收空间并记录前后对比。
+    按时间片分批推进，到期后携带进度重新投递自身；首个时间片先记录迁移前的表大小与列表查询耗时。
+    手动触发：celery -A app.workers.celery_app call app.workers.ocr_tasks.migrate_ocr_payloads
+    """
+    migration = OCRPayloadMigration(self.db)
+    if state is None:
+        state = {"phase": 0, "last_id": None, "counts": {}, "baseline": migration.measure()}
+    deadline = time.monotonic() + settings.OCR_PAYLOAD_MIGRATION_SLICE_SECONDS
+    batch = settings.OCR_PAYLOAD_MIGRATION_BATCH
+
+    while state["phase"] < len(_PAYLOAD_MIGRATION_PHASES):
+        name, start_id = _PAYLOAD_MIGRATION_PHASES[state["phase"]]
+        after_id = state["last_id"] if state["last_id"] is not None else start_id
+        last_id, count = getattr(migration, f"migrate_{name}")(after_id, batch)
+        state["counts"][name] = state["counts"].get(name, 0) + count
+        if last_id is None:
+            state["phase"] += 1
+            state["last_id"] = None
+        else:
+            state["last_id"] = last_id
+        if time.monotonic() >= deadline and state["phase"] < len(_PAYLOAD_MIGRATION_PHASES):
+            migrate_ocr_payloads.apply_async(args=[state], countdown=1)
+            return {"status": "continued", "phase": _PAYLOAD_MIGRATION_PHASES[state["phase"]][0],
+                    "counts": state["counts"]}
+
+    migration.reclaim_space()
+    after = migration.measure()
+    baseline = state.get("baseline") or {}
+    details = {
+        "counts": state["counts"],
+        "tables": summarize_sizes(baseline, after),
+        "list_query_ms": {"before": baseline.get("list_query_ms"), "after": after.get("list_query_ms")},
+    }
+    logger.info(f"OCR结果迁移完成: {details}")
+    try:
+        logging_service.log_system_event(
+            db=self.db,
+            event_type="ocr_payload_migration",
+            message=f"OCR结果迁移完成: {sum(state['counts'].values())} 条",
+            details=details,
+        )
+    except Exception:
+        pass
+    return {"status": "completed", **details}
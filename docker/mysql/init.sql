@@ -6,6 +6,8 @@
 SET NAMES utf8mb4 COLLATE utf8mb4_unicode_ci;
 SET FOREIGN_KEY_CHECKS = 0;
 SET sql_mode = 'STRICT_TRANS_TABLES,ERROR_FOR_DIVISION_BY_ZERO,NO_ENGINE_SUBSTITUTION';
+-- ngram 全文索引不使用停用词表（默认英文停用词会让含 a、i 等字母的 2 字词元失效）
+SET SESSION innodb_ft_enable_stopword = OFF;
 
 -- 设置数据库字符集
 ALTER DATABASE invoice_system CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
@@ -103,9 +105,16 @@ CREATE TABLE IF NOT EXISTS `invoices` (
     KEY `idx_invoice_user_date` (`user_id`, `invoice_date`),
     KEY `idx_invoices_user_code_num` (`user_id`, `invoice_code`, `invoice_num`),
     KEY `idx_invoices_user_ocr_status` (`user_id`, `ocr_status`),
+    KEY `idx_invoices_ocr_status_created` (`ocr_status`, `created_at`),
+    KEY `idx_invoices_user_status_created_id` (`user_id`, `status`, `created_at`, `id`),
+    KEY `idx_invoices_user_created_id` (`user_id`, `created_at`, `id`),
     KEY `idx_invoices_user_file_size` (`user_id`, `file_size`),
     KEY `idx_invoice_seller_name` (`seller_name`(50)),
     
+    -- 名称模糊检索 (ngram 全文索引)
+    FULLTEXT KEY `ft_invoices_seller_name` (`seller_name`) WITH PARSER ngram,
+    FULLTEXT KEY `ft_invoices_purchaser_name` (`purchaser_name`) WITH PARSER ngram,
+    
     -- 哈希去重索引/约束 (高性能文件去重)
     KEY `idx_invoices_md5_hash` (`file_md5_hash`),
     KEY `idx_invoices_sha256_hash` (`file_sha256_hash`),
@@ -165,6 +174,7 @@ CREATE TABLE IF NOT EXISTS `email_configs` (
     `scan_days` INT(11) DEFAULT 7,
     `last_seen_uid` BIGINT DEFAULT NULL,
     `uid_validity` BIGINT DEFAULT NULL,
+    `scan_folders` JSON DEFAULT NULL,
     
     -- 时间戳
     `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -230,6 +240,10 @@ CREATE TABLE IF NOT EXISTS `emails` (
     KEY `idx_emails_user_processing_status` (`user_id`, `processing_status`),
     KEY `idx_emails_user_date` (`user_id`, `date_sent`),
     
+    -- 发件人/主题模糊检索 (ngram 全文索引)
+    FULLTEXT KEY `ft_emails_sender` (`sender`) WITH PARSER ngram,
+    FULLTEXT KEY `ft_emails_subject` (`subject`) WITH PARSER ngram,
+    
     -- 唯一约束：同一用户下的邮件message_id唯一
     UNIQUE KEY `unique_user_message` (`user_id`, `message_id`),
     
@@ -252,6 +266,74 @@ CREATE TABLE IF NOT EXISTS `ocr_cache` (
     KEY `idx_ocr_cache_sha256` (`sha256`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- =============================================================================
+-- 6.5.1. 创建 OCR 原始数据存储表（按文件 sha256，压缩 JSON）
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS `ocr_payloads` (
+    `sha256` VARCHAR(64) NOT NULL,
+    `codec` VARCHAR(10) NOT NULL,
+    `payload` MEDIUMBLOB NOT NULL,
+    `raw_size` INT(11) DEFAULT NULL,
+    `stored_size` INT(11) DEFAULT NULL,
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+    `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (`sha256`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =============================================================================
+-- 6.5.2. 创建发票筛选项字典表（按用户的销售方/购买方/服务类型取值与发票数）
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS `invoice_facets` (
+    `id` INT(11) NOT NULL AUTO_INCREMENT,
+    `user_id` INT(11) NOT NULL,
+    `facet` VARCHAR(20) NOT NULL,
+    `value` VARCHAR(200) NOT NULL,
+    `count` INT(11) NOT NULL DEFAULT 0,
+    `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (`id`),
+    UNIQUE KEY `uq_invoice_facets_user_facet_value` (`user_id`, `facet`, `value`),
+    CONSTRAINT `fk_invoice_facets_user_id` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =============================================================================
+-- 6.6. 创建下载链接指纹缓存表
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS `link_cache` (
+    `id` INT(11) NOT NULL AUTO_INCREMENT,
+    `url_hash` VARCHAR(64) NOT NULL,
+    `url` TEXT NOT NULL,
+    `sha256` VARCHAR(64) NOT NULL,
+    `file_md5_hash` VARCHAR(32) DEFAULT NULL,
+    `file_size` INT(11) DEFAULT NULL,
+    `stored_path` VARCHAR(500) DEFAULT NULL,
+    `filename` VARCHAR(255) DEFAULT NULL,
+    `etag` VARCHAR(255) DEFAULT NULL,
+    `last_modified` VARCHAR(64) DEFAULT NULL,
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+    `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (`id`),
+    UNIQUE KEY `uq_link_cache_url_hash` (`url_hash`),
+    KEY `ix_link_cache_sha256` (`sha256`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =============================================================================
+-- 6.7. 创建邮箱扫描检查点表
+-- =============================================================================
+CREATE TABLE IF NOT EXISTS `email_scan_cursors` (
+    `id` INT(11) NOT NULL AUTO_INCREMENT,
+    `config_id` INT(11) NOT NULL,
+    `folder` VARCHAR(255) NOT NULL DEFAULT 'INBOX',
+    `uid_validity` BIGINT DEFAULT NULL,
+    `last_seen_uid` BIGINT DEFAULT NULL,
+    `last_committed_uid` BIGINT DEFAULT NULL,
+    `last_scan_time` DATETIME DEFAULT NULL,
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+    `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (`id`),
+    UNIQUE KEY `uq_email_scan_cursor_config_folder` (`config_id`, `folder`),
+    CONSTRAINT `fk_email_scan_cursors_config_id` FOREIGN KEY (`config_id`) REFERENCES `email_configs` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- =============================================================================
 -- 6. 创建系统日志表 (监控和审计)
 -- =============================================================================
@@ -288,6 +370,9 @@ CREATE TABLE IF NOT EXISTS `system_logs` (
     KEY `idx_logs_user_type_created` (`user_id`, `log_type`, `created_at`),
     KEY `idx_logs_resource` (`resource_type`, `resource_id`),
     
+    -- 日志关键词检索 (ngram 全文索引)
+    FULLTEXT KEY `ft_system_logs_search` (`message`, `resource_id`) WITH PARSER ngram,
+    
     -- 外键约束
     CONSTRAINT `fk_system_logs_user_id` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -312,8 +397,8 @@ VALUES (
         'version', '1.1.0',
         'init_date', NOW(),
         'deployment_type', 'docker-compose',
-        'tables_created', JSON_ARRAY('users', 'invoices', 'attachments', 'email_configs', 'emails', 'ocr_cache', 'system_logs'),
-        'features', JSON_ARRAY('发票管理', '邮件处理', '去重检测', '系统日志', 'OCR处理', 'OCR缓存', 'IMAP UID 增量扫描')
+        'tables_created', JSON_ARRAY('users', 'invoices', 'attachments', 'email_configs', 'emails', 'ocr_cache', 'ocr_payloads', 'invoice_facets', 'link_cache', 'email_scan_cursors', 'system_logs'),
+        'features', JSON_ARRAY('发票管理', '邮件处理', '去重检测', '系统日志', 'OCR处理', 'OCR缓存', 'IMAP UID 增量扫描', '多文件夹扫描', '全文检索', '筛选项计数')
     ),
     'initialization'
 );
\ No newline at end of file
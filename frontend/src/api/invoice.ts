@@ -57,6 +57,11 @@ export const getInvoiceFilterOptions = () => {
     sellers: string[]
     purchasers: string[]
     service_types: string[]
+    counts?: {
+      sellers: Record<string, number>
+      purchasers: Record<string, number>
+      service_types: Record<string, number>
+    }
   }>('/invoices/filters/options')
 }
 
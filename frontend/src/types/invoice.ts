@@ -69,6 +69,8 @@ export interface InvoiceListResponse {
   page: number
   size: number
   pages: number
+  // 键集分页：传回 cursor 获取下一页，没有更多数据时为 null
+  next_cursor?: string | null
 }
 
 export interface InvoiceUploadResponse {